@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for the digest pipeline stages.
+
+Run from the digest/ directory, e.g. `python -m benchmarks.chunking_benchmark`.
+"""
@@ -0,0 +1,187 @@
+"""
+Chunking Token-Accounting Benchmark
+===================================
+
+Times the chunk + token-count stages of the digest pipeline on a large
+markdown corpus, before and after encode-once token accounting:
+
+    legacy    chunker.chunk_md as it was (one encode per line, the heading
+              stack re-encoded at every flush), then the uploader encoding
+              every chunk again to enforce max_tokens
+    current   chunker.chunk_md (one batched encode of the distinct lines),
+              one batched encode of the chunks stored in the chunk JSON and
+              reused by the uploader
+
+Also reports how many documents are split exactly as before: the heading
+stack is now counted from its line counts, which can move a chunk boundary
+by a token or two.
+
+Usage (from the digest/ directory):
+    python -m benchmarks.chunking_benchmark
+    python -m benchmarks.chunking_benchmark --docs 2000 --sections 40 --repeat 3
+    python -m benchmarks.chunking_benchmark --input data/my_collection/md --output bench/chunking.json
+"""
+
+import argparse
+import json
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+# The digest CLI uses a flat directory structure without a formal Python package.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from chunker import chunk_md, clean_markdown, count_tokens, count_tokens_batch
+
+IGNORE_PATTERN = r"<!-- Page\s+\d+\s+End -->"
+
+WORDS = (
+    "béton armé fondation chantier coffrage ferraillage dalle poutre poteau charge "
+    "résistance norme sécurité échafaudage maçonnerie enduit isolation thermique "
+    "acoustique étanchéité toiture charpente menuiserie plomberie électricité "
+    "ventilation réglementation contrôle réception ouvrage maître d'œuvre "
+    "entreprise devis planning coût délai qualité environnement déchets"
+).split()
+
+
+def legacy_chunk_md(md_text: str, min_tokens: int = 200, ignore_pattern: str = None) -> List[str]:
+    """Previous chunker.chunk_md implementation, kept for comparison."""
+    md_text = clean_markdown(md_text)
+    lines = md_text.splitlines()
+    titles_stack = ["" for _ in range(10)]
+    chunks = []
+    current_chunk = []
+    current_chunk_tokens = 0
+
+    for line in lines:
+        if ignore_pattern and re.match(ignore_pattern, line):
+            continue
+
+        line_stripped = line.strip()
+        number_of_hashes = len(line_stripped) - len(line_stripped.lstrip('#'))
+
+        if number_of_hashes > 0:
+            for i in range(number_of_hashes - 1, 10):
+                titles_stack[i] = ""
+            titles_stack[number_of_hashes - 1] = line_stripped
+
+            if current_chunk_tokens >= min_tokens:
+                chunk_text = "\n".join(current_chunk)
+                chunks.append(chunk_text)
+                current_chunk = [t for t in titles_stack if t]
+                current_chunk_tokens = count_tokens("\n".join(current_chunk))
+            else:
+                current_chunk.append(line_stripped)
+                current_chunk_tokens += count_tokens(line_stripped)
+        else:
+            current_chunk.append(line_stripped)
+            current_chunk_tokens += count_tokens(line_stripped)
+
+    if current_chunk and not current_chunk[-1].startswith('#'):
+        chunk_text = "\n".join(current_chunk)
+        chunks.append(chunk_text)
+
+    return chunks
+
+
+def synthetic_document(sections: int, rng: random.Random) -> str:
+    """Markdown shaped like a converted PDF: nested headings, paragraphs, page markers."""
+    lines = [f"# {' '.join(rng.choices(WORDS, k=4)).capitalize()}", ""]
+    page = 1
+    for s in range(sections):
+        level = rng.choice([2, 2, 3, 3, 4])
+        lines.append(f"{'#' * level} {s + 1}. {' '.join(rng.choices(WORDS, k=rng.randint(2, 6))).capitalize()}")
+        lines.append("")
+        for _ in range(rng.randint(1, 5)):
+            lines.append(" ".join(rng.choices(WORDS, k=rng.randint(20, 90))).capitalize() + ".")
+            lines.append("")
+        if rng.random() < 0.3:
+            lines.append(f"<!-- Page {page} End -->")
+            page += 1
+    return "\n".join(lines)
+
+
+def load_corpus(args) -> List[str]:
+    if args.input:
+        paths = sorted(Path(args.input).rglob("*.md"))
+        return [p.read_text(encoding="utf-8") for p in paths]
+    rng = random.Random(args.seed)
+    return [synthetic_document(args.sections, rng) for _ in range(args.docs)]
+
+
+def run_legacy(docs: List[str], min_tokens: int) -> List[List[str]]:
+    results = []
+    for md in docs:
+        chunks = legacy_chunk_md(md, min_tokens=min_tokens, ignore_pattern=IGNORE_PATTERN)
+        # Uploader: one encode per chunk to enforce max_tokens
+        [count_tokens(c) for c in chunks]
+        results.append(chunks)
+    return results
+
+
+def run_current(docs: List[str], min_tokens: int) -> List[List[str]]:
+    results = []
+    for md in docs:
+        chunks = chunk_md(md, min_tokens=min_tokens, ignore_pattern=IGNORE_PATTERN)
+        # Stored as "chunk_tokens", reused by the uploader
+        count_tokens_batch(chunks)
+        results.append(chunks)
+    return results
+
+
+def _time(func, docs, min_tokens, repeat: int):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(docs, min_tokens)
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark chunk token accounting")
+    parser.add_argument("--input", help="Directory of .md files (default: synthetic corpus)")
+    parser.add_argument("--docs", type=int, default=500, help="Synthetic documents")
+    parser.add_argument("--sections", type=int, default=30, help="Sections per synthetic document")
+    parser.add_argument("--min-tokens", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    docs = load_corpus(args)
+    total_chars = sum(len(d) for d in docs)
+    count_tokens("warm up")  # Load the encoding outside of the timings
+
+    legacy_times, legacy_chunks = _time(run_legacy, docs, args.min_tokens, args.repeat)
+    current_times, current_chunks = _time(run_current, docs, args.min_tokens, args.repeat)
+
+    same_docs = sum(1 for a, b in zip(legacy_chunks, current_chunks) if a == b)
+    results: Dict = {
+        "docs": len(docs),
+        "chars": total_chars,
+        "chunks": sum(len(c) for c in current_chunks),
+        "legacy_s": round(statistics.median(legacy_times), 3),
+        "current_s": round(statistics.median(current_times), 3),
+        "speedup": round(statistics.median(legacy_times) / max(statistics.median(current_times), 1e-9), 2),
+        "identical_docs": same_docs,
+    }
+
+    print(f"docs={results['docs']} chars={total_chars} chunks={results['chunks']} repeat={args.repeat}")
+    print(f"{'legacy':>8} {results['legacy_s']:>8.3f} s")
+    print(f"{'current':>8} {results['current_s']:>8.3f} s   x{results['speedup']}")
+    print(f"identical chunking: {same_docs}/{len(docs)} documents")
+
+    if args.output:
+        out = Path(args.output)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
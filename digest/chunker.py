@@ -2,31 +2,185 @@
 Markdown heading-based chunker.
 Refactored from chunker/md_hashtag_chunker.py.
 No BTP-specific metadata loading — metadata is passed in as a parameter.
+
+Token counts are computed once: line counts with one batched encode of the
+distinct lines of a document, chunk counts with one batched encode of its
+chunks. The chunk counts are stored in the chunk JSON ("chunk_tokens",
+parallel to "chunks") so the uploader does not tokenize again.
+
+Size-bounded mode (chunk_files with max_tokens): heading sections of
+max_tokens tokens or more are split into pieces that each repeat the heading
+lines, cutting at paragraph, then line, then sentence, then token boundaries,
+with a small overlap between consecutive pieces. Every chunk then fits the
+embedding limit instead of being dropped at upload.
+
+chunk_files can spread files over a process pool (workers > 1); results keep
+the sorted file order either way. Chunk files are written compact, as
+`<hash>.json`, `<hash>.jsonl` (a header line with the metadata, then one
+line per chunk) or `<hash>.msgpack` (needs the optional msgpack package);
+read_chunk_file() loads any of them.
 """
 
 import os
 import re
 import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 import tiktoken
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Chunk file formats, by file suffix
+OUTPUT_FORMATS = {"json": ".json", "jsonl": ".jsonl", "msgpack": ".msgpack"}
+CHUNK_FILE_SUFFIXES = tuple(OUTPUT_FORMATS.values())
+
 
-# Module-level tokenizer (lazy-initialized)
-_enc = None
+# Module-level tokenizers (lazy-initialized), by encoding name
+_encoders = {}
 
 
 def _get_encoder(encoding: str = "o200k_base"):
-    global _enc
-    if _enc is None:
-        _enc = tiktoken.get_encoding(encoding)
-    return _enc
+    if encoding not in _encoders:
+        _encoders[encoding] = tiktoken.get_encoding(encoding)
+    return _encoders[encoding]
 
 
 def count_tokens(text: str, encoding: str = "o200k_base") -> int:
     return len(_get_encoder(encoding).encode(text))
 
 
+def count_tokens_batch(texts: list[str], encoding: str = "o200k_base") -> list[int]:
+    """Token counts of several texts in one batched (multi-threaded) encode."""
+    if not texts:
+        return []
+    return [len(tokens) for tokens in _get_encoder(encoding).encode_ordinary_batch(texts)]
+
+
+# Boundaries tried in order when splitting an oversized section
+_SPLIT_LEVELS = ("paragraph", "line", "sentence")
+_SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+
+
+def _split_units(text: str, level: str) -> tuple[list[str], str]:
+    """Units of `text` at a split level, and the separator to rejoin them."""
+    if level == "paragraph":
+        return [u.strip("\n") for u in re.split(r'\n\s*\n', text) if u.strip()], "\n\n"
+    if level == "line":
+        return [u for u in text.split("\n") if u.strip()], "\n"
+    return [u for u in _SENTENCE_END.split(text) if u.strip()], " "
+
+
+def _token_windows(text: str, budget: int, overlap_tokens: int, encoding: str) -> list[str]:
+    enc = _get_encoder(encoding)
+    tokens = enc.encode_ordinary(text)
+    step = max(1, budget - overlap_tokens)
+    return [enc.decode(tokens[i:i + budget]) for i in range(0, max(1, len(tokens) - overlap_tokens), step)]
+
+
+def _split_text(text: str, budget: int, overlap_tokens: int, encoding: str, level: int = 0) -> list[str]:
+    """Split `text` into pieces of about `budget` tokens at the coarsest possible boundary."""
+    if level == len(_SPLIT_LEVELS):
+        return _token_windows(text, budget, overlap_tokens, encoding)
+
+    units, joiner = _split_units(text, _SPLIT_LEVELS[level])
+    if len(units) <= 1:
+        return _split_text(text, budget, overlap_tokens, encoding, level + 1)
+
+    # Units still over budget are split at the next boundary
+    sized = []
+    for unit, tokens in zip(units, count_tokens_batch(units, encoding)):
+        if tokens > budget:
+            subunits = _split_text(unit, budget, overlap_tokens, encoding, level + 1)
+            sized.extend(zip(subunits, count_tokens_batch(subunits, encoding)))
+        else:
+            sized.append((unit, tokens))
+
+    # Greedy packing (about one token per joiner), carrying the last units of a
+    # piece over to the next one up to overlap_tokens
+    pieces = []
+    current, size = [], 0
+    for unit, tokens in sized:
+        if current and size + 1 + tokens > budget:
+            pieces.append(joiner.join(u for u, _ in current))
+            carry, carried = [], 0
+            for u, t in reversed(current):
+                if carried + t > overlap_tokens:
+                    break
+                carry.insert(0, (u, t))
+                carried += t + 1
+            if carried + tokens > budget:
+                carry, carried = [], 0
+            current, size = carry, carried
+        size += tokens + (1 if current else 0)
+        current.append((unit, tokens))
+    if current:
+        pieces.append(joiner.join(u for u, _ in current))
+    return pieces
+
+
+def split_oversized(
+    chunk_text: str,
+    max_tokens: int,
+    overlap_tokens: int = 0,
+    encoding: str = "o200k_base",
+) -> tuple[list[str], list[int]]:
+    """
+    Split a chunk into pieces of fewer than max_tokens tokens.
+
+    Every piece starts with the chunk's leading heading lines, so it keeps its
+    context in the index. Returns the pieces and their exact token counts.
+    """
+    lines = chunk_text.split("\n")
+    n = 0
+    while n < len(lines) and (lines[n].startswith("#") or not lines[n].strip()):
+        n += 1
+    heading = "\n".join(line for line in lines[:n] if line.strip())
+    body = "\n".join(lines[n:])
+    heading_tokens = count_tokens(heading, encoding) + 1 if heading else 0
+    if heading_tokens > max_tokens // 2:
+        # Pathological heading stack: split the whole chunk instead
+        heading, body, heading_tokens = "", chunk_text, 0
+
+    budget = max_tokens - 1 - heading_tokens
+    overlap_tokens = min(overlap_tokens, budget // 4)
+    # The packing estimate can be a little off: tighten the budget until it fits
+    for _ in range(5):
+        pieces = _split_text(body, budget, overlap_tokens, encoding)
+        if heading:
+            pieces = [f"{heading}\n{piece}" for piece in pieces]
+        counts = count_tokens_batch(pieces, encoding)
+        if all(c < max_tokens for c in counts):
+            return pieces, counts
+        budget = int(budget * 0.9)
+
+    pieces = _token_windows(chunk_text, max_tokens - 1, overlap_tokens, encoding)
+    return pieces, count_tokens_batch(pieces, encoding)
+
+
+def bound_chunks(
+    chunks: list[str],
+    chunk_tokens: list[int],
+    max_tokens: int,
+    overlap_tokens: int = 0,
+    encoding: str = "o200k_base",
+) -> tuple[list[str], list[int]]:
+    """Replace the chunks of max_tokens tokens or more by their split pieces."""
+    bounded, bounded_tokens = [], []
+    for text, tokens in zip(chunks, chunk_tokens):
+        if tokens < max_tokens:
+            bounded.append(text)
+            bounded_tokens.append(tokens)
+        else:
+            pieces, counts = split_oversized(text, max_tokens, overlap_tokens, encoding)
+            bounded.extend(pieces)
+            bounded_tokens.extend(counts)
+    return bounded, bounded_tokens
+
+
 def clean_markdown(md: str) -> str:
     """Remove images, convert hyperlinks to text, tp.demain-specific cleaning."""
     # Remove images: ![alt](link)
@@ -60,7 +214,12 @@ def clean_markdown(md: str) -> str:
     return md
 
 
-def chunk_md(md_text: str, min_tokens: int = 200, ignore_pattern: str = None) -> list[str]:
+def chunk_md(
+    md_text: str,
+    min_tokens: int = 200,
+    ignore_pattern: str = None,
+    encoding: str = "o200k_base",
+) -> list[str]:
     """
     Split markdown text into chunks based on heading hierarchy.
 
@@ -68,22 +227,28 @@ def chunk_md(md_text: str, min_tokens: int = 200, ignore_pattern: str = None) ->
         md_text: Raw markdown text.
         min_tokens: Minimum tokens before a heading triggers a new chunk.
         ignore_pattern: Regex pattern for lines to skip (e.g. page markers).
+        encoding: Tiktoken encoding name.
 
     Returns:
         List of chunk strings.
     """
     md_text = clean_markdown(md_text)
-    lines = md_text.splitlines()
+    ignore_re = re.compile(ignore_pattern) if ignore_pattern else None
+    lines = [
+        line.strip() for line in md_text.splitlines()
+        if not (ignore_re and ignore_re.match(line))
+    ]
+
+    # Each distinct line is encoded once (blank lines, repeated headers...)
+    distinct = list(dict.fromkeys(lines))
+    line_tokens = dict(zip(distinct, count_tokens_batch(distinct, encoding)))
+
     titles_stack = ["" for _ in range(10)]
     chunks = []
     current_chunk = []
     current_chunk_tokens = 0
 
-    for line in lines:
-        if ignore_pattern and re.match(ignore_pattern, line):
-            continue
-
-        line_stripped = line.strip()
+    for line_stripped in lines:
         number_of_hashes = len(line_stripped) - len(line_stripped.lstrip('#'))
 
         if number_of_hashes > 0:
@@ -95,13 +260,14 @@ def chunk_md(md_text: str, min_tokens: int = 200, ignore_pattern: str = None) ->
                 chunk_text = "\n".join(current_chunk)
                 chunks.append(chunk_text)
                 current_chunk = [t for t in titles_stack if t]
-                current_chunk_tokens = count_tokens("\n".join(current_chunk))
+                # Headings were counted as lines; one token per joining newline
+                current_chunk_tokens = sum(line_tokens[t] for t in current_chunk) + len(current_chunk) - 1
             else:
                 current_chunk.append(line_stripped)
-                current_chunk_tokens += count_tokens(line_stripped)
+                current_chunk_tokens += line_tokens[line_stripped]
         else:
             current_chunk.append(line_stripped)
-            current_chunk_tokens += count_tokens(line_stripped)
+            current_chunk_tokens += line_tokens[line_stripped]
 
     # Flush last chunk if it has non-heading content
     if current_chunk and not current_chunk[-1].startswith('#'):
@@ -111,6 +277,83 @@ def chunk_md(md_text: str, min_tokens: int = 200, ignore_pattern: str = None) ->
     return chunks
 
 
+def write_chunk_file(chunks_dir: Path, file_hash: str, output: dict, output_format: str = "json") -> Path:
+    """Write a chunk file (compact), replacing any copy of it in another format."""
+    output_path = chunks_dir / f"{file_hash}{OUTPUT_FORMATS[output_format]}"
+
+    if output_format == "msgpack":
+        with open(output_path, "wb") as out_file:
+            msgpack.pack(output, out_file, use_bin_type=True)
+    elif output_format == "jsonl":
+        header = {k: v for k, v in output.items() if k not in ("chunks", "chunk_tokens")}
+        with open(output_path, "w", encoding="utf-8") as out_file:
+            out_file.write(json.dumps(header, ensure_ascii=False, separators=(",", ":")) + "\n")
+            for text, tokens in zip(output["chunks"], output["chunk_tokens"]):
+                line = {"text": text, "tokens": tokens}
+                out_file.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+    else:
+        with open(output_path, "w", encoding="utf-8") as out_file:
+            json.dump(output, out_file, ensure_ascii=False, separators=(",", ":"))
+
+    for suffix in CHUNK_FILE_SUFFIXES:
+        other = chunks_dir / f"{file_hash}{suffix}"
+        if other != output_path and other.exists():
+            other.unlink()
+    return output_path
+
+
+def read_chunk_file(path: Path) -> dict:
+    """Load a chunk file of any format as {"metadata", "chunks", "chunk_tokens", ...}."""
+    path = Path(path)
+    if path.suffix == ".msgpack":
+        if msgpack is None:
+            raise ImportError("msgpack is required to read .msgpack chunk files")
+        with open(path, "rb") as f:
+            return msgpack.unpack(f, raw=False)
+    if path.suffix == ".jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.loads(f.readline())
+            lines = [json.loads(line) for line in f if line.strip()]
+        data["chunks"] = [line["text"] for line in lines]
+        data["chunk_tokens"] = [line["tokens"] for line in lines]
+        return data
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _chunk_one(task: tuple) -> tuple[str, str, str]:
+    """
+    Chunk and write one markdown file (runs in a worker process).
+    Returns (hash, output path or None, error or None).
+    """
+    (file_hash, md_file, chunks_dir, metadata, min_tokens, ignore_pattern,
+     tokenizer_encoding, max_tokens, overlap_tokens, output_format) = task
+    try:
+        with open(md_file, "r", encoding="utf-8") as f:
+            md_text = f.read()
+
+        chunks = chunk_md(md_text, min_tokens=min_tokens, ignore_pattern=ignore_pattern,
+                          encoding=tokenizer_encoding)
+
+        chunk_tokens = count_tokens_batch(chunks, tokenizer_encoding)
+        if max_tokens:
+            chunks, chunk_tokens = bound_chunks(
+                chunks, chunk_tokens, max_tokens, overlap_tokens, tokenizer_encoding
+            )
+
+        output = {
+            "metadata": metadata,
+            "chunks": chunks,
+            "chunk_tokens": chunk_tokens,
+            "tokenizer_encoding": tokenizer_encoding,
+        }
+        output_path = write_chunk_file(Path(chunks_dir), file_hash, output, output_format)
+        return file_hash, str(output_path), None
+
+    except Exception as e:
+        return file_hash, None, f"Failed to chunk {md_file}: {e}"
+
+
 def chunk_files(
     md_dir: str,
     chunks_dir: str,
@@ -118,31 +361,46 @@ def chunk_files(
     min_tokens: int = 200,
     ignore_pattern: str = None,
     file_hashes: set[str] = None,
+    tokenizer_encoding: str = "o200k_base",
+    max_tokens: int = None,
+    overlap_tokens: int = 0,
+    workers: int = 1,
+    output_format: str = "json",
 ) -> dict[str, str]:
     """
     Batch-chunk markdown files in md_dir.
 
     Args:
         md_dir: Directory containing <hash>/<hash>.md files.
-        chunks_dir: Output directory for JSON chunk files.
+        chunks_dir: Output directory for chunk files.
         metadata_map: Dict keyed by hash -> metadata object.
         min_tokens: Minimum tokens per chunk.
         ignore_pattern: Regex pattern for lines to skip.
         file_hashes: If given, only process these file hashes.
                      If None, process all files in md_dir.
+        tokenizer_encoding: Tiktoken encoding of the stored token counts.
+        max_tokens: If given, split chunks of this many tokens or more
+                    (size-bounded mode).
+        overlap_tokens: Tokens shared by consecutive pieces of a split chunk.
+        workers: Worker processes (1 = chunk in this process, 0 = one per CPU).
+        output_format: "json", "jsonl" or "msgpack".
 
     Returns:
-        Dict of {hash: output_json_path} for successfully chunked files.
+        Dict of {hash: output_path} for successfully chunked files, in hash order.
     """
     md_dir = Path(md_dir)
     chunks_dir = Path(chunks_dir)
     chunks_dir.mkdir(parents=True, exist_ok=True)
 
-    results = {}
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown chunk output format '{output_format}' (expected one of {list(OUTPUT_FORMATS)})")
+    if output_format == "msgpack" and msgpack is None:
+        print("[WARNING] msgpack not installed; writing JSON chunk files instead")
+        output_format = "json"
 
     # Find markdown files: <hash>/<hash>.md
     md_files = []
-    for subdir in md_dir.iterdir():
+    for subdir in sorted(md_dir.iterdir()):
         if subdir.is_dir():
             if file_hashes is not None and subdir.name not in file_hashes:
                 continue
@@ -150,25 +408,26 @@ def chunk_files(
             if md_file.exists():
                 md_files.append((subdir.name, md_file))
 
-    for file_hash, md_file in tqdm(md_files, desc="Chunking"):
-        try:
-            with open(md_file, "r", encoding="utf-8") as f:
-                md_text = f.read()
-
-            chunks = chunk_md(md_text, min_tokens=min_tokens, ignore_pattern=ignore_pattern)
-
-            # Get metadata for this file (or empty dict)
-            metadata = metadata_map.get(file_hash, {})
-
-            output = {"metadata": metadata, "chunks": chunks}
-
-            output_path = chunks_dir / f"{file_hash}.json"
-            with open(output_path, "w", encoding="utf-8") as out_file:
-                json.dump(output, out_file, ensure_ascii=False, indent=4)
-
-            results[file_hash] = str(output_path)
-
-        except Exception as e:
-            print(f"[ERROR] Failed to chunk {md_file}: {e}")
+    tasks = [
+        (file_hash, str(md_file), str(chunks_dir), metadata_map.get(file_hash, {}), min_tokens,
+         ignore_pattern, tokenizer_encoding, max_tokens, overlap_tokens, output_format)
+        for file_hash, md_file in md_files
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(tasks)) or 1
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map() yields in task order, whatever the completion order
+            outcomes = list(tqdm(pool.map(_chunk_one, tasks, chunksize=4),
+                                 total=len(tasks), desc=f"Chunking ({workers} workers)"))
+    else:
+        outcomes = [_chunk_one(task) for task in tqdm(tasks, desc="Chunking")]
 
+    results = {}
+    for file_hash, output_path, error in outcomes:
+        if error:
+            print(f"[ERROR] {error}")
+        else:
+            results[file_hash] = output_path
     return results
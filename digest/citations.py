@@ -0,0 +1,42 @@
+"""
+Ingest-time citation resolution.
+Uses the resolver shared with the server (shared/url_resolver.py) so the
+citation stored in the Qdrant payload matches what the server would compute.
+"""
+
+import sys
+from pathlib import Path
+
+from qdrant_client import QdrantClient
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+REPO_ROOT = SCRIPT_DIR.parent
+
+sys.path.insert(0, str(REPO_ROOT))
+from shared.url_resolver import CitationResolver, backfill_citations as _backfill  # noqa: E402
+
+# Mapping maintained for the server (overridable with [citations] global_hashes)
+DEFAULT_HASHES_PATH = REPO_ROOT / "server" / "rag_engine" / "global_hashes.json"
+
+
+def load_resolver(config) -> CitationResolver:
+    """Build a resolver from [citations] global_hashes (relative to the digest dir)."""
+    hashes_path = config.get("citations", "global_hashes", fallback=str(DEFAULT_HASHES_PATH))
+    path = Path(hashes_path)
+    if not path.is_absolute():
+        path = SCRIPT_DIR / path
+    resolver = CitationResolver(path)
+    print(f"  Citation mapping: {resolver.size} entries from {path}")
+    return resolver
+
+
+def backfill_citations(qdrant_url: str, collection_name: str, resolver: CitationResolver,
+                       scroll_size: int = 2000) -> int:
+    """
+    Write (or refresh) the 'citation' payload field of every point.
+
+    Returns:
+        Number of points updated.
+    """
+    client = QdrantClient(url=qdrant_url)
+    return _backfill(client, collection_name, resolver, scroll_size=scroll_size)
@@ -3,8 +3,9 @@ Digest CLI — Create & Update RAG Collections.
 
 Usage:
     python digest.py create <name> <input_dir> [--mistral-key KEY]
-    python digest.py update <name> <input_dir> [--mistral-key KEY]
+    python digest.py update <name> <input_dir> [--mistral-key KEY] [--prune]
     python digest.py rebuild-manifest <name>
+    python digest.py backfill-citations <name>
     python digest.py list
 """
 
@@ -27,10 +28,14 @@ def main():
     p_create.add_argument("--mistral-key", help="Mistral API key (required if input contains PDFs)")
 
     # --- update ---
-    p_update = subparsers.add_parser("update", help="Add new files to an existing collection")
+    p_update = subparsers.add_parser("update", help="Add new and modified files to an existing collection")
     p_update.add_argument("name", help="Collection name")
     p_update.add_argument("input_dir", help="Directory containing input files")
     p_update.add_argument("--mistral-key", help="Mistral API key (required if input contains PDFs)")
+    p_update.add_argument(
+        "--prune", action="store_true",
+        help="Also remove from the collection the files that are no longer in input_dir",
+    )
 
     # --- rebuild-manifest ---
     p_rebuild = subparsers.add_parser(
@@ -39,6 +44,13 @@ def main():
     )
     p_rebuild.add_argument("name", help="Collection name")
 
+    # --- backfill-citations ---
+    p_backfill = subparsers.add_parser(
+        "backfill-citations",
+        help="Store resolved citation URLs/titles in the payload of existing points",
+    )
+    p_backfill.add_argument("name", help="Collection name")
+
     # --- list ---
     subparsers.add_parser("list", help="List all registered collections")
 
@@ -56,7 +68,10 @@ def main():
     # Import pipeline here (after config is loaded) to allow the script
     # to be invoked from any working directory.
     sys.path.insert(0, str(script_dir))
-    from pipeline import create_collection, update_collection, rebuild_manifest, list_collections
+    from pipeline import (
+        create_collection, update_collection, rebuild_manifest,
+        backfill_collection_citations, list_collections,
+    )
 
     if args.command == "create":
         input_dir = Path(args.input_dir)
@@ -70,11 +85,15 @@ def main():
         if not input_dir.is_dir():
             print(f"Error: '{args.input_dir}' is not a directory")
             sys.exit(1)
-        update_collection(args.name, str(input_dir), config, mistral_key=args.mistral_key)
+        update_collection(args.name, str(input_dir), config, mistral_key=args.mistral_key,
+                          prune=args.prune)
 
     elif args.command == "rebuild-manifest":
         rebuild_manifest(args.name, config)
 
+    elif args.command == "backfill-citations":
+        backfill_collection_citations(args.name, config)
+
     elif args.command == "list":
         list_collections(config)
 
@@ -2,6 +2,7 @@
 Elasticsearch BM25 indexer for lemmatized chunks.
 Refactored from chunker/make_bm25_idx.py.
 Parameterized by index name; supports incremental add for UPDATE mode.
+Documents are stored under their point id, so indexing is idempotent.
 """
 
 import os
@@ -67,7 +68,8 @@ def index_lemmas(es_url: str, index_name: str, lemmas_dir: str):
             doc_id = data["id"]
             text = data["lemma"]
 
-            es.index(index=index_name, document={"doc_id": doc_id, "text": text})
+            # Point id as ES id: re-indexing a chunk replaces it
+            es.index(index=index_name, id=doc_id, document={"doc_id": doc_id, "text": text})
         except Exception as e:
             print(f"[ERROR] Failed to index {f.name}: {e}")
 
@@ -105,8 +107,27 @@ def add_lemmas(es_url: str, index_name: str, lemmas_dir: str, doc_ids: list[str]
             doc_id = data["id"]
             text = data["lemma"]
 
-            es.index(index=index_name, document={"doc_id": doc_id, "text": text})
+            # Point id as ES id: re-indexing a chunk replaces it
+            es.index(index=index_name, id=doc_id, document={"doc_id": doc_id, "text": text})
         except Exception as e:
             print(f"[ERROR] Failed to index {f.name}: {e}")
 
     print(f"Added {len(files)} documents to '{index_name}'.")
+
+
+def delete_docs(es_url: str, index_name: str, doc_ids: list[str], batch_size: int = 1000):
+    """
+    Delete the documents of these point IDs from an Elasticsearch index.
+    Matches on the doc_id field, so documents indexed before they were stored
+    under their point id are deleted too.
+    """
+    es = Elasticsearch(es_url)
+    deleted = 0
+    for i in range(0, len(doc_ids), batch_size):
+        response = es.delete_by_query(
+            index=index_name,
+            query={"terms": {"doc_id": doc_ids[i : i + batch_size]}},
+            refresh=True,
+        )
+        deleted += response.get("deleted", 0)
+    print(f"Deleted {deleted} documents from '{index_name}'.")
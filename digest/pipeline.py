@@ -12,10 +12,11 @@ from pathlib import Path
 
 from pdf_converter import convert_pdfs
 from html_converter import convert_htmls
-from chunker import chunk_files
-from uploader import ensure_collection, upload_chunks
+from chunker import CHUNK_FILE_SUFFIXES, chunk_files
+from uploader import ensure_collection, upload_chunks, fetch_vectors, delete_points
 from lemmatizer import lemmatize_points
-from indexer import create_index, index_lemmas, add_lemmas
+from indexer import create_index, index_lemmas, add_lemmas, delete_docs
+from citations import load_resolver, backfill_citations
 
 
 # ---------------------------------------------------------------------------
@@ -44,6 +45,20 @@ def _md_dir(name: str) -> Path:
     return _data_dir(name) / "markdown"
 
 
+def _chunking_options(config) -> dict:
+    """chunk_files arguments from the [chunking] config section."""
+    options = {
+        "tokenizer_encoding": config["chunking"]["tokenizer_encoding"],
+        "workers": config.getint("chunking", "workers", fallback=1),
+        "output_format": config.get("chunking", "output_format", fallback="json"),
+    }
+    # Size-bounded mode
+    if config.getboolean("chunking", "split_oversized", fallback=True):
+        options["max_tokens"] = config.getint("chunking", "max_tokens")
+        options["overlap_tokens"] = config.getint("chunking", "overlap_tokens", fallback=50)
+    return options
+
+
 def _chunks_dir(name: str) -> Path:
     return _data_dir(name) / "chunks"
 
@@ -93,18 +108,18 @@ def _save_manifest(manifest: dict, name: str):
         json.dump(manifest, f, ensure_ascii=False, indent=2)
 
 
-def _copy_to_fileserver(files: dict):
+def _copy_to_fileserver(files: dict, overwrite: bool = False):
     """
     Copy original source files (PDF/HTML) to the fileserver storage directory.
     Files are named as <hash>.<ext> so the fileserver can serve them via
-    GET /download/<hash>.
+    GET /download/<hash>. Existing copies are kept unless `overwrite`.
     """
     FILESERVER_DIR.mkdir(parents=True, exist_ok=True)
     copied = 0
     for file_hash, info in files.items():
         src = Path(info["path"])
         dest = FILESERVER_DIR / f"{file_hash}{src.suffix.lower()}"
-        if not dest.exists():
+        if overwrite or not dest.exists():
             shutil.copy2(str(src), str(dest))
             copied += 1
     print(f"  Copied {copied} source files to fileserver storage")
@@ -294,13 +309,14 @@ def create_collection(name: str, input_dir: str, config, mistral_key: str = None
     chunk_results = chunk_files(
         str(md_dir), str(chunks_dir), metadata_map,
         min_tokens=min_tokens, ignore_pattern=ignore_pattern,
+        **_chunking_options(config),
     )
 
     # 6. Create Qdrant collection + upload
     print(f"\n[6/9] Uploading to Qdrant collection '{qdrant_col}'")
     vector_dim = config.getint("qdrant", "vector_dim")
     ensure_collection(qdrant_url, qdrant_col, vector_dim)
-    point_ids = upload_chunks(
+    point_ids_by_file, failed_files = upload_chunks(
         qdrant_url=qdrant_url,
         collection_name=qdrant_col,
         chunks_dir=str(chunks_dir),
@@ -311,7 +327,9 @@ def create_collection(name: str, input_dir: str, config, mistral_key: str = None
         embedding_workers=config.getint("qdrant", "embedding_workers"),
         max_tokens=config.getint("chunking", "max_tokens"),
         tokenizer_encoding=config["chunking"]["tokenizer_encoding"],
+        citation_resolver=load_resolver(config),
     )
+    point_ids = [pid for ids in point_ids_by_file.values() for pid in ids]
 
     # 7. Lemmatize
     print(f"\n[7/9] Lemmatizing chunks")
@@ -337,12 +355,9 @@ def create_collection(name: str, input_dir: str, config, mistral_key: str = None
     collections[name] = {"qdrant_collection": qdrant_col, "es_index": es_idx}
     _save_collections(collections)
 
-    # Save manifest
+    # Save manifest (files not fully uploaded are left out: 'update' retries them as new)
     manifest = _new_manifest(name)
-    # Build file entries from chunk results + point_ids
-    # We need to map point_ids back to files — for simplicity, store all point_ids
-    # grouped by the chunk file they came from
-    _build_manifest_from_chunks(manifest, files, chunks_dir, point_ids)
+    _build_manifest_from_chunks(manifest, files, _complete(point_ids_by_file, failed_files))
     _save_manifest(manifest, name)
 
     print(f"\nCollection '{name}' created successfully!")
@@ -350,49 +365,26 @@ def create_collection(name: str, input_dir: str, config, mistral_key: str = None
     print(f"  ES:     {es_idx}")
     print(f"  Files:  {len(files)}")
     print(f"  Points: {len(point_ids)}")
+    if failed_files:
+        print(f"  [WARN] {len(failed_files)} files not fully uploaded; run 'update' to retry them")
 
 
-def _build_manifest_from_chunks(manifest: dict, files: dict, chunks_dir, all_point_ids: list[str]):
-    """
-    Build manifest file entries by reading chunk files to count chunks,
-    and distributing point_ids across files proportionally.
+def _complete(point_ids_by_file: dict[str, list[str]], failed_files: set[str]) -> dict[str, list[str]]:
+    """Point IDs of the files upload_chunks fully uploaded."""
+    return {h: ids for h, ids in point_ids_by_file.items() if h not in failed_files}
+
 
-    Since upload_chunks processes files sequentially and returns point_ids in order,
-    we can map them back by counting valid chunks per file.
+def _build_manifest_from_chunks(manifest: dict, files: dict, point_ids_by_file: dict[str, list[str]]):
+    """
+    Build manifest file entries from the point IDs created for each file
+    (as returned by upload_chunks).
     Only processes files whose hash is present in the `files` dict.
     """
-    chunks_dir = Path(chunks_dir)
-
-    # Read chunk files in the same order as upload_chunks would process them
-    # Only include files that are in the `files` dict (filters out old files during UPDATE)
-    json_files = sorted([
-        f for f in chunks_dir.iterdir()
-        if f.suffix == ".json" and f.stem in files
-    ])
-
-    idx = 0  # pointer into all_point_ids
-    for json_file in json_files:
-        file_hash = json_file.stem
+    for file_hash, file_point_ids in point_ids_by_file.items():
+        if file_hash not in files:
+            continue
         try:
-            with open(json_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            chunks = data["chunks"]
-            # Count valid chunks (matching the filter logic in uploader.py)
-            valid_count = 0
-            for text in chunks:
-                if not text.strip():
-                    continue
-                # We don't re-count tokens here; just count non-empty chunks
-                # as an approximation. The exact mapping isn't critical for the manifest.
-                valid_count += 1
-
-            # Slice point_ids for this file
-            file_point_ids = all_point_ids[idx : idx + valid_count]
-            idx += valid_count
-
-            # Build manifest entry
-            file_info = files.get(file_hash, {})
+            file_info = files[file_hash]
             manifest["files"][file_hash] = {
                 "original_name": file_info.get("original_name", f"{file_hash}.unknown"),
                 "file_type": file_info.get("file_type", "unknown"),
@@ -402,17 +394,59 @@ def _build_manifest_from_chunks(manifest: dict, files: dict, chunks_dir, all_poi
                 "point_ids": file_point_ids,
             }
         except Exception as e:
-            print(f"[WARN] Could not build manifest entry for {json_file.name}: {e}")
+            print(f"[WARN] Could not build manifest entry for {file_hash}: {e}")
 
 
 # ---------------------------------------------------------------------------
 # UPDATE
 # ---------------------------------------------------------------------------
 
-def update_collection(name: str, input_dir: str, config, mistral_key: str = None):
+def _diff_input_files(manifest: dict, all_files: dict, prune: bool) -> tuple[dict, dict, list[str], int]:
+    """
+    Compare scanned files with the manifest.
+
+    Returns (new files, changed files, removed file hashes, unknown count).
+    A file is changed when its content hash differs from the manifest's.
+    Manifest entries without a content hash (rebuilt from Qdrant) cannot be
+    compared: their hash is recorded and they count as unchanged. Removed
+    files are only reported with `prune` (the input directory may hold only
+    a subset of the collection).
+    """
+    known = manifest.get("files", {})
+    new_files, changed_files, unknown = {}, {}, 0
+    for file_hash, info in all_files.items():
+        if file_hash not in known:
+            new_files[file_hash] = info
+            continue
+        content_hash = _file_content_hash(info["path"])
+        if not known[file_hash].get("content_hash"):
+            known[file_hash]["content_hash"] = content_hash
+            unknown += 1
+        elif known[file_hash]["content_hash"] != content_hash:
+            changed_files[file_hash] = info
+    removed = sorted(h for h in known if h not in all_files) if prune else []
+    return new_files, changed_files, removed, unknown
+
+
+def _remove_points(qdrant_url: str, qdrant_col: str, es_url: str, es_idx: str, lemmas_dir: Path,
+                   point_ids: list[str]):
+    """Delete points from Qdrant and Elasticsearch in bulk, with their lemma files."""
+    if not point_ids:
+        return
+    delete_points(qdrant_url, qdrant_col, point_ids)
+    delete_docs(es_url, es_idx, point_ids)
+    for point_id in point_ids:
+        (lemmas_dir / f"{point_id}.json").unlink(missing_ok=True)
+
+
+def update_collection(name: str, input_dir: str, config, mistral_key: str = None, prune: bool = False):
     """
-    Add new files to an existing collection.
-    Loads manifest, identifies new files, runs pipeline for new files only.
+    Add new and modified files to an existing collection.
+    Loads manifest, compares content hashes, runs pipeline for new and
+    changed files only. For a changed file, chunks whose text is unchanged
+    keep (or reuse) their vectors, and its obsolete points are deleted.
+    With `prune`, files of the manifest missing from input_dir are removed
+    from the collection.
     """
     valid_ext = set(config["processing"]["valid_extensions"].split(","))
     qdrant_url = config["qdrant"]["url"]
@@ -439,20 +473,6 @@ def update_collection(name: str, input_dir: str, config, mistral_key: str = None
         if manifest is None:
             manifest = _new_manifest(name)
 
-    # Scan input files
-    print(f"\n[1/6] Scanning input files in {input_dir}")
-    all_files = scan_input_files(input_dir, valid_ext)
-
-    # Identify new files (not in manifest by content hash)
-    existing_hashes = set(manifest.get("files", {}).keys())
-    new_files = {h: info for h, info in all_files.items() if h not in existing_hashes}
-
-    if not new_files:
-        print("No new files to process. Everything is up to date.")
-        return
-
-    print(f"  Found {len(new_files)} new files (out of {len(all_files)} total)")
-
     # Prepare dirs
     md_dir = _md_dir(name)
     chunks_dir = _chunks_dir(name)
@@ -460,16 +480,50 @@ def update_collection(name: str, input_dir: str, config, mistral_key: str = None
     for d in [md_dir, chunks_dir, lemmas_dir]:
         d.mkdir(parents=True, exist_ok=True)
 
-    # 2. Copy new source files to fileserver storage
+    # 1. Scan input files and diff them against the manifest
+    print(f"\n[1/7] Scanning input files in {input_dir}")
+    all_files = scan_input_files(input_dir, valid_ext)
+    new_files, changed_files, removed, unknown = _diff_input_files(manifest, all_files, prune)
+
+    print(f"  {len(new_files)} new, {len(changed_files)} changed, {len(removed)} removed "
+          f"(out of {len(all_files)} scanned)")
+    if unknown:
+        print(f"  [WARN] {unknown} manifest entries had no content hash; recorded as unchanged")
+
+    if removed:
+        print(f"  Removing {len(removed)} files no longer in {input_dir}")
+        removed_ids = [pid for h in removed for pid in manifest["files"][h].get("point_ids", [])]
+        _remove_points(qdrant_url, qdrant_col, es_url, es_idx, lemmas_dir, removed_ids)
+        for file_hash in removed:
+            for suffix in CHUNK_FILE_SUFFIXES:
+                (chunks_dir / f"{file_hash}{suffix}").unlink(missing_ok=True)
+            del manifest["files"][file_hash]
+
+    to_process = {**new_files, **changed_files}
+    if not to_process:
+        manifest["updated_at"] = datetime.now().isoformat()
+        _save_manifest(manifest, name)
+        print("No new or changed files to process. Everything is up to date.")
+        return
+
+    # Previous points of the changed files
+    old_ids = {h: manifest["files"][h].get("point_ids", []) for h in changed_files}
+    old_id_set = {pid for ids in old_ids.values() for pid in ids}
+
+    # 2. Copy new source files to fileserver storage (changed ones replace
+    # their old copy once their new version is fully uploaded)
     print(f"\n[2/7] Copying new source files to fileserver")
     _copy_to_fileserver(new_files)
 
-    # 3. Convert new files
-    print(f"\n[3/7] Converting new files to markdown")
+    # 3. Convert files (changed ones are converted again)
+    print(f"\n[3/7] Converting files to markdown")
+    for file_hash in changed_files:
+        shutil.rmtree(md_dir / file_hash, ignore_errors=True)
+
     pdf_paths = []
     html_paths = []
 
-    for file_hash, info in new_files.items():
+    for file_hash, info in to_process.items():
         if "md_override" in info:
             dest_dir = md_dir / file_hash
             dest_dir.mkdir(parents=True, exist_ok=True)
@@ -492,25 +546,27 @@ def update_collection(name: str, input_dir: str, config, mistral_key: str = None
         print(f"  Converting {len(html_paths)} HTML files...")
         convert_htmls(html_paths, str(md_dir))
 
-    # 4. Chunk only new files
-    print(f"\n[4/7] Chunking new markdown files")
-    metadata_map = _load_metadata(input_dir, new_files)
+    # 4. Chunk only new and changed files
+    print(f"\n[4/7] Chunking new and changed markdown files")
+    metadata_map = _load_metadata(input_dir, to_process)
     min_tokens = config.getint("chunking", "min_tokens")
     ignore_pattern = config["processing"]["ignore_pattern"]
 
-    # Only chunk new files — create a temp chunks dir for new files
+    # Chunk into a temp chunks dir, moved over the main one at the end
     new_chunks_dir = _data_dir(name) / "chunks_new"
     new_chunks_dir.mkdir(parents=True, exist_ok=True)
 
     chunk_results = chunk_files(
         str(md_dir), str(new_chunks_dir), metadata_map,
         min_tokens=min_tokens, ignore_pattern=ignore_pattern,
-        file_hashes=set(new_files.keys()),
+        file_hashes=set(to_process.keys()),
+        **_chunking_options(config),
     )
 
-    # 5. Upload new chunks to existing Qdrant collection
-    print(f"\n[5/7] Uploading new chunks to '{qdrant_col}'")
-    point_ids = upload_chunks(
+    # 5. Upload: unchanged chunks keep their point (same id), moved ones reuse their vector
+    print(f"\n[5/7] Uploading new and changed chunks to '{qdrant_col}'")
+    known_vectors = fetch_vectors(qdrant_url, qdrant_col, list(old_id_set)) if old_id_set else {}
+    point_ids_by_file, failed_files = upload_chunks(
         qdrant_url=qdrant_url,
         collection_name=qdrant_col,
         chunks_dir=str(new_chunks_dir),
@@ -521,28 +577,55 @@ def update_collection(name: str, input_dir: str, config, mistral_key: str = None
         embedding_workers=config.getint("qdrant", "embedding_workers"),
         max_tokens=config.getint("chunking", "max_tokens"),
         tokenizer_encoding=config["chunking"]["tokenizer_encoding"],
+        citation_resolver=load_resolver(config),
+        known_vectors=known_vectors,
     )
-
-    # 6. Lemmatize new chunks
-    print(f"\n[6/7] Lemmatizing new chunks")
+    # Files that failed to convert, chunk or upload keep their manifest entry
+    # (or get none) and their old points: the next update retries them
+    completed = _complete(point_ids_by_file, failed_files)
+    incomplete = sorted(h for h in to_process if h not in completed)
+    if incomplete:
+        print(f"  [WARN] {len(incomplete)} files not fully processed, kept as they were: "
+              f"{', '.join(incomplete)}")
+
+    point_ids = [pid for ids in completed.values() for pid in ids]
+    added_ids = [pid for pid in point_ids if pid not in old_id_set]
+
+    # Points of the completed changed files that are not part of their new version
+    kept = set(point_ids)
+    obsolete_ids = [pid for h, ids in old_ids.items() if h in completed for pid in ids if pid not in kept]
+    if obsolete_ids:
+        print(f"  Removing {len(obsolete_ids)} obsolete points of changed files")
+        _remove_points(qdrant_url, qdrant_col, es_url, es_idx, lemmas_dir, obsolete_ids)
+    _copy_to_fileserver({h: info for h, info in changed_files.items() if h in completed}, overwrite=True)
+
+    # 6. Lemmatize added chunks
+    print(f"\n[6/7] Lemmatizing {len(added_ids)} added chunks")
     spacy_model = config["spacy"]["model"]
     new_lemmas_dir = _data_dir(name) / "lemmas_new"
     new_lemmas_dir.mkdir(parents=True, exist_ok=True)
 
-    lemmatize_points(
-        qdrant_url=qdrant_url,
-        collection_name=qdrant_col,
-        output_dir=str(new_lemmas_dir),
-        point_ids=point_ids,
-        spacy_model=spacy_model,
-    )
+    if added_ids:
+        lemmatize_points(
+            qdrant_url=qdrant_url,
+            collection_name=qdrant_col,
+            output_dir=str(new_lemmas_dir),
+            point_ids=added_ids,
+            spacy_model=spacy_model,
+        )
 
     # 7. Add new lemmas to existing ES index
     print(f"\n[7/7] Adding new lemmas to ES index '{es_idx}'")
-    add_lemmas(es_url, es_idx, str(new_lemmas_dir), doc_ids=point_ids)
+    if added_ids:
+        add_lemmas(es_url, es_idx, str(new_lemmas_dir), doc_ids=added_ids)
 
-    # Move new chunks/lemmas to main dirs
+    # Move new chunks/lemmas to main dirs (a changed file's chunk file replaces the old one)
     for f in new_chunks_dir.iterdir():
+        if f.stem not in completed:
+            f.unlink()
+            continue
+        for suffix in CHUNK_FILE_SUFFIXES:
+            (chunks_dir / f"{f.stem}{suffix}").unlink(missing_ok=True)
         shutil.move(str(f), str(chunks_dir / f.name))
     new_chunks_dir.rmdir()
 
@@ -550,14 +633,19 @@ def update_collection(name: str, input_dir: str, config, mistral_key: str = None
         shutil.move(str(f), str(lemmas_dir / f.name))
     new_lemmas_dir.rmdir()
 
-    # Update manifest
-    _build_manifest_from_chunks(manifest, new_files, chunks_dir, point_ids)
+    # Update manifest (entries of completed changed files are replaced)
+    _build_manifest_from_chunks(manifest, to_process, completed)
     manifest["updated_at"] = datetime.now().isoformat()
     _save_manifest(manifest, name)
 
     print(f"\nCollection '{name}' updated successfully!")
-    print(f"  New files:  {len(new_files)}")
-    print(f"  New points: {len(point_ids)}")
+    print(f"  New files:       {len(new_files)}")
+    print(f"  Changed files:   {len(changed_files)}")
+    print(f"  Removed files:   {len(removed)}")
+    print(f"  Added points:    {len(added_ids)}")
+    print(f"  Deleted points:  {len(obsolete_ids)}")
+    if incomplete:
+        print(f"  Incomplete:      {len(incomplete)} (retried by the next update)")
 
 
 # ---------------------------------------------------------------------------
@@ -568,7 +656,9 @@ def rebuild_manifest(name: str, config):
     """
     Rebuild manifest from an existing Qdrant collection.
     Scrolls the collection, groups points by hash in payload.
-    Enables 'update' on legacy collections.
+    Enables 'update' on legacy collections. Points uploaded with
+    deterministic ids carry their file hash and chunk index, so their
+    entries are exact and in chunk order.
     """
     collections = _load_collections()
     if name in collections:
@@ -601,8 +691,8 @@ def rebuild_manifest(name: str, config):
     def _process_points(points):
         for p in points:
             metadata = p.payload.get("metadata", {})
-            # Try to get hash from metadata
-            point_hash = metadata.get("hash", "")
+            # Source file hash recorded by the uploader, else from metadata
+            point_hash = p.payload.get("file_hash") or metadata.get("hash", "")
             if not point_hash:
                 # Fallback: try source_url or other identifiers
                 point_hash = metadata.get("source_url", "unknown")
@@ -613,7 +703,7 @@ def rebuild_manifest(name: str, config):
                     "source_type": metadata.get("source_type", "unknown"),
                     "title": metadata.get("title", ""),
                 }
-            file_points[point_hash]["point_ids"].append(str(p.id))
+            file_points[point_hash]["point_ids"].append((p.payload.get("chunk_index", -1), str(p.id)))
 
     _process_points(points)
     total = len(points)
@@ -633,6 +723,7 @@ def rebuild_manifest(name: str, config):
 
     # Build manifest files entries
     for file_hash, info in file_points.items():
+        info["point_ids"] = [pid for _, pid in sorted(info["point_ids"], key=lambda entry: entry[0])]
         manifest["files"][file_hash] = {
             "original_name": info.get("title", file_hash),
             "file_type": info.get("source_type", "unknown"),
@@ -649,6 +740,27 @@ def rebuild_manifest(name: str, config):
     print(f"  {len(file_points)} files, {total} total points")
 
 
+# ---------------------------------------------------------------------------
+# BACKFILL CITATIONS
+# ---------------------------------------------------------------------------
+
+def backfill_collection_citations(name: str, config):
+    """
+    Store the resolved citation in the payload of every existing point.
+    Needed once for collections ingested before citations were stored, and
+    again whenever global_hashes.json changes.
+    """
+    collections = _load_collections()
+    if name in collections:
+        qdrant_col = collections[name]["qdrant_collection"]
+    else:
+        qdrant_col = _qdrant_name(name)
+
+    print(f"Backfilling citations in Qdrant collection '{qdrant_col}'...")
+    resolver = load_resolver(config)
+    backfill_citations(config["qdrant"]["url"], qdrant_col, resolver)
+
+
 # ---------------------------------------------------------------------------
 # LIST
 # ---------------------------------------------------------------------------
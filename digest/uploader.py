@@ -2,37 +2,93 @@
 Qdrant chunk uploader with Ollama embeddings.
 Refactored from chunker/qdrant_uploader.py.
 Parameterized by collection name; returns point_ids.
+
+Point ids are derived from the content (UUIDv5 of collection, source file
+hash, chunk index and chunk text hash), so re-running an interrupted create
+or update upserts the same points instead of duplicating them, and chunks
+already in the collection are not embedded again. When a file is re-ingested,
+the vectors of its previous chunks can be passed as known_vectors (by text
+hash, see fetch_vectors) so only chunks whose text changed are embedded.
 """
 
 import os
-import json
 import uuid
+import hashlib
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 
 import requests
-import tiktoken
 from tqdm import tqdm
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, PointStruct
+from qdrant_client.models import VectorParams, PointStruct, PointIdsList
+
+from chunker import CHUNK_FILE_SUFFIXES, count_tokens_batch, read_chunk_file
 
 
 # Module-level session for connection reuse
 _session = requests.Session()
 
-# Lazy tokenizer
-_enc = None
+# Namespace of the chunk point ids; changing it gives every chunk a new id
+POINT_ID_NAMESPACE = uuid.UUID("8b6f2a3e-4c1d-5e7f-9a0b-1c2d3e4f5a6b")
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
-def _get_encoder(encoding: str = "o200k_base"):
-    global _enc
-    if _enc is None:
-        _enc = tiktoken.get_encoding(encoding)
-    return _enc
+def point_id_for(collection_name: str, file_hash: str, chunk_index: int, chunk_text_hash: str) -> str:
+    """Deterministic point id of a chunk (UUIDv5)."""
+    key = f"{collection_name}\x1f{file_hash}\x1f{chunk_index}\x1f{chunk_text_hash}"
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, key))
 
 
-def _count_tokens(text: str, encoding: str = "o200k_base") -> int:
-    return len(_get_encoder(encoding).encode(text))
+def _existing_ids(client: QdrantClient, collection_name: str, ids: list[str]) -> set[str]:
+    points = client.retrieve(collection_name=collection_name, ids=ids, with_payload=False, with_vectors=False)
+    return {str(p.id) for p in points}
+
+
+def fetch_vectors(qdrant_url: str, collection_name: str, point_ids: list[str],
+                  batch_size: int = 256) -> dict[str, list]:
+    """Vectors of existing points, keyed by the hash of their chunk text."""
+    client = QdrantClient(url=qdrant_url)
+    vectors = {}
+    for i in range(0, len(point_ids), batch_size):
+        points = client.retrieve(
+            collection_name=collection_name,
+            ids=point_ids[i : i + batch_size],
+            with_payload=["text_hash", "chunk_text"],
+            with_vectors=True,
+        )
+        for p in points:
+            payload = p.payload or {}
+            # Points uploaded before text_hash was stored: hash their text
+            sha = payload.get("text_hash") or text_hash(payload.get("chunk_text", ""))
+            vectors[sha] = p.vector
+    return vectors
+
+
+def delete_points(qdrant_url: str, collection_name: str, point_ids: list[str], batch_size: int = 1000):
+    """Delete points from a Qdrant collection in bulk."""
+    client = QdrantClient(url=qdrant_url)
+    for i in range(0, len(point_ids), batch_size):
+        client.delete(
+            collection_name=collection_name,
+            points_selector=PointIdsList(points=point_ids[i : i + batch_size]),
+        )
+    print(f"Deleted {len(point_ids)} points from '{collection_name}'")
+
+
+def chunk_token_counts(data: dict, encoding: str = "o200k_base") -> list[int]:
+    """
+    Token counts of the chunks of a chunk file: the ones stored by the
+    chunker when present, otherwise counted here (older chunk files).
+    """
+    chunks = data["chunks"]
+    stored = data.get("chunk_tokens")
+    if (stored is not None and len(stored) == len(chunks)
+            and data.get("tokenizer_encoding", encoding) == encoding):
+        return stored
+    return count_tokens_batch(chunks, encoding)
 
 
 def _embed_single(text: str, model: str, url: str):
@@ -73,9 +129,20 @@ def upload_chunks(
     embedding_workers: int = 8,
     max_tokens: int = 2000,
     tokenizer_encoding: str = "o200k_base",
-) -> list[str]:
+    citation_resolver=None,
+    skip_existing: bool = True,
+    known_vectors: dict[str, list] = None,
+) -> tuple[dict[str, list[str]], set[str]]:
     """
-    Read JSON chunk files, embed with Ollama, upload to Qdrant.
+    Read chunk files (json, jsonl or msgpack), embed with Ollama, upload to Qdrant.
+
+    Files are processed in name order. Chunks the chunker did not bound
+    (size-bounded mode off) are still skipped at >= max_tokens, with a warning.
+
+    A file is incomplete when its chunk file could not be read, when one of
+    its embedding or upsert batches failed, or when it ends up with fewer
+    point ids than it has uploadable chunks. Failures are reported, not
+    raised: the other files are still uploaded.
 
     Args:
         qdrant_url: Qdrant server URL.
@@ -86,76 +153,149 @@ def upload_chunks(
         batch_size: Batch size for embedding requests.
         upload_batch_size: Batch size for Qdrant upserts.
         embedding_workers: Number of parallel embedding workers.
-        max_tokens: Skip chunks with >= this many tokens.
+        max_tokens: Skip chunks with >= this many tokens (the chunker splits
+            them in size-bounded mode, so none are skipped then).
         tokenizer_encoding: Tiktoken encoding name.
+        citation_resolver: Optional CitationResolver; when given, the resolved
+            citation is stored in each point's payload.
+        skip_existing: Do not embed nor upsert chunks whose point already
+            exists (same id means same collection, file, position and text).
+        known_vectors: Optional {text hash: vector} (see fetch_vectors);
+            chunks with a known text reuse that vector instead of being
+            embedded.
 
     Returns:
-        List of all created point IDs (UUIDs as strings).
+        (point_ids_by_file, failed_files): {file hash (chunk file stem): point
+        IDs of its chunks (UUIDs as strings, created or already present), in
+        chunk order}, and the set of file hashes that were not fully uploaded
+        (their point id list, if any, is partial).
     """
     client = QdrantClient(url=qdrant_url)
     chunks_dir = Path(chunks_dir)
 
-    json_files = [f for f in chunks_dir.iterdir() if f.suffix == ".json"]
-    print(f"Found {len(json_files)} JSON documents")
+    json_files = sorted(f for f in chunks_dir.iterdir() if f.suffix in CHUNK_FILE_SUFFIXES)
+    print(f"Found {len(json_files)} chunk documents")
 
-    all_point_ids = []
+    point_ids_by_file = {}
+    failed_files = set()
+    total_points = 0
+    skipped_points = 0
+    reused_vectors = 0
+    known_vectors = known_vectors or {}
     upload_batch = []
+    batch_files = set()  # Files with points in upload_batch
+
+    def flush():
+        nonlocal upload_batch, total_points
+        try:
+            client.upsert(collection_name=collection_name, points=upload_batch)
+            total_points += len(upload_batch)
+        except Exception as e:
+            print(f"[ERROR] Upsert of {len(upload_batch)} points failed: {e}")
+            failed_files.update(batch_files)
+        upload_batch = []
+        batch_files.clear()
 
     for json_file in tqdm(json_files, desc="Uploading chunks"):
         try:
-            with open(json_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = read_chunk_file(json_file)
 
             metadata = data["metadata"]
             chunks = data["chunks"]
+            token_counts = chunk_token_counts(data, tokenizer_encoding)
 
             # Remove internal id field from metadata if present
             if "id" in metadata:
                 del metadata["id"]
+
+            # Resolve the citation once per file
+            payload_extra = {}
+            if citation_resolver is not None:
+                payload_extra["citation"] = citation_resolver.citation(metadata)
         except Exception as e:
             print(f"[ERROR] Failed to read {json_file.name}: {e}")
+            failed_files.add(json_file.stem)
             continue
 
+        file_point_ids = point_ids_by_file.setdefault(json_file.stem, [])
+        uploadable = sum(1 for text, tokens in zip(chunks, token_counts) if text.strip() and tokens < max_tokens)
+        oversized = sum(1 for tokens in token_counts if tokens >= max_tokens)
+        if oversized:
+            print(f"[WARNING] Skipping {oversized} chunks of >= {max_tokens} tokens in {json_file.name}")
+
         for i in range(0, len(chunks), batch_size):
             chunk_batch = chunks[i : i + batch_size]
 
             # Filter invalid chunks
-            valid_chunks = []
-            for text in chunk_batch:
+            valid_chunks = []  # (chunk index, text, text hash, point id)
+            for index, (text, tokens) in enumerate(
+                zip(chunk_batch, token_counts[i : i + batch_size]), start=i
+            ):
                 if not text.strip():
                     continue
-                if _count_tokens(text, tokenizer_encoding) >= max_tokens:
+                if tokens >= max_tokens:
                     continue
-                valid_chunks.append(text)
+                sha = text_hash(text)
+                valid_chunks.append((index, text, sha, point_id_for(collection_name, json_file.stem, index, sha)))
 
             if not valid_chunks:
                 continue
 
+            existing = set()
+            if skip_existing:
+                try:
+                    existing = _existing_ids(client, collection_name, [c[3] for c in valid_chunks])
+                except Exception as e:
+                    print(f"[WARNING] Could not check existing points in {json_file.name}: {e}")
+            missing = [c for c in valid_chunks if c[3] not in existing]
+            skipped_points += len(valid_chunks) - len(missing)
+
+            # Unchanged text at a new position: reuse its vector
+            vector_by_id = {c[3]: known_vectors[c[2]] for c in missing if c[2] in known_vectors}
+            reused_vectors += len(vector_by_id)
+            to_embed = [c for c in missing if c[3] not in vector_by_id]
+
             try:
                 vectors = _embed_batch_parallel(
-                    valid_chunks, embedding_model, embedding_url, embedding_workers
-                )
+                    [c[1] for c in to_embed], embedding_model, embedding_url, embedding_workers
+                ) if to_embed else []
             except Exception as e:
                 print(f"[ERROR] Embedding failed in {json_file.name}: {e}")
+                failed_files.add(json_file.stem)
                 continue
 
-            for text, vec in zip(valid_chunks, vectors):
-                point_id = str(uuid.uuid4())
+            vector_by_id.update((c[3], vec) for c, vec in zip(to_embed, vectors))
+            for index, text, sha, point_id in valid_chunks:
+                file_point_ids.append(point_id)
+                if point_id not in vector_by_id:
+                    continue  # Already in the collection
                 point = PointStruct(
                     id=point_id,
-                    vector=vec,
-                    payload={"chunk_text": text, "metadata": metadata},
+                    vector=vector_by_id[point_id],
+                    payload={
+                        "chunk_text": text,
+                        "metadata": metadata,
+                        "file_hash": json_file.stem,
+                        "chunk_index": index,
+                        "text_hash": sha,
+                        **payload_extra,
+                    },
                 )
                 upload_batch.append(point)
-                all_point_ids.append(point_id)
+                batch_files.add(json_file.stem)
 
                 if len(upload_batch) >= upload_batch_size:
-                    client.upsert(collection_name=collection_name, points=upload_batch)
-                    upload_batch = []
+                    flush()
+
+        if len(file_point_ids) != uploadable:
+            failed_files.add(json_file.stem)
 
     # Flush remaining
     if upload_batch:
-        client.upsert(collection_name=collection_name, points=upload_batch)
+        flush()
 
-    print(f"Upload complete! {len(all_point_ids)} points created.")
-    return all_point_ids
+    print(f"Upload complete! {total_points} points created ({reused_vectors} with reused vectors), "
+          f"{skipped_points} already present.")
+    if failed_files:
+        print(f"[WARNING] {len(failed_files)} files not fully uploaded: {', '.join(sorted(failed_files))}")
+    return point_ids_by_file, failed_files
@@ -0,0 +1,122 @@
+"""
+Pre-compressed variants of text artifacts.
+
+Text files (QCM JSON, Markdown, ...) get compressed siblings written once,
+next to them, when they are stored: `<hash>.json.gz` and, when the optional
+`brotli` package is installed, `<hash>.json.br`. Downloads pick a sibling from
+the client's `Accept-Encoding`, so compression costs nothing per request.
+
+Siblings are not stored files of their own: the file index ignores them.
+A sibling older than its source (the source was replaced) is not served.
+
+Existing stores can be backfilled with:
+    python file_index.py precompress /app/uploads
+"""
+
+import gzip
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {".json", ".md", ".txt", ".csv", ".html", ".xml", ".svg", ".log"}
+
+# Below this size the compressed variant is not worth a second file
+MIN_COMPRESS_BYTES = int(os.getenv("FILE_COMPRESS_MIN_BYTES", "1024"))
+
+# (Content-Encoding, sibling suffix), in order of preference
+ENCODINGS: List[Tuple[str, str]] = ([("br", ".br")] if brotli is not None else []) + [("gzip", ".gz")]
+
+COMPRESSED_SUFFIXES = (".gz", ".br")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def is_compressible(path: Path) -> bool:
+    return Path(path).suffix.lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def _write_gzip(source: Path, target):
+    with open(source, "rb") as src, gzip.GzipFile(fileobj=target, mode="wb", compresslevel=9, mtime=0) as gz:
+        while chunk := src.read(CHUNK_SIZE):
+            gz.write(chunk)
+
+
+def _write_brotli(source: Path, target):
+    compressor = brotli.Compressor(quality=11, mode=brotli.MODE_TEXT)
+    with open(source, "rb") as src:
+        while chunk := src.read(CHUNK_SIZE):
+            target.write(compressor.process(chunk))
+    target.write(compressor.finish())
+
+
+def write_compressed_siblings(path: Path) -> List[Path]:
+    """Write the compressed siblings of a text file (atomically). Returns them."""
+    path = Path(path)
+    if not is_compressible(path) or path.stat().st_size < MIN_COMPRESS_BYTES:
+        return []
+
+    written = []
+    for encoding, suffix in ENCODINGS:
+        writer = _write_brotli if encoding == "br" else _write_gzip
+        fd, tmp_name = tempfile.mkstemp(prefix=".compress-", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                writer(path, tmp)
+            os.chmod(tmp_name, path.stat().st_mode & 0o777)  # mkstemp files are 0600
+            sibling = path.with_name(path.name + suffix)
+            os.replace(tmp_name, sibling)
+            written.append(sibling)
+        except Exception as e:
+            Path(tmp_name).unlink(missing_ok=True)
+            print(f"[WARNING] Could not write {encoding} variant of {path.name}: {e}")
+    return written
+
+
+def _accepted_encodings(accept_encoding: str) -> dict:
+    """Content-coding -> q-value from an Accept-Encoding header."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def negotiate(accept_encoding: Optional[str], path: Path) -> Optional[Tuple[str, Path, os.stat_result]]:
+    """
+    Pick the compressed sibling to serve for `path`.
+
+    Returns (content encoding, sibling path, sibling stat) or None to serve the
+    file as is.
+    """
+    if not accept_encoding or not is_compressible(path):
+        return None
+    accepted = _accepted_encodings(accept_encoding)
+    source_mtime = path.stat().st_mtime_ns
+
+    for encoding, suffix in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) <= 0:
+            continue
+        sibling = path.with_name(path.name + suffix)
+        try:
+            stat = sibling.stat()
+        except OSError:
+            continue
+        if stat.st_mtime_ns >= source_mtime:
+            return encoding, sibling, stat
+    return None
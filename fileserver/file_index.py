@@ -0,0 +1,284 @@
+"""
+In-memory index of the stored files: hash code -> path.
+
+Files are stored as `<hash_code><extension>` (e.g. `3f2a9c1b7d4e8f60.pdf`),
+either flat in a directory or sharded by hash prefix
+(`3f/2a/3f2a9c1b7d4e8f60.pdf` with a shard depth of 2). The index is built
+once at startup by walking the directories, then kept up to date:
+
+- on upload, with add();
+- optionally by watching the directories (inotify through watchfiles);
+- optionally by a periodic full rescan.
+
+Lookups are a dict access: no directory scan and no disk access per request.
+Listings page through hash codes kept sorted (globally and per extension), so
+a page costs the same whatever the size of the store.
+
+When the same hash exists in several directories, the directory listed last
+wins (uploads override the read-only files directory).
+
+Resharding an existing flat directory:
+    python file_index.py reshard /app/uploads --depth 2
+
+Writing the compressed variants of existing text files (see compression.py):
+    python file_index.py precompress /app/uploads
+"""
+
+import argparse
+import asyncio
+import bisect
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from compression import COMPRESSED_SUFFIXES, is_compressible, write_compressed_siblings
+
+
+def hash_of(name: str) -> Optional[str]:
+    """Hash code of a stored file name, or None for names that are not stored files."""
+    if name.startswith("."):
+        return None  # Hidden and temporary files (.upload-*.tmp, ...)
+    if is_compressed_sibling(name):
+        return None  # Compressed variants of a stored file (<hash>.json.gz)
+    hash_code, dot, _ = name.partition(".")
+    return hash_code if dot and hash_code else None
+
+
+def is_compressed_sibling(name: str) -> bool:
+    """`<hash>.json.gz` is a variant of `<hash>.json`; an uploaded `<hash>.gz` archive is not."""
+    if not name.endswith(COMPRESSED_SUFFIXES):
+        return False
+    return is_compressible(Path(name).with_suffix(""))
+
+
+def extension_of(path: Path) -> str:
+    """Extension used for listing filters, lowercase without the dot ("pdf")."""
+    return path.suffix.lower().lstrip(".")
+
+
+def shard_dir(base: Path, hash_code: str, depth: int) -> Path:
+    """Directory holding `hash_code` in a store sharded `depth` levels deep (2 hex chars per level)."""
+    path = Path(base)
+    for level in range(depth):
+        prefix = hash_code[level * 2:level * 2 + 2]
+        if len(prefix) < 2:
+            break
+        path = path / prefix
+    return path
+
+
+class FileIndex:
+    """hash code -> path for the files of one or more directories."""
+
+    def __init__(self, directories: Iterable[str]):
+        self.directories: List[Path] = [Path(d) for d in directories]
+        self._paths: Dict[str, Path] = {}
+        # Sorted hash codes, for cursor pagination
+        self._sorted: List[str] = []
+        self._by_extension: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._changed_during_scan: Optional[Dict[str, Optional[Path]]] = None
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def lookup(self, hash_code: str) -> Optional[Path]:
+        return self._paths.get(hash_code)
+
+    def add(self, hash_code: str, path: Path):
+        path = Path(path)
+        with self._lock:
+            previous = self._paths.get(hash_code)
+            if previous is None:
+                bisect.insort(self._sorted, hash_code)
+            elif extension_of(previous) != extension_of(path):
+                self._unlist_extension(hash_code, previous)
+            if previous is None or extension_of(previous) != extension_of(path):
+                bisect.insort(self._by_extension.setdefault(extension_of(path), []), hash_code)
+            self._paths[hash_code] = path
+            if self._changed_during_scan is not None:
+                self._changed_during_scan[hash_code] = path
+
+    def discard(self, path: Path):
+        """Forget `path` if it is the indexed file for its hash."""
+        path = Path(path)
+        hash_code = hash_of(path.name)
+        with self._lock:
+            if hash_code and self._paths.get(hash_code) == path:
+                del self._paths[hash_code]
+                _remove_sorted(self._sorted, hash_code)
+                self._unlist_extension(hash_code, path)
+                if self._changed_during_scan is not None:
+                    self._changed_during_scan[hash_code] = None
+
+    def _unlist_extension(self, hash_code: str, path: Path):
+        extension = extension_of(path)
+        codes = self._by_extension.get(extension)
+        if codes is not None:
+            _remove_sorted(codes, hash_code)
+            if not codes:
+                del self._by_extension[extension]
+
+    def page(self, after: Optional[str] = None, limit: int = 100,
+             extension: Optional[str] = None) -> Tuple[List[Tuple[str, Path]], Optional[str], int]:
+        """
+        One page of the index in hash code order.
+
+        Returns (hash code, path) pairs following the cursor `after`, the
+        cursor of the next page (None on the last page) and the number of
+        files matching `extension`.
+        """
+        with self._lock:
+            if extension:
+                codes = self._by_extension.get(extension.lower().lstrip("."), [])
+            else:
+                codes = self._sorted
+            start = bisect.bisect_right(codes, after) if after else 0
+            selected = codes[start:start + limit]
+            items = [(code, self._paths[code]) for code in selected]
+            more = start + limit < len(codes)
+            return items, (selected[-1] if more and selected else None), len(codes)
+
+    # ------------------------------------------------------------------
+    # Full scans
+    # ------------------------------------------------------------------
+
+    def rescan(self) -> int:
+        """Rebuild the index from disk. Safe to call while requests are served."""
+        with self._lock:
+            self._changed_during_scan = {}
+
+        paths: Dict[str, Path] = {}
+        for directory in self.directories:
+            for path in self._walk(directory):
+                paths[hash_of(path.name)] = path
+
+        with self._lock:
+            # Uploads and deletions seen while walking win over the walk
+            for hash_code, path in self._changed_during_scan.items():
+                if path is None:
+                    paths.pop(hash_code, None)
+                else:
+                    paths[hash_code] = path
+            self._changed_during_scan = None
+            self._paths = paths
+            self._sorted = sorted(paths)
+            self._by_extension = {}
+            for hash_code in self._sorted:
+                self._by_extension.setdefault(extension_of(paths[hash_code]), []).append(hash_code)
+        return len(paths)
+
+    @staticmethod
+    def _walk(directory: Path):
+        if not directory.is_dir():
+            return
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = list(os.scandir(current))
+            except OSError as e:
+                print(f"[WARNING] Cannot scan {current}: {e}")
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith("."):
+                        stack.append(Path(entry.path))
+                elif hash_of(entry.name):
+                    yield Path(entry.path)
+
+    # ------------------------------------------------------------------
+    # Background refresh
+    # ------------------------------------------------------------------
+
+    async def rescan_periodically(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                count = await loop.run_in_executor(None, self.rescan)
+                print(f"[file_index] Rescan: {count} files")
+            except Exception as e:
+                print(f"[WARNING] File index rescan failed: {e}")
+
+    async def watch(self):
+        """Follow file creations and deletions with inotify (needs the watchfiles package)."""
+        try:
+            from watchfiles import Change, awatch
+        except ImportError:
+            print("[WARNING] watchfiles not installed; file index watching disabled")
+            return
+
+        directories = [str(d) for d in self.directories if d.is_dir()]
+        async for changes in awatch(*directories, recursive=True):
+            for change, raw_path in changes:
+                path = Path(raw_path)
+                if change == Change.deleted:
+                    self.discard(path)
+                elif hash_of(path.name) and path.is_file():
+                    # Directory order decides between duplicates, as in rescan()
+                    current = self.lookup(hash_of(path.name))
+                    if current is None or self._rank(path) >= self._rank(current):
+                        self.add(hash_of(path.name), path)
+
+    def _rank(self, path: Path) -> int:
+        for rank in range(len(self.directories) - 1, -1, -1):
+            if self.directories[rank] in path.parents:
+                return rank
+        return -1
+
+
+def _remove_sorted(codes: List[str], hash_code: str):
+    i = bisect.bisect_left(codes, hash_code)
+    if i < len(codes) and codes[i] == hash_code:
+        del codes[i]
+
+
+def reshard(directory: Path, depth: int) -> int:
+    """Move the files of a flat directory into hash-prefix shards."""
+    moved = 0
+    for entry in list(os.scandir(directory)):
+        if not entry.is_file() or entry.name.startswith("."):
+            continue
+        # Compressed variants follow their source file
+        hash_code = hash_of(entry.name) or hash_of(entry.name.rsplit(".", 1)[0])
+        if not hash_code:
+            continue
+        target_dir = shard_dir(directory, hash_code, depth)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        os.replace(entry.path, target_dir / entry.name)
+        moved += 1
+    return moved
+
+
+def precompress(directory: Path) -> int:
+    """Write the compressed variants of the text files of a store. Returns how many were written."""
+    written = 0
+    for path in FileIndex._walk(Path(directory)):
+        if is_compressible(path):
+            written += len(write_compressed_siblings(path))
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="File store maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reshard_parser = sub.add_parser("reshard", help="Move a flat directory into hash-prefix shards")
+    reshard_parser.add_argument("directory")
+    reshard_parser.add_argument("--depth", type=int, default=2)
+    precompress_parser = sub.add_parser("precompress", help="Write compressed variants of text files")
+    precompress_parser.add_argument("directory")
+    args = parser.parse_args(argv)
+
+    if args.command == "reshard":
+        moved = reshard(Path(args.directory), args.depth)
+        print(f"Moved {moved} files into {args.depth}-level shards")
+    elif args.command == "precompress":
+        written = precompress(Path(args.directory))
+        print(f"Wrote {written} compressed files")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
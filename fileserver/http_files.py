@@ -0,0 +1,176 @@
+"""
+HTTP caching and range support for content-addressed downloads.
+
+Responses carry a strong ETag and Last-Modified, and repeat views are
+answered with 304 Not Modified. Hash codes are not always derived from the
+content (uploads may pass a custom hash code and replace the file behind it),
+so caches revalidate by default (`no-cache`) instead of keeping an
+`immutable` copy forever.
+
+`Range: bytes=...` requests (used by browser PDF viewers to seek) are served
+as 206 Partial Content. A single range is supported; multi-range requests get
+the full file, which RFC 9110 allows.
+
+Text files with a compressed sibling (see compression.py) are sent in the
+best encoding the client accepts (`Vary: Accept-Encoding`, one ETag per
+encoding). Range requests always address the uncompressed bytes.
+
+The ETag is derived from the hash code plus the file size and modification
+time, so an upload reusing a custom hash code still invalidates caches.
+"""
+
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from compression import is_compressible, negotiate
+
+# Stores whose hash codes are never reused can use "public, max-age=31536000, immutable"
+CACHE_CONTROL = os.getenv("FILE_CACHE_CONTROL", "public, no-cache")
+
+# Types browsers display themselves (PDF viewer, images); the rest is downloaded
+INLINE_TYPES = ("application/pdf", "image/", "text/plain")
+
+# Uploaded SVG can carry scripts: never rendered on the fileserver origin
+ATTACHMENT_TYPES = ("image/svg+xml",)
+
+CHUNK_SIZE = 64 * 1024
+
+mimetypes.add_type("application/json", ".json")
+mimetypes.add_type("text/markdown", ".md")
+
+
+def content_type_of(path: Path) -> str:
+    media_type, _ = mimetypes.guess_type(path.name)
+    return media_type or "application/octet-stream"
+
+
+def etag_of(hash_code: str, stat: os.stat_result, encoding: Optional[str] = None) -> str:
+    suffix = f"-{encoding}" if encoding else ""
+    return f'"{hash_code}-{stat.st_size:x}-{stat.st_mtime_ns:x}{suffix}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak comparison, as RFC 9110 requires for it)."""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    # If-Modified-Since is only considered without If-None-Match
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range lies outside the file (answered with 416)."""
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into inclusive (start, end).
+
+    Returns None when the header should be ignored (other unit, several
+    ranges, malformed).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first or last) or not all(p.isdigit() for p in (first, last) if p):
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _read_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, path: Path, hash_code: str) -> Response:
+    """Full, partial (206) or not-modified (304) response for a stored file."""
+    stat = path.stat()
+    media_type = content_type_of(path)
+    range_header = request.headers.get("range")
+
+    # Compressed variants are only sent whole
+    variant = None if range_header else negotiate(request.headers.get("accept-encoding"), path)
+    encoding = variant[0] if variant else None
+
+    etag = etag_of(hash_code, stat, encoding)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if is_compressible(path):
+        headers["Vary"] = "Accept-Encoding"
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    inline = media_type.startswith(INLINE_TYPES) and not media_type.startswith(ATTACHMENT_TYPES)
+    disposition = "inline" if inline else "attachment"
+    headers["Content-Disposition"] = f'{disposition}; filename="{path.name}"'
+
+    if variant is not None:
+        _, variant_path, variant_stat = variant
+        headers["Content-Encoding"] = encoding
+        return FileResponse(path=str(variant_path), media_type=media_type, headers=headers,
+                            stat_result=variant_stat)
+
+    # If-Range: only honour the range if the client's copy is still current
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(_read_range(path, start, end), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    return FileResponse(path=str(path), media_type=media_type, headers=headers, stat_result=stat)
@@ -1,11 +1,14 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request, UploadFile, File, Form
+from fastapi.responses import JSONResponse
+import asyncio
 import os
-import hashlib
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional
 
-app = FastAPI(title="File Server", description="Download and upload files by hash code")
+from file_index import FileIndex
+from http_files import content_type_of, file_response
+from uploads import UploadTooLarge, iter_bytes, iter_upload_file, store_upload
 
 # Directory for existing files (PDFs, etc.) - can be read-only
 FILES_DIR = os.getenv("FILES_DIR", "/app/files")
@@ -13,9 +16,56 @@ FILES_DIR = os.getenv("FILES_DIR", "/app/files")
 # Directory for uploads (QCM JSONs, etc.) - must be writable
 UPLOADS_DIR = os.getenv("UPLOADS_DIR", "/app/uploads")
 
+# Uploads are stored in hash-prefix subdirectories this many levels deep (0 = flat)
+FILE_SHARD_DEPTH = int(os.getenv("FILE_SHARD_DEPTH", "0"))
+
+# Largest accepted upload in bytes, 0 = no limit (default 512 MB)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+
+# Index refresh for files added outside /upload: full rescan every N seconds (0 = off)
+# and/or inotify watching of both directories
+FILE_INDEX_RESCAN_INTERVAL = float(os.getenv("FILE_INDEX_RESCAN_INTERVAL", "300"))
+FILE_INDEX_WATCH = os.getenv("FILE_INDEX_WATCH", "false").lower() in ("1", "true", "yes")
+
 # Ensure uploads directory exists
 Path(UPLOADS_DIR).mkdir(parents=True, exist_ok=True)
 
+# hash code -> path, uploads take precedence over files (listed last)
+file_index = FileIndex([FILES_DIR, UPLOADS_DIR])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the file index, then keep it fresh in the background"""
+    count = await asyncio.get_running_loop().run_in_executor(None, file_index.rescan)
+    print(f"[file_index] Indexed {count} files")
+
+    tasks = []
+    if FILE_INDEX_RESCAN_INTERVAL > 0:
+        tasks.append(asyncio.create_task(file_index.rescan_periodically(FILE_INDEX_RESCAN_INTERVAL)))
+    if FILE_INDEX_WATCH:
+        tasks.append(asyncio.create_task(file_index.watch()))
+    yield
+    for task in tasks:
+        task.cancel()
+
+
+app = FastAPI(title="File Server", description="Download and upload files by hash code", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def reject_large_uploads(request: Request, call_next):
+    """
+    Reject uploads announced as too large (Content-Length) before their body
+    is read: FastAPI parses and spools a multipart body before the endpoint
+    runs. Bodies without a Content-Length are limited while they are stored.
+    """
+    content_length = request.headers.get("content-length")
+    if MAX_UPLOAD_BYTES and request.url.path.startswith("/upload") and content_length \
+            and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        return JSONResponse(status_code=413, content={"detail": f"Upload exceeds the {MAX_UPLOAD_BYTES} bytes limit"})
+    return await call_next(request)
+
 
 @app.get("/")
 async def root():
@@ -27,70 +77,121 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "indexed_files": len(file_index)}
 
 
 @app.get("/download/{hash_code}")
-async def download_file(hash_code: str):
+async def download_file(hash_code: str, request: Request):
     """
     Download a file by its hash code (extension auto-detected).
-    Searches in both FILES_DIR (existing files) and UPLOADS_DIR (uploaded files).
+    Looks the hash up in the in-memory index of FILES_DIR (existing files)
+    and UPLOADS_DIR (uploaded files); uploads take precedence.
+
+    Supports conditional requests (ETag / If-None-Match -> 304) and
+    single byte ranges (Range -> 206), see http_files.py.
     """
 
     # Sanitize
     hash_code = os.path.basename(hash_code)
 
-    # Look in both directories
-    matching_files = []
-
-    # First check uploads directory (for QCM JSONs etc.)
-    uploads_path = Path(UPLOADS_DIR)
-    if uploads_path.exists():
-        matching_files.extend(list(uploads_path.glob(f"{hash_code}.*")))
+    file_path = file_index.lookup(hash_code)
 
-    # Then check files directory (for existing PDFs etc.)
-    if not matching_files:
-        files_path = Path(FILES_DIR)
-        if files_path.exists():
-            matching_files.extend(list(files_path.glob(f"{hash_code}.*")))
-
-    if not matching_files:
+    if file_path is None:
         raise HTTPException(
             status_code=404,
             detail=f"No file found for hash '{hash_code}' (searched in uploads and files)"
         )
 
-    # If multiple results, choose the first one
-    file_path = matching_files[0]
-
-    return FileResponse(
-        path=str(file_path),
-        filename=file_path.name,
-        media_type="application/octet-stream"
-    )
+    try:
+        return file_response(request, file_path, hash_code)
+    except FileNotFoundError:
+        # Deleted since it was indexed
+        file_index.discard(file_path)
+        raise HTTPException(status_code=404, detail=f"No file found for hash '{hash_code}'")
 
 
 @app.get("/list")
-async def list_files():
+async def list_files(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    extension: Optional[str] = None,
+    metadata: bool = False
+):
     """
-    List all available files in the directory.
+    List the available files (FILES_DIR and UPLOADS_DIR), one page at a time.
+
+    Pages come from the in-memory index in hash code order, so a page costs
+    the same whatever the number of stored files.
+
+    Args:
+        cursor: next_cursor of the previous page (omit for the first page)
+        limit: Files per page (1-1000)
+        extension: Only list files with this extension (e.g. "pdf")
+        metadata: Return size, modification time and content type per file
 
     Returns:
-        List of file hashes (filenames)
+        files: File names, or objects when metadata is requested
+        count: Files in this page
+        total: Files matching the filter
+        next_cursor: Cursor of the next page, null on the last page
     """
+    items, next_cursor, total = file_index.page(cursor, limit, extension)
+
+    if metadata:
+        files = await asyncio.to_thread(_describe, items)
+    else:
+        files = [path.name for _, path in items]
+
+    return {
+        "files": files,
+        "count": len(files),
+        "total": total,
+        "next_cursor": next_cursor,
+    }
+
+
+def _describe(items) -> list:
+    files = []
+    for hash_code, path in items:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue  # Deleted since it was indexed
+        files.append({
+            "hash_code": hash_code,
+            "name": path.name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "content_type": content_type_of(path),
+        })
+    return files
+
+
+def _upload_extension(extension: Optional[str], filename: Optional[str]) -> str:
+    if extension:
+        return extension if extension.startswith('.') else f".{extension}"
+    # Use original file extension
+    original_ext = Path(filename).suffix if filename else ""
+    return original_ext if original_ext else ".bin"
+
+
+async def _store(chunks, extension: str, custom_hash: Optional[str]) -> dict:
     try:
-        files_path = Path(FILES_DIR)
-        if not files_path.exists():
-            return {"files": [], "message": "Files directory does not exist"}
-
-        files = [f.name for f in files_path.iterdir() if f.is_file()]
-        return {
-            "files": files,
-            "count": len(files),
-            "directory": FILES_DIR
-        }
+        stored = await store_upload(
+            chunks,
+            uploads_dir=UPLOADS_DIR,
+            extension=extension,
+            index=file_index,
+            shard_depth=FILE_SHARD_DEPTH,
+            custom_hash=os.path.basename(custom_hash) if custom_hash else None,  # Sanitize
+            max_bytes=MAX_UPLOAD_BYTES,
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    stored["download_url"] = f"/download/{stored['hash_code']}"
+    return stored
 
 
 @app.post("/upload")
@@ -104,6 +205,8 @@ async def upload_file(
 
     The file will be saved with a hash-based name (auto-generated or custom).
     Use the returned hash_code to download the file via /download/{hash_code}.
+    The file is copied to disk in chunks (see uploads.py); content that is
+    already stored is not written again.
 
     Args:
         file: The file to upload
@@ -114,46 +217,39 @@ async def upload_file(
         hash_code: The hash to use for downloading
         filename: Original filename
         download_url: URL path to download the file
+        deduplicated: True if identical content was already stored
     """
-    try:
-        # Read file contents
-        contents = await file.read()
-
-        # Generate hash or use custom
-        if custom_hash:
-            hash_code = os.path.basename(custom_hash)  # Sanitize
-        else:
-            # Auto-generate hash from content
-            hash_code = hashlib.sha256(contents).hexdigest()[:16]
-
-        # Determine file extension
-        if extension:
-            file_ext = extension if extension.startswith('.') else f".{extension}"
-        else:
-            # Use original file extension
-            original_ext = Path(file.filename).suffix if file.filename else ""
-            file_ext = original_ext if original_ext else ".bin"
-
-        # Save to uploads directory (writable)
-        uploads_path = Path(UPLOADS_DIR)
-        uploads_path.mkdir(parents=True, exist_ok=True)
-
-        # Save file
-        file_path = uploads_path / f"{hash_code}{file_ext}"
-
-        with open(file_path, "wb") as f:
-            f.write(contents)
-
-        return {
-            "hash_code": hash_code,
-            "filename": file.filename,
-            "saved_as": file_path.name,
-            "size": len(contents),
-            "download_url": f"/download/{hash_code}"
-        }
+    stored = await _store(
+        iter_upload_file(file),
+        _upload_extension(extension, file.filename),
+        custom_hash,
+    )
+    return {"filename": file.filename, **stored}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/upload/stream")
+async def upload_stream(
+    request: Request,
+    filename: Optional[str] = None,
+    custom_hash: Optional[str] = None,
+    extension: Optional[str] = None
+):
+    """
+    Upload a file sent as the raw request body (no multipart encoding).
+
+    The body is hashed and written as it arrives, without being buffered
+    first, which makes this the preferred endpoint for large files:
+
+        curl -T report.pdf "http://localhost:8000/upload/stream?filename=report.pdf"
+
+    Same parameters and response as /upload, as query parameters.
+    """
+    stored = await _store(
+        request.stream(),
+        _upload_extension(extension, filename),
+        custom_hash,
+    )
+    return {"filename": filename, **stored}
 
 
 @app.post("/upload/json")
@@ -177,33 +273,15 @@ async def upload_json(
     """
     import json as json_module
 
-    try:
-        # Convert to JSON string
-        json_content = json_module.dumps(data, ensure_ascii=False, indent=2)
-        contents = json_content.encode('utf-8')
-
-        # Generate hash or use custom
-        if custom_hash:
-            hash_code = os.path.basename(custom_hash)
-        else:
-            hash_code = hashlib.sha256(contents).hexdigest()[:16]
-
-        # Save to uploads directory (writable)
-        uploads_path = Path(UPLOADS_DIR)
-        uploads_path.mkdir(parents=True, exist_ok=True)
-
-        # Save file
-        file_path = uploads_path / f"{hash_code}.json"
+    # Convert to compact JSON (clients pretty-print; compressed variants are written on store)
+    json_content = json_module.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    contents = json_content.encode('utf-8')
 
-        with open(file_path, "wb") as f:
-            f.write(contents)
-
-        return {
-            "hash_code": hash_code,
-            "saved_as": file_path.name,
-            "size": len(contents),
-            "download_url": f"/download/{hash_code}"
-        }
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    stored = await _store(iter_bytes(contents), ".json", custom_hash)
+    return {
+        "hash_code": stored["hash_code"],
+        "saved_as": stored["saved_as"],
+        "size": stored["size"],
+        "download_url": stored["download_url"],
+        "deduplicated": stored["deduplicated"],
+    }
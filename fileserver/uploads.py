@@ -0,0 +1,146 @@
+"""
+Streaming, memory-bounded upload storage.
+
+Uploads are consumed chunk by chunk: each chunk is hashed and appended to a
+hidden temp file in UPLOADS_DIR (ignored by the file index), and the temp file
+is atomically renamed to `<hash_code><extension>` once complete. Readers never
+see a partial file, and a failed upload leaves nothing behind.
+
+All disk work runs in the thread pool, so the event loop keeps serving other
+requests while large files are written.
+
+Text files also get their compressed variants written once published (see
+compression.py).
+
+When the hash code is the content hash (no custom hash, or a custom hash equal
+to it) and that hash is already stored, the temp file is dropped and the
+existing file is returned.
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from compression import is_compressible, write_compressed_siblings
+from file_index import FileIndex, shard_dir
+
+# Chunk size used to read the request / spooled multipart file
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# mkstemp creates 0600 files: published files get the mode open() would give them
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeds the configured size limit (answered with 413)."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds the {max_bytes} bytes limit")
+        self.max_bytes = max_bytes
+
+
+class SpooledUpload:
+    """Temp file that hashes what is written to it, for atomic publication."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        fd, name = tempfile.mkstemp(prefix=".upload-", suffix=".tmp", dir=directory)
+        self.path = Path(name)
+        self._file = os.fdopen(fd, "wb")
+
+    @property
+    def content_hash(self) -> str:
+        return self._sha256.hexdigest()[:16]
+
+    def _write(self, chunk: bytes):
+        self._sha256.update(chunk)
+        self._file.write(chunk)
+
+    async def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        await asyncio.to_thread(self._write, chunk)
+
+    def _publish(self, target: Path):
+        self._file.close()
+        os.chmod(self.path, FILE_MODE)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.path, target)
+
+    async def publish(self, target: Path):
+        await asyncio.to_thread(self._publish, target)
+
+    def _discard(self):
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+    async def discard(self):
+        await asyncio.to_thread(self._discard)
+
+
+async def store_upload(
+    chunks: AsyncIterator[bytes],
+    uploads_dir: str,
+    extension: str,
+    index: FileIndex,
+    shard_depth: int = 0,
+    custom_hash: Optional[str] = None,
+    max_bytes: int = 0,
+) -> dict:
+    """
+    Spool `chunks` to disk and publish them as `<hash_code><extension>`.
+
+    Returns hash_code, saved_as, size and deduplicated. Raises UploadTooLarge
+    (nothing is kept) when more than `max_bytes` are received (0 = no limit).
+    """
+    upload = SpooledUpload(Path(uploads_dir), max_bytes)
+    try:
+        async for chunk in chunks:
+            if chunk:
+                await upload.write(chunk)
+    except BaseException:
+        await upload.discard()
+        raise
+
+    hash_code = custom_hash or upload.content_hash
+
+    if hash_code == upload.content_hash:
+        existing = index.lookup(hash_code)
+        if existing is not None and existing.is_file():
+            # Same content already stored: keep the existing file
+            await upload.discard()
+            return {"hash_code": hash_code, "saved_as": existing.name,
+                    "size": upload.size, "deduplicated": True}
+
+    target = shard_dir(Path(uploads_dir), hash_code, shard_depth) / f"{hash_code}{extension}"
+    try:
+        await upload.publish(target)
+    except BaseException:
+        await upload.discard()
+        raise
+    index.add(hash_code, target)
+    if is_compressible(target):
+        await asyncio.to_thread(write_compressed_siblings, target)
+    return {"hash_code": hash_code, "saved_as": target.name,
+            "size": upload.size, "deduplicated": False}
+
+
+async def iter_upload_file(file, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Chunks of a FastAPI UploadFile (already spooled to disk by Starlette)."""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def iter_bytes(data: bytes) -> AsyncIterator[bytes]:
+    yield data
@@ -1,16 +1,22 @@
 """
 Course generation endpoints router
 """
+import asyncio
+import gzip
 import os
+import shutil
 import uuid
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
 from fastapi.responses import StreamingResponse, FileResponse
 from datetime import datetime
 
 from app.models.schemas import ChatRequest
 from app.core.auth import get_current_user
-from app.services.course_service import stream_course_generation
+from app.services.course_service import stream_course_generation, submit_course_job
+from app.services.course_jobs import course_jobs, FAILED
 from app.core.settings import settings
+from app.core.tracing import new_request_id
 
 router = APIRouter(prefix="/course", tags=["Course Generation"])
 
@@ -34,13 +40,21 @@ async def course_models(current_user: dict = Depends(get_current_user)):
 
 
 @router.post("/api/chat/completions")
-async def course_chat(request: ChatRequest, current_user: dict = Depends(get_current_user)):
+async def course_chat(
+    request: ChatRequest,
+    current_user: dict = Depends(get_current_user),
+    x_request_id: str = Header(None)
+):
     """
     Course generation endpoint
 
     Generates a complete course based on the subject provided.
     The request.model must be a valid collection name (e.g., "btp", "medatai").
+
+    The course is built by a background job (id in the X-Job-ID header); if
+    the connection drops, reattach with GET /course/api/jobs/{job_id}/events.
     """
+    request_id = x_request_id or new_request_id()
     user_messages = [msg for msg in request.messages if msg.role == "user"]
     if not user_messages:
         raise HTTPException(status_code=400, detail="Aucun message utilisateur trouvé")
@@ -68,22 +82,132 @@ async def course_chat(request: ChatRequest, current_user: dict = Depends(get_cur
             detail=f"Unknown collection '{collection_name}'. Available collections: {available}"
         )
 
+    job = submit_course_job(subject, collection_name, request_id=request_id)
+
+    return StreamingResponse(
+        stream_course_generation(job.id, request.model),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+            "X-Request-ID": request_id,
+            "X-Job-ID": job.id
+        }
+    )
+
+
+@router.get("/api/jobs")
+async def course_jobs_list(current_user: dict = Depends(get_current_user)):
+    """Liste les tâches de génération de cours (plus récentes d'abord)."""
+    return {"object": "list", "data": course_jobs.list_jobs()}
+
+
+@router.get("/api/jobs/{job_id}")
+async def course_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Statut d'une tâche : queued, running, completed ou failed, et dernière étape terminée."""
+    job = course_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.get("/api/jobs/{job_id}/events")
+async def course_job_events(
+    job_id: str,
+    after: int = Query(0, ge=0, description="Replay only the events after this sequence number"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Se rattacher au flux de progression d'une tâche (rejoue puis suit en direct)."""
+    job = course_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
     return StreamingResponse(
-        stream_course_generation(subject, collection_name, collection_name),
+        stream_course_generation(job.id, after=after),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
+            "X-Accel-Buffering": "no",
+            "X-Job-ID": job.id
         }
     )
 
 
+@router.get("/api/jobs/{job_id}/result")
+async def course_job_result(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Résultat d'une tâche terminée : structure du cours, markdown et statistiques."""
+    job = course_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    results = job.load_results()
+    if results is None:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}, no result yet")
+    return {"job": job.to_dict(), **results}
+
+
+@router.post("/api/jobs/{job_id}/resume")
+async def course_job_resume(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Relance une tâche échouée à partir de son dernier point de reprise."""
+    job = course_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != FAILED:
+        raise HTTPException(status_code=409, detail=f"Only failed jobs can be resumed (job is {job.status})")
+    course_jobs.resume(job_id)
+    return job.to_dict()
+
+
+# Generated text artifacts are sent gzip-compressed to clients that accept it
+COMPRESSIBLE_EXTENSIONS = ('.md', '.json', '.txt', '.log')
+
+
+def _accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            q = 1.0
+            for param in params.split(";"):
+                name, _, value = param.strip().partition("=")
+                if name == "q":
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            return q > 0
+    return False
+
+
+def _gzip_variant(file_path: str) -> Optional[str]:
+    """
+    Path of the `.gz` sibling of a generated file, written on first download
+    (and again if the file changed since), so each artifact is compressed once.
+    Returns None if it cannot be written.
+    """
+    gz_path = file_path + ".gz"
+    try:
+        if os.path.exists(gz_path) and os.path.getmtime(gz_path) >= os.path.getmtime(file_path):
+            return gz_path
+        tmp_path = f"{gz_path}.{uuid.uuid4().hex}.tmp"
+        with open(file_path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, gz_path)
+        return gz_path
+    except OSError as e:
+        print(f"[WARNING] Could not write gzip variant of {file_path}: {e}")
+        return None
+
+
 @router.get("/download/{filename:path}")
-async def course_download(filename: str):
+async def course_download(filename: str, accept_encoding: Optional[str] = Header(None)):
     """
     Download generated course files
 
+    Markdown, JSON and text files are sent gzip-compressed when the client
+    accepts it (Accept-Encoding); the compressed copy is written once, next
+    to the file.
+
     Args:
         filename: Path to the file to download
 
@@ -91,7 +215,6 @@ async def course_download(filename: str):
         FileResponse: The requested file
     """
     file_path = os.path.normpath(filename)
-    print(file_path)
 
     if not file_path.startswith(settings.DOWNLOAD_ALLOWED_BASE_PATH):
         raise HTTPException(status_code=403, detail="Access denied")
@@ -109,8 +232,19 @@ async def course_download(filename: str):
     elif file_path.endswith('.json'):
         media_type = "application/json"
 
+    headers = None
+    served_path = file_path
+    if file_path.endswith(COMPRESSIBLE_EXTENSIONS):
+        headers = {"Vary": "Accept-Encoding"}
+        if _accepts_gzip(accept_encoding):
+            gz_path = await asyncio.to_thread(_gzip_variant, file_path)
+            if gz_path:
+                headers["Content-Encoding"] = "gzip"
+                served_path = gz_path
+
     return FileResponse(
-        path=file_path,
+        path=served_path,
         media_type=media_type,
-        filename=os.path.basename(file_path)
+        filename=os.path.basename(file_path),
+        headers=headers
     )
@@ -0,0 +1,17 @@
+"""
+LLM gateway endpoints router
+"""
+from fastapi import APIRouter, Depends
+
+from app.core.auth import get_current_user
+from app.core.llm_gateway import gateway
+from app.core import scheduler
+from course_build_agents.utils import json_stats
+
+router = APIRouter(prefix="/llm", tags=["LLM"])
+
+
+@router.get("/metrics")
+async def llm_metrics(current_user: dict = Depends(get_current_user)):
+    """Concurrency slots, queue depth, queue wait and time-to-first-token per model, JSON repair calls"""
+    return {"scheduler": scheduler.describe(), **gateway.metrics(), "json": json_stats.snapshot()}
@@ -22,6 +22,7 @@ from app.services.qcm_service import (
     stream_qcm_direct_generation
 )
 from app.core.settings import settings
+from app.core.tracing import new_request_id
 
 router = APIRouter()
 
@@ -47,7 +48,8 @@ async def list_qcm_models(current_user: dict = Depends(get_current_user)):
 @router.post("/api/chat/completions")
 async def qcm_chat_completions(
     request: ChatRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    x_request_id: str = Header(None)
 ):
     """
     Endpoint de génération de QCM.
@@ -59,6 +61,8 @@ async def qcm_chat_completions(
     - Afficher une confirmation avant de générer
     - Générer le QCM après confirmation
     """
+    request_id = x_request_id or new_request_id()
+
     # Convertir les messages en format dict
     messages = [
         {"role": msg.role, "content": msg.content}
@@ -82,13 +86,15 @@ async def qcm_chat_completions(
         stream_qcm_response(
             messages=messages,
             model=collection_name,
-            collection_name=collection_name
+            collection_name=collection_name,
+            request_id=request_id
         ),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
+            "X-Accel-Buffering": "no",
+            "X-Request-ID": request_id
         }
     )
 
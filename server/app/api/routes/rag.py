@@ -1,16 +1,21 @@
 """
 RAG endpoints router
 """
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header
 from fastapi.responses import StreamingResponse
 from datetime import datetime
+import asyncio
 import uuid
 
 from app.models.schemas import ChatRequest
 from app.core.auth import get_current_user
 from app.services.rag_service import stream_rag_response
 from rag_engine.rag import query_rag
+from rag_engine.url_resolver import refresh_citations
+from retrivers.hybrid_retriever import qdrant
 from app.core.settings import settings
+from app.core.tracing import tracer, new_request_id
+from app.core.llm_gateway import LLMQueueTimeout
 
 router = APIRouter(prefix="/rag", tags=["RAG"])
 
@@ -33,13 +38,28 @@ async def rag_models(current_user: dict = Depends(get_current_user)):
     }
 
 
+@router.post("/api/citations/reload")
+async def reload_citations(current_user: dict = Depends(get_current_user)):
+    """
+    Re-read global_hashes.json (citation URL mapping) without restarting and
+    rewrite the citations stored in the Qdrant payloads that changed
+    """
+    result = await asyncio.to_thread(refresh_citations, qdrant, settings.COLLECTIONS)
+    return {"status": "reloaded", **result}
+
+
 @router.post("/api/chat/completions")
-async def rag_chat(request: ChatRequest, current_user: dict = Depends(get_current_user)):
+async def rag_chat(
+    request: ChatRequest,
+    current_user: dict = Depends(get_current_user),
+    x_request_id: str = Header(None)
+):
     """
     RAG chat completion endpoint
 
     Supports both streaming and non-streaming responses
     """
+    request_id = x_request_id or new_request_id()
     user_messages = [msg for msg in request.messages if msg.role == "user"]
     if not user_messages:
         raise HTTPException(status_code=400, detail="No user message found")
@@ -53,19 +73,30 @@ async def rag_chat(request: ChatRequest, current_user: dict = Depends(get_curren
 
     question = user_messages[-1].content
     top_k = request.top_k or settings.RAG_DEFAULT_TOP_K
+    candidate_k = settings.RAG_CANDIDATE_K
 
     if request.stream:
         return StreamingResponse(
-            stream_rag_response(question, top_k, request.model, collection_name=collection_name),
+            stream_rag_response(
+                question, top_k, request.model,
+                collection_name=collection_name, candidate_k=candidate_k, request_id=request_id
+            ),
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"
+                "X-Accel-Buffering": "no",
+                "X-Request-ID": request_id
             }
         )
     else:
-        answer_with_links, used_sources = query_rag(question, collection_name=collection_name, top_k=top_k)
+        try:
+            with tracer.start_trace("rag.query", request_id=request_id, collection=collection_name, top_k=top_k):
+                answer_with_links, used_sources = query_rag(
+                    question, collection_name=collection_name, top_k=top_k, candidate_k=candidate_k
+                )
+        except LLMQueueTimeout as e:
+            raise HTTPException(status_code=503, detail=str(e))
         if used_sources:
             sources_text = "\n\n**Sources:**\n"
             for idx, source in enumerate(used_sources, 1):
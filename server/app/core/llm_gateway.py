@@ -0,0 +1,592 @@
+"""
+LLM Gateway
+===========
+
+Single entry point for every LLM call made by the server (RAG, course agents,
+QCM agents). It owns one pooled Ollama client and bounds how many generations
+run at the same time on each model, so that under load requests wait in the
+gateway, in a fair order, instead of piling up inside Ollama.
+
+Architecture
+------------
+
+    rag_engine.rag ──────┐
+    course_build_agents ─┼──► gateway.chat() / gateway.generate()
+    qcm_agents ──────────┘            │
+                                      ▼
+                          ModelLimiter(model)      ◄── N slots per model
+                           priority 0: rag ─────────┐
+                           priority 10: course, qcm ┤ round-robin per endpoint
+                                      │
+                                      ▼
+                          pooled ollama.Client (keep-alive HTTP connections)
+
+Concurrency
+-----------
+Each model gets LLM_MAX_CONCURRENCY slots; LLM_MODEL_CONCURRENCY overrides it
+per model ("gpt-oss:20b=2,llama3.1:8b=4"). When a slot frees up it goes to
+the waiting call with the best (lowest) priority; among calls of the same
+priority, endpoints are served round-robin, so a course build issuing dozens
+of calls cannot lock out a QCM request queued behind it. Slots are handed
+over directly on release, so a new call never jumps the queue.
+
+A priority can be capped below the model's slot count (priority_caps):
+batch calls never hold more than LLM_BATCH_CONCURRENCY slots, keeping the
+rest for interactive calls (see app/core/scheduler.py). gateway.capacity()
+tells callers fanning out work how many of their calls can actually run at
+once.
+
+Calls wait at most LLM_QUEUE_TIMEOUT for a slot. Background work that queues
+many calls of its own on purpose (the chapters of a course) runs inside
+no_queue_timeout(): nobody is waiting on the other end of those calls.
+
+Streaming calls hold their slot until the stream is exhausted or closed.
+
+Endpoint and priority come from the calling context, set once at the entry
+point of each pipeline with the llm_priority() decorator (or scheduled(),
+which derives the priority from the endpoint's work class):
+
+    @llm_priority("rag", PRIORITY_INTERACTIVE)
+    def stream_rag_with_thinking(...): ...
+
+The context lives in a ContextVar: like tracing, it does not cross into new
+threads on its own (use app.core.tracing.propagate for thread pools).
+
+Model Residency
+---------------
+Local Ollama unloads a model after 5 idle minutes by default, and the next
+call pays the full load before its first token. Every call is sent with
+keep_alive=LLM_KEEP_ALIVE, and gateway.warm_up() loads the RAG model at
+server startup (LLM_WARMUP), so bursts separated by quiet periods find the
+model resident. A loaded model also keeps its KV cache: a call whose prompt
+starts like the previous one (same system prompt, same knowledge block) only
+evaluates the tokens after the shared prefix. Prompts are ordered for this:
+static instructions first, then the knowledge, then the per-call part.
+
+Metrics
+-------
+gateway.metrics() returns, per model: slots, active calls, queue depth (by
+priority and endpoint), calls served, timeouts and queue wait times, plus
+time-to-first-token split between warm calls and cold starts (model loaded
+for the call) and the prompt tokens Ollama actually evaluated. Served at
+GET /llm/metrics. Each call also records llm.queue_wait_ms, llm.ttft_ms,
+llm.cold_start and llm.prompt_eval_count on its span.
+
+Usage:
+    from app.core.llm_gateway import gateway
+
+    response = gateway.generate(model=model, prompt=user_prompt, system=system_prompt)
+    for chunk in gateway.chat(model=model, messages=messages, stream=True):
+        ...
+"""
+
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import httpx
+from ollama import Client
+
+from app.core.settings import settings
+from app.core.tracing import current_span
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+DEFAULT_ENDPOINT = "default"
+
+_llm_context: contextvars.ContextVar = contextvars.ContextVar(
+    "llm_context", default=(DEFAULT_ENDPOINT, PRIORITY_INTERACTIVE)
+)
+_queue_timeout_exempt: contextvars.ContextVar = contextvars.ContextVar(
+    "llm_queue_timeout_exempt", default=False
+)
+
+
+# A call whose load_duration exceeds this had to load the model (cold start)
+COLD_START_SECONDS = 1.0
+
+
+class LLMQueueTimeout(Exception):
+    """Raised when a call waited longer than LLM_QUEUE_TIMEOUT for a slot."""
+
+
+# =============================================================================
+# CALLING CONTEXT
+# =============================================================================
+
+@contextmanager
+def llm_context(endpoint: str, priority: int = PRIORITY_INTERACTIVE):
+    """Tag the LLM calls made inside the block with an endpoint and a priority."""
+    token = _llm_context.set((endpoint, priority))
+    try:
+        yield
+    finally:
+        _llm_context.reset(token)
+
+
+@contextmanager
+def no_queue_timeout():
+    """LLM calls made inside the block wait for a slot as long as needed."""
+    token = _queue_timeout_exempt.set(True)
+    try:
+        yield
+    finally:
+        _queue_timeout_exempt.reset(token)
+
+
+def current_llm_context() -> Tuple[str, int]:
+    """(endpoint, priority) of the calling code."""
+    return _llm_context.get()
+
+
+def llm_priority(endpoint: str, priority: int = PRIORITY_INTERACTIVE):
+    """Decorator running a function (or generator function) inside llm_context()."""
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                with llm_context(endpoint, priority):
+                    yield from func(*args, **kwargs)
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with llm_context(endpoint, priority):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+# =============================================================================
+# PER-MODEL LIMITER
+# =============================================================================
+
+class _Waiter:
+    __slots__ = ("endpoint", "priority", "granted")
+
+    def __init__(self, endpoint: str, priority: int):
+        self.endpoint = endpoint
+        self.priority = priority
+        self.granted = False
+
+
+class ModelLimiter:
+    """Concurrency slots for one model, handed out by priority then round-robin."""
+
+    def __init__(self, model: str, slots: int, caps: Optional[Dict[int, int]] = None):
+        self.model = model
+        self.slots = max(1, slots)
+        # priority -> max calls of that priority running at once (others: all slots)
+        self.caps = {p: max(1, min(cap, self.slots)) for p, cap in (caps or {}).items()}
+        self.active = 0
+        self.active_by_priority: Dict[int, int] = {}
+        self.queued = 0
+        self._cond = threading.Condition()
+        # priority -> endpoint -> FIFO of waiters (endpoint order = round-robin order)
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {}
+
+        # Stats
+        self.served = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, endpoint: str, priority: int, timeout: Optional[float] = None) -> float:
+        """Block until a slot is free. Returns the time spent waiting (seconds)."""
+        start = time.monotonic()
+        with self._cond:
+            waiter = _Waiter(endpoint, priority)
+            self._queues.setdefault(priority, OrderedDict()).setdefault(endpoint, deque()).append(waiter)
+            self.queued += 1
+            self._dispatch()
+
+            deadline = None if timeout is None else start + timeout
+            while not waiter.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._remove(waiter)
+                    self.timeouts += 1
+                    raise LLMQueueTimeout(
+                        f"No free slot for model '{self.model}' after {timeout:g}s "
+                        f"({self.active} running, {self.queued} queued)"
+                    )
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self._record_wait(waited)
+            return waited
+
+    def release(self, priority: int):
+        with self._cond:
+            self.active -= 1
+            self.active_by_priority[priority] -= 1
+            self._dispatch()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            by_priority = {}
+            by_endpoint = {}
+            for priority, endpoints in self._queues.items():
+                for endpoint, waiters in endpoints.items():
+                    by_priority[priority] = by_priority.get(priority, 0) + len(waiters)
+                    by_endpoint[endpoint] = by_endpoint.get(endpoint, 0) + len(waiters)
+            return {
+                "slots": self.slots,
+                "caps": self.caps,
+                "active": self.active,
+                "active_by_priority": {p: n for p, n in self.active_by_priority.items() if n},
+                "queued": self.queued,
+                "queued_by_priority": by_priority,
+                "queued_by_endpoint": by_endpoint,
+                "served": self.served,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / self.served * 1000, 1) if self.served else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+            }
+
+    # Called with the lock held
+    def _dispatch(self):
+        """Hand free slots to waiters: best priority first, skipping capped priorities."""
+        granted = False
+        while self.active < self.slots:
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            waiter.granted = True
+            self.active += 1
+            self.active_by_priority[waiter.priority] = self.active_by_priority.get(waiter.priority, 0) + 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            cap = self.caps.get(priority)
+            if cap is not None and self.active_by_priority.get(priority, 0) >= cap:
+                continue
+            endpoints = self._queues[priority]
+            endpoint, waiters = next(iter(endpoints.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                endpoints.move_to_end(endpoint)
+            else:
+                del endpoints[endpoint]
+            if not endpoints:
+                del self._queues[priority]
+            self.queued -= 1
+            return waiter
+        return None
+
+    def _remove(self, waiter: _Waiter):
+        endpoints = self._queues[waiter.priority]
+        waiters = endpoints[waiter.endpoint]
+        waiters.remove(waiter)
+        if not waiters:
+            del endpoints[waiter.endpoint]
+        if not endpoints:
+            del self._queues[waiter.priority]
+        self.queued -= 1
+
+    def _record_wait(self, waited: float):
+        self.served += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+
+# =============================================================================
+# LATENCY
+# =============================================================================
+
+def _ns_to_s(value) -> float:
+    return (value or 0) / 1e9
+
+
+def _has_token(chunk) -> bool:
+    """True if a response chunk carries generated text (or thinking)."""
+    if chunk.get("response") or chunk.get("thinking"):
+        return True
+    message = chunk.get("message")
+    return bool(message and (message.get("content") or message.get("thinking")))
+
+
+def _percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LatencyStats:
+    """Time-to-first-token and prompt evaluation figures for one model."""
+
+    def __init__(self, window: int = 500):
+        self.calls = 0
+        self.cold_starts = 0
+        self.load_seconds = 0.0
+        self.prompt_eval_tokens = 0
+        self.prompt_eval_seconds = 0.0
+        # Recent TTFT samples (seconds), warm calls and cold starts apart
+        self._ttft = {"warm": deque(maxlen=window), "cold": deque(maxlen=window)}
+        self._lock = threading.Lock()
+
+    def record(self, ttft: Optional[float], load: float, prompt_eval_tokens: int, prompt_eval: float) -> bool:
+        """Add one finished call. Returns True if it was a cold start."""
+        cold = load >= COLD_START_SECONDS
+        with self._lock:
+            self.calls += 1
+            self.cold_starts += cold
+            self.load_seconds += load
+            self.prompt_eval_tokens += prompt_eval_tokens
+            self.prompt_eval_seconds += prompt_eval
+            if ttft is not None:
+                self._ttft["cold" if cold else "warm"].append(ttft)
+        return cold
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ttft = {}
+            for state, samples in self._ttft.items():
+                ttft[state] = {
+                    "samples": len(samples),
+                    "p50_ms": round(_percentile(samples, 0.5) * 1000, 1) if samples else None,
+                    "p95_ms": round(_percentile(samples, 0.95) * 1000, 1) if samples else None,
+                }
+            return {
+                "calls": self.calls,
+                "cold_starts": self.cold_starts,
+                "avg_load_ms": round(self.load_seconds / self.calls * 1000, 1) if self.calls else 0.0,
+                "avg_prompt_eval_tokens": round(self.prompt_eval_tokens / self.calls, 1) if self.calls else 0.0,
+                "prompt_eval_tokens_per_s": round(self.prompt_eval_tokens / self.prompt_eval_seconds, 1)
+                if self.prompt_eval_seconds else None,
+                "ttft": ttft,
+            }
+
+
+class _CallTimer:
+    """Measures one call: TTFT from the first chunk, durations from the final one."""
+
+    def __init__(self, stats: LatencyStats, span):
+        self._stats = stats
+        self._span = span
+        self._start = time.monotonic()
+        self._ttft = None
+        self._done = False
+
+    def observe(self, chunk):
+        if self._ttft is None and _has_token(chunk):
+            self._ttft = time.monotonic() - self._start
+        if chunk.get("done"):
+            self.finish(chunk)
+
+    def finish(self, response):
+        """Record the call from its final response (streamed or not)."""
+        if self._done:
+            return
+        self._done = True
+        load = _ns_to_s(response.get("load_duration"))
+        prompt_eval = _ns_to_s(response.get("prompt_eval_duration"))
+        prompt_tokens = response.get("prompt_eval_count") or 0
+        ttft = self._ttft
+        if ttft is None and response.get("total_duration"):
+            # Non-streamed: Ollama's own time before the first generated token
+            ttft = load + prompt_eval
+        cold = self._stats.record(ttft, load, prompt_tokens, prompt_eval)
+        if ttft is not None:
+            self._span.set_attribute("llm.ttft_ms", round(ttft * 1000, 1))
+        self._span.set_attribute("llm.cold_start", cold)
+        self._span.set_attribute("llm.prompt_eval_count", prompt_tokens)
+
+
+class _SlotStream:
+    """Iterates a streaming response and releases the slot exactly once."""
+
+    def __init__(self, stream: Iterator, limiter: ModelLimiter, priority: int, timer: Optional[_CallTimer] = None):
+        self._stream = stream
+        self._limiter = limiter
+        self._priority = priority
+        self._timer = timer
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._stream)
+        except BaseException:
+            self.close()
+            raise
+        if self._timer is not None:
+            self._timer.observe(chunk)
+        return chunk
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+            self._limiter.release(self._priority)
+
+    def __del__(self):
+        self.close()
+
+
+# =============================================================================
+# GATEWAY
+# =============================================================================
+
+class LLMGateway:
+    """Shared Ollama client with per-model concurrency limits."""
+
+    def __init__(self, host: str, headers: Optional[Dict[str, str]] = None, use_cloud: bool = False,
+                 default_slots: int = 2, model_slots: Optional[Dict[str, int]] = None,
+                 priority_caps: Optional[Dict[int, int]] = None, queue_timeout: Optional[float] = None, pool_size: int = 16,
+                 request_timeout: Optional[float] = None, keep_alive: Optional[Union[str, float]] = None):
+        self.use_cloud = use_cloud
+        # Residency is managed by Ollama Cloud itself
+        self.keep_alive = None if use_cloud else keep_alive
+        self.default_slots = default_slots
+        self.model_slots = model_slots or {}
+        self.priority_caps = priority_caps or {}
+        self.queue_timeout = queue_timeout
+        # One httpx connection pool for the whole process (keep-alive)
+        self.client = Client(
+            host=host,
+            headers=headers,
+            timeout=request_timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._latency: Dict[str, LatencyStats] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model: str) -> ModelLimiter:
+        with self._lock:
+            limiter = self._limiters.get(model)
+            if limiter is None:
+                limiter = ModelLimiter(
+                    model, self.model_slots.get(model, self.default_slots), self.priority_caps
+                )
+                self._limiters[model] = limiter
+            return limiter
+
+    def capacity(self, model: str, priority: int) -> int:
+        """How many calls of `priority` can run at the same time on `model`."""
+        limiter = self.limiter(model)
+        return limiter.caps.get(priority, limiter.slots)
+
+    def latency(self, model: str) -> LatencyStats:
+        with self._lock:
+            return self._latency.setdefault(model, LatencyStats())
+
+    def chat(self, model: str, messages, stream: bool = False, **kwargs):
+        """ollama.Client.chat() behind the model's concurrency limit."""
+        return self._call(self.client.chat, model, stream=stream, messages=messages, **kwargs)
+
+    def generate(self, model: str, prompt: str = "", stream: bool = False, **kwargs):
+        """ollama.Client.generate() behind the model's concurrency limit."""
+        return self._call(self.client.generate, model, stream=stream, prompt=prompt, **kwargs)
+
+    def warm_up(self, models) -> Dict[str, float]:
+        """
+        Load models into Ollama before the first request.
+
+        An empty prompt only loads the model (no generation); keep_alive then
+        keeps it resident. Returns the load time of each model, in seconds.
+        """
+        if self.use_cloud:
+            return {}
+        loaded = {}
+        for model in models:
+            start = time.monotonic()
+            try:
+                self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+            except Exception as e:
+                print(f"[WARNING] Warm-up of model '{model}' failed: {e}")
+                continue
+            loaded[model] = time.monotonic() - start
+            print(f"[llm_gateway] Model '{model}' loaded in {loaded[model]:.1f}s (keep_alive={self.keep_alive})")
+        return loaded
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            limiters = list(self._limiters.values())
+            latency = dict(self._latency)
+        models = {}
+        for limiter in limiters:
+            models[limiter.model] = limiter.snapshot()
+            if limiter.model in latency:
+                models[limiter.model]["latency"] = latency[limiter.model].snapshot()
+        return {
+            "cloud": self.use_cloud,
+            "default_slots": self.default_slots,
+            "keep_alive": self.keep_alive,
+            "models": models,
+        }
+
+    def _call(self, method, model: str, stream: bool, **kwargs):
+        endpoint, priority = current_llm_context()
+        limiter = self.limiter(model)
+
+        span = current_span()
+        span.set_attribute("llm.endpoint", endpoint)
+        span.set_attribute("llm.priority", priority)
+        try:
+            timeout = None if _queue_timeout_exempt.get() else self.queue_timeout
+            waited = limiter.acquire(endpoint, priority, timeout)
+        except LLMQueueTimeout as e:
+            print(f"[WARNING] {e}")
+            raise
+        span.set_attribute("llm.queue_wait_ms", round(waited * 1000, 1))
+
+        if self.keep_alive is not None:
+            kwargs.setdefault("keep_alive", self.keep_alive)
+        timer = _CallTimer(self.latency(model), span)
+
+        if not stream:
+            try:
+                response = method(model=model, stream=False, **kwargs)
+            finally:
+                limiter.release(priority)
+            timer.finish(response)
+            return response
+
+        try:
+            response = method(model=model, stream=True, **kwargs)
+        except BaseException:
+            limiter.release(priority)
+            raise
+        return _SlotStream(iter(response), limiter, priority, timer)
+
+
+def _build_gateway() -> LLMGateway:
+    ollama_cfg = settings.ollama
+    llm_cfg = settings.llm
+    if ollama_cfg.use_cloud:
+        host = ollama_cfg.cloud_host
+        headers = {"Authorization": f"Bearer {ollama_cfg.api_key}"}
+    else:
+        host = ollama_cfg.base_url
+        headers = None
+    return LLMGateway(
+        host=host,
+        headers=headers,
+        use_cloud=ollama_cfg.use_cloud,
+        default_slots=llm_cfg.max_concurrency,
+        model_slots=llm_cfg.model_concurrency_map,
+        priority_caps={PRIORITY_BATCH: llm_cfg.batch_concurrency},
+        queue_timeout=llm_cfg.queue_timeout or None,
+        pool_size=llm_cfg.pool_connections,
+        request_timeout=llm_cfg.request_timeout or None,
+        keep_alive=llm_cfg.keep_alive_value,
+    )
+
+
+gateway = _build_gateway()
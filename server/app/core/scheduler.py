@@ -0,0 +1,76 @@
+"""
+Work Scheduling
+===============
+
+Classifies the server's work as interactive or batch and maps each class to
+an LLM gateway priority (see app/core/llm_gateway.py):
+
+    class         endpoints (default)         gateway priority       LLM calls per model
+    interactive   rag, qcm.conversation       PRIORITY_INTERACTIVE   up to LLM_MAX_CONCURRENCY
+    batch         course, qcm.generate        PRIORITY_BATCH         up to LLM_BATCH_CONCURRENCY
+
+Batch LLM calls wait in a lower-priority queue and never hold more than
+LLM_BATCH_CONCURRENCY slots of a model, so with the defaults
+(LLM_MAX_CONCURRENCY=2, LLM_BATCH_CONCURRENCY=1) one slot stays reserved for
+chats even while a course is being built.
+
+Preemption happens at call boundaries: a running batch call is never
+interrupted, but when it ends its slot goes to any waiting interactive call
+before the next step of the batch job gets it. A chat therefore waits at most
+for one in-flight generation, never for a whole course.
+
+Batch endpoints are configured with LLM_BATCH_ENDPOINTS. An entry matches the
+endpoint itself and its dotted children ("qcm" covers "qcm.generate" and
+"qcm.conversation"). Everything else is interactive.
+
+Usage:
+    from app.core.scheduler import scheduled
+
+    @scheduled("course")
+    def stream_course_generation_progress(subject, config=None): ...
+"""
+
+from typing import Dict, Optional
+
+from app.core.settings import settings
+from app.core.llm_gateway import llm_priority, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+PRIORITIES: Dict[str, int] = {
+    INTERACTIVE: PRIORITY_INTERACTIVE,
+    BATCH: PRIORITY_BATCH,
+}
+
+
+def classify(endpoint: str) -> str:
+    """Work class of an endpoint ('interactive' or 'batch')."""
+    batch_endpoints = settings.llm.batch_endpoint_list
+    parts = endpoint.split(".")
+    for i in range(len(parts), 0, -1):
+        if ".".join(parts[:i]) in batch_endpoints:
+            return BATCH
+    return INTERACTIVE
+
+
+def scheduled(endpoint: str, work_class: Optional[str] = None):
+    """
+    Decorator scheduling the LLM calls of a pipeline entry point.
+
+    Args:
+        endpoint: Name used for round-robin fairness and metrics (e.g. "rag", "qcm.generate")
+        work_class: Force INTERACTIVE or BATCH instead of classifying the endpoint
+    """
+    priority = PRIORITIES[work_class or classify(endpoint)]
+    return llm_priority(endpoint, priority)
+
+
+def describe() -> Dict:
+    """Current scheduling policy (served with the gateway metrics)."""
+    return {
+        "batch_endpoints": settings.llm.batch_endpoint_list,
+        "batch_concurrency": settings.llm.batch_concurrency,
+        "priorities": PRIORITIES,
+    }
@@ -25,7 +25,7 @@ import os
 import warnings
 import configparser
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Union
 from pydantic import BaseModel, Field, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -64,6 +64,48 @@ class OllamaSettings(BaseModel):
         return self.api_key is not None and len(self.api_key) > 0
 
 
+class LLMSettings(BaseModel):
+    """LLM gateway configuration (shared client, per-model concurrency)"""
+    max_concurrency: int = Field(default=2, description="Concurrent generations per model")
+    model_concurrency: Optional[str] = Field(default=None, description="Per-model overrides: 'model=N,model=N'")
+    batch_concurrency: int = Field(default=1, description="Max concurrent batch (course/QCM) generations per model")
+    batch_endpoints: str = Field(default="course,qcm.generate", description="Endpoints scheduled as batch work")
+    queue_timeout: float = Field(default=300, description="Max seconds a call waits for a slot (0 = no limit)")
+    pool_connections: int = Field(default=16, description="HTTP connections kept open to Ollama")
+    request_timeout: float = Field(default=600, description="HTTP timeout of one LLM call in seconds (0 = none)")
+    keep_alive: Optional[str] = Field(default="30m", description="How long Ollama keeps a model loaded after a call ('30m', '-1' = forever, empty = Ollama default)")
+    warmup: bool = Field(default=True, description="Load the RAG model into Ollama at server startup")
+
+    @computed_field
+    @property
+    def model_concurrency_map(self) -> Dict[str, int]:
+        """Parse 'model=N,model=N' into {model: N}"""
+        overrides = {}
+        for entry in (self.model_concurrency or "").split(","):
+            model, sep, slots = entry.strip().rpartition("=")
+            if sep and model and slots.strip().isdigit():
+                overrides[model.strip()] = int(slots)
+        return overrides
+
+    @computed_field
+    @property
+    def keep_alive_value(self) -> Optional[Union[str, float]]:
+        """keep_alive as sent to Ollama: plain numbers are seconds, '' means unset"""
+        value = (self.keep_alive or "").strip()
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+    @computed_field
+    @property
+    def batch_endpoint_list(self) -> list:
+        """Parse comma-separated batch endpoints into list"""
+        return [e.strip() for e in self.batch_endpoints.split(",") if e.strip()]
+
+
 class FileServerSettings(BaseModel):
     """File server configuration for PDF/document serving"""
     base_url: str = Field(default="http://localhost:7700")
@@ -89,7 +131,9 @@ class QCMSettings(BaseModel):
     """QCM (Multiple Choice Question) generation settings"""
     retriever_top_k: int = Field(default=15, description="Chunks to retrieve for question generation")
     answer_top_k: int = Field(default=5, description="Chunks to retrieve per answer")
+    candidate_k: int = Field(default=30, description="BM25/vector candidates fused before keeping the top chunks")
     max_questions: int = Field(default=20, description="Maximum questions per QCM")
+    state_cache_size: int = Field(default=1024, description="Conversation states cached by history hash")
 
 
 class CourseSettings(BaseModel):
@@ -97,9 +141,20 @@ class CourseSettings(BaseModel):
     retriever_top_k: int = Field(default=5, description="Sources per query in retrieval")
     enhancer_iterations: int = Field(default=3, description="Max iterations for knowledge enhancement")
     enhancer_top_k: int = Field(default=5, description="Sources per gap-filling query")
+    candidate_k: int = Field(default=20, description="BM25/vector candidates fused before keeping the top sources")
     output_base_dir: str = Field(default="./course_outputs", description="Directory for course outputs")
     enable_logging: bool = Field(default=True, description="Enable course generation logging")
     heartbeat_interval: int = Field(default=10, description="Seconds between heartbeats")
+    job_workers: int = Field(default=1, description="Course generation jobs running at the same time")
+    chapter_concurrency: int = Field(default=1, description="Chapters of one course detailed at the same time (at most LLM batch_concurrency)")
+    chapter_context_tokens: int = Field(default=3000, description="Knowledge slice per chapter in tokens (0 = whole knowledge base)")
+
+
+class ContextSettings(BaseModel):
+    """Prompt context assembly (token budget, near-duplicate filtering)"""
+    max_tokens: int = Field(default=6000, description="Token budget for the knowledge base of one query")
+    dedup_threshold: float = Field(default=0.8, description="Shingle Jaccard similarity above which a chunk is a near-duplicate")
+    encoding: str = Field(default="o200k_base", description="tiktoken encoding used to count tokens")
 
 
 class StreamingSettings(BaseModel):
@@ -109,6 +164,16 @@ class StreamingSettings(BaseModel):
     heartbeat_interval: int = Field(default=10, description="Heartbeat interval in seconds")
 
 
+class TracingSettings(BaseModel):
+    """Request tracing configuration (spans, sampling, export)"""
+    enabled: bool = Field(default=True, description="Record spans for RAG, course and QCM requests")
+    export_path: Optional[str] = Field(default="traces/traces.jsonl", description="OTLP/JSON lines file for sampled traces")
+    otlp_endpoint: Optional[str] = Field(default=None, description="OTLP/HTTP collector base URL (e.g. http://localhost:4318)")
+    slow_threshold_ms: float = Field(default=10000, description="Always export traces slower than this")
+    sample_rate: float = Field(default=0.0, description="Fraction of fast traces exported anyway")
+    service_name: str = Field(default="universal-chatbot-server")
+
+
 class ServerSettings(BaseModel):
     """Server configuration"""
     host: str = Field(default="0.0.0.0")
@@ -152,7 +217,8 @@ class CORSSettings(BaseModel):
 class RAGSettings(BaseModel):
     """RAG model configuration"""
     model: str = Field(default="gpt-oss:20b")
-    default_top_k: int = Field(default=30)
+    default_top_k: int = Field(default=8)
+    candidate_k: int = Field(default=30)
     chunk_size: int = Field(default=5)
     chunk_delay: float = Field(default=0.01)
     temperature: float = Field(default=0.7)
@@ -202,6 +268,17 @@ class Settings(BaseSettings):
     ollama_base_url: str = Field(default="http://localhost:11434", alias="OLLAMA_BASE_URL")
     ollama_api_key: Optional[str] = Field(default=None, alias="OLLAMA_API_KEY")
 
+    # LLM gateway
+    llm_max_concurrency: int = Field(default=2, alias="LLM_MAX_CONCURRENCY")
+    llm_model_concurrency: Optional[str] = Field(default=None, alias="LLM_MODEL_CONCURRENCY")
+    llm_batch_concurrency: int = Field(default=1, alias="LLM_BATCH_CONCURRENCY")
+    llm_batch_endpoints: str = Field(default="course,qcm.generate", alias="LLM_BATCH_ENDPOINTS")
+    llm_queue_timeout: float = Field(default=300, alias="LLM_QUEUE_TIMEOUT")
+    llm_pool_connections: int = Field(default=16, alias="LLM_POOL_CONNECTIONS")
+    llm_request_timeout: float = Field(default=600, alias="LLM_REQUEST_TIMEOUT")
+    llm_keep_alive: Optional[str] = Field(default="30m", alias="LLM_KEEP_ALIVE")
+    llm_warmup: bool = Field(default=True, alias="LLM_WARMUP")
+
     # File Server
     fileserver_base: str = Field(default="http://localhost:7700", alias="FILESERVER_BASE")
     fileserver_public_url: Optional[str] = Field(default=None, alias="FILESERVER_PUBLIC_URL")
@@ -220,17 +297,35 @@ class Settings(BaseSettings):
     qcm_retriever_top_k: int = Field(default=15, alias="QCM_RETRIEVER_TOP_K")
     qcm_answer_top_k: int = Field(default=5, alias="QCM_ANSWER_TOP_K")
     qcm_max_questions: int = Field(default=20, alias="QCM_MAX_QUESTIONS")
+    qcm_candidate_k: int = Field(default=30, alias="QCM_CANDIDATE_K")
+    qcm_state_cache_size: int = Field(default=1024, alias="QCM_STATE_CACHE_SIZE")
 
     # Course
     course_retriever_top_k: int = Field(default=5, alias="COURSE_RETRIEVER_TOP_K")
     course_enhancer_iterations: int = Field(default=3, alias="COURSE_ENHANCER_ITERATIONS")
     course_enhancer_top_k: int = Field(default=5, alias="COURSE_ENHANCER_TOP_K")
+    course_candidate_k: int = Field(default=20, alias="COURSE_CANDIDATE_K")
+    course_job_workers: int = Field(default=1, alias="COURSE_JOB_WORKERS")
+    course_chapter_concurrency: int = Field(default=1, alias="COURSE_CHAPTER_CONCURRENCY")
+    course_chapter_context_tokens: int = Field(default=3000, alias="COURSE_CHAPTER_CONTEXT_TOKENS")
+
+    # Context assembly
+    context_max_tokens: int = Field(default=6000, alias="CONTEXT_MAX_TOKENS")
+    context_dedup_threshold: float = Field(default=0.8, alias="CONTEXT_DEDUP_THRESHOLD")
+    context_encoding: str = Field(default="o200k_base", alias="CONTEXT_ENCODING")
 
     # Streaming
     stream_queue_timeout: float = Field(default=0.1, alias="STREAM_QUEUE_TIMEOUT")
     stream_sleep_interval: float = Field(default=0.01, alias="STREAM_SLEEP_INTERVAL")
     heartbeat_interval: int = Field(default=10, alias="HEARTBEAT_INTERVAL")
 
+    # Tracing
+    tracing_enabled: bool = Field(default=True, alias="TRACING_ENABLED")
+    tracing_export_path: Optional[str] = Field(default="traces/traces.jsonl", alias="TRACING_EXPORT_PATH")
+    tracing_otlp_endpoint: Optional[str] = Field(default=None, alias="TRACING_OTLP_ENDPOINT")
+    tracing_slow_threshold_ms: float = Field(default=10000, alias="TRACING_SLOW_THRESHOLD_MS")
+    tracing_sample_rate: float = Field(default=0.0, alias="TRACING_SAMPLE_RATE")
+
     # Authentication
     auth_tokens: Optional[str] = Field(default=None, alias="AUTH_TOKENS")
 
@@ -256,6 +351,22 @@ class Settings(BaseSettings):
             api_key=self.ollama_api_key,
         )
 
+    @computed_field
+    @property
+    def llm(self) -> LLMSettings:
+        """LLM gateway settings"""
+        return LLMSettings(
+            max_concurrency=self.llm_max_concurrency,
+            model_concurrency=self.llm_model_concurrency,
+            batch_concurrency=self.llm_batch_concurrency,
+            batch_endpoints=self.llm_batch_endpoints,
+            queue_timeout=self.llm_queue_timeout,
+            pool_connections=self.llm_pool_connections,
+            request_timeout=self.llm_request_timeout,
+            keep_alive=self.llm_keep_alive,
+            warmup=self.llm_warmup,
+        )
+
     @computed_field
     @property
     def fileserver(self) -> FileServerSettings:
@@ -285,6 +396,8 @@ class Settings(BaseSettings):
             retriever_top_k=self.qcm_retriever_top_k,
             answer_top_k=self.qcm_answer_top_k,
             max_questions=self.qcm_max_questions,
+            candidate_k=self.qcm_candidate_k,
+            state_cache_size=self.qcm_state_cache_size,
         )
 
     @computed_field
@@ -295,6 +408,20 @@ class Settings(BaseSettings):
             retriever_top_k=self.course_retriever_top_k,
             enhancer_iterations=self.course_enhancer_iterations,
             enhancer_top_k=self.course_enhancer_top_k,
+            candidate_k=self.course_candidate_k,
+            job_workers=self.course_job_workers,
+            chapter_concurrency=self.course_chapter_concurrency,
+            chapter_context_tokens=self.course_chapter_context_tokens,
+        )
+
+    @computed_field
+    @property
+    def context(self) -> ContextSettings:
+        """Context assembly settings"""
+        return ContextSettings(
+            max_tokens=self.context_max_tokens,
+            dedup_threshold=self.context_dedup_threshold,
+            encoding=self.context_encoding,
         )
 
     @computed_field
@@ -307,6 +434,21 @@ class Settings(BaseSettings):
             heartbeat_interval=self.heartbeat_interval,
         )
 
+    @computed_field
+    @property
+    def tracing(self) -> TracingSettings:
+        """Tracing settings"""
+        export_path = self.tracing_export_path
+        if export_path and not Path(export_path).is_absolute():
+            export_path = str(BASE_DIR / export_path)
+        return TracingSettings(
+            enabled=self.tracing_enabled,
+            export_path=export_path or None,
+            otlp_endpoint=self.tracing_otlp_endpoint,
+            slow_threshold_ms=self.tracing_slow_threshold_ms,
+            sample_rate=self.tracing_sample_rate,
+        )
+
     # ==========================================================================
     # Backwards compatibility: Load from config.ini
     # ==========================================================================
@@ -412,6 +554,10 @@ class Settings(BaseSettings):
     def VECTOR_WEIGHT(self) -> float:
         return self.vector_weight
 
+    @property
+    def RRF_K(self) -> int:
+        return self.rrf_k
+
     @property
     def RETRIEVER_TOP_K(self) -> int:
         return self.retriever_top_k
@@ -428,6 +574,10 @@ class Settings(BaseSettings):
     def QCM_ANSWER_TOP_K(self) -> int:
         return self.qcm_answer_top_k
 
+    @property
+    def QCM_CANDIDATE_K(self) -> int:
+        return self.qcm_candidate_k
+
     @property
     def COURSE_RETRIEVER_TOP_K(self) -> int:
         return self.course_retriever_top_k
@@ -440,6 +590,10 @@ class Settings(BaseSettings):
     def COURSE_ENHANCER_TOP_K(self) -> int:
         return self.course_enhancer_top_k
 
+    @property
+    def COURSE_CANDIDATE_K(self) -> int:
+        return self.course_candidate_k
+
     # Config.ini based settings (for full backwards compatibility)
     @property
     def SERVER_HOST(self) -> str:
@@ -492,7 +646,13 @@ class Settings(BaseSettings):
     @property
     def RAG_DEFAULT_TOP_K(self) -> int:
         if self._config_ini:
-            return self._config_ini.getint("rag", "default_top_k", fallback=30)
+            return self._config_ini.getint("rag", "default_top_k", fallback=8)
+        return 8
+
+    @property
+    def RAG_CANDIDATE_K(self) -> int:
+        if self._config_ini:
+            return self._config_ini.getint("rag", "candidate_k", fallback=30)
         return 30
 
     @property
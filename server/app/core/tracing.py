@@ -0,0 +1,406 @@
+"""
+Request Tracing
+===============
+
+In-process tracing for the RAG, course and QCM pipelines. A request opens a
+root span in the route/service layer; every retrieval, LLM call and agent step
+underneath opens a nested span. When the root span closes, the whole trace is
+either dropped or exported, depending on its latency.
+
+Architecture
+------------
+
+    route (request_id)
+       │
+       ▼
+    start_trace("course.generate")            ◄── root span, owns the Trace
+       │
+       ├── span("course.retriever.retrieve_knowledge")
+       │      ├── span("retriever.retrieve")
+       │      │      ├── span("retriever.bm25")
+       │      │      └── span("retriever.vector")
+       │      └── span("llm.generate")
+       └── ...
+
+The current span lives in a ContextVar, so nesting follows the call stack.
+Threads do NOT inherit context automatically: the sync generators run by
+streaming_utils open their root span inside the worker thread (see
+trace_generator), and thread pools must use propagate() to carry the context.
+
+Sampling
+--------
+    - Traces slower than TRACING_SLOW_THRESHOLD_MS are always exported
+    - Traces that ended with an error are always exported
+    - Other traces are exported with probability TRACING_SAMPLE_RATE
+
+Export Format
+-------------
+Each exported trace is one line of OTLP/JSON (the payload of an OTLP/HTTP
+`POST /v1/traces` request). The file can be replayed into any OpenTelemetry
+collector with the `otlpjsonfile` receiver; if TRACING_OTLP_ENDPOINT is set,
+the same payload is also POSTed to `{endpoint}/v1/traces`.
+
+Usage:
+    from app.core.tracing import tracer, traced
+
+    with tracer.start_trace("rag.query", request_id=request_id):
+        with tracer.span("retriever.retrieve", top_k=5):
+            ...
+
+    @traced("llm.generate")
+    def call_llm(system_prompt, user_prompt): ...
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import random
+import secrets
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+import requests
+
+from app.core.settings import settings
+
+
+# OTLP enum values (opentelemetry/proto/trace/v1/trace.proto)
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+# =============================================================================
+# SPANS & TRACES
+# =============================================================================
+
+class Span:
+    """A timed operation inside a trace."""
+
+    def __init__(self, trace, name: str, parent=None, kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status_code = STATUS_CODE_OK
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes})
+
+    def record_exception(self, exc: BaseException):
+        self.status_code = STATUS_CODE_ERROR
+        self.status_message = f"{type(exc).__name__}: {exc}"
+        self.add_event("exception", type=type(exc).__name__, message=str(exc))
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.trace.add(self)
+
+
+class _NoopSpan:
+    """Returned by span() when no trace is active, so callers never branch."""
+
+    duration_ms = 0.0
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """All finished spans of one request. Spans may finish on several threads."""
+
+    def __init__(self, request_id: str):
+        self.trace_id = secrets.token_hex(16)
+        self.request_id = request_id
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+
+# =============================================================================
+# EXPORTERS
+# =============================================================================
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def to_otlp_json(trace: Trace, service_name: str) -> Dict[str, Any]:
+    """Serialize a trace as an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for span in trace.spans:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or span.start_ns),
+            "attributes": _otlp_attributes({**span.attributes, "request.id": trace.request_id}),
+            "events": [
+                {
+                    "name": e["name"],
+                    "timeUnixNano": str(e["time_ns"]),
+                    "attributes": _otlp_attributes(e["attributes"]),
+                }
+                for e in span.events
+            ],
+            "status": {"code": span.status_code, "message": span.status_message},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+            "scopeSpans": [{"scope": {"name": "app.core.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class FileSpanExporter:
+    """Appends one OTLP/JSON payload per line to a local file."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, payload: Dict[str, Any]):
+        line = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class OTLPHttpSpanExporter:
+    """Posts OTLP/JSON payloads to a collector (`{endpoint}/v1/traces`) in the background."""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def export(self, payload: Dict[str, Any]):
+        def _post():
+            try:
+                self._session.post(self.url, json=payload, timeout=self.timeout)
+            except Exception as e:
+                print(f"[WARNING] Trace export to {self.url} failed: {e}")
+
+        threading.Thread(target=_post, daemon=True).start()
+
+
+# =============================================================================
+# TRACER
+# =============================================================================
+
+class Tracer:
+    """Creates spans, tracks the current one, and exports sampled traces."""
+
+    def __init__(self, enabled: bool = True, slow_threshold_ms: float = 10000,
+                 sample_rate: float = 0.0, exporters: Optional[list] = None,
+                 service_name: str = "universal-chatbot-server"):
+        self.enabled = enabled
+        self.slow_threshold_ms = slow_threshold_ms
+        self.sample_rate = sample_rate
+        self.exporters = exporters or []
+        self.service_name = service_name
+
+    @contextmanager
+    def start_trace(self, name: str, request_id: Optional[str] = None, **attributes):
+        """Open the root span of a request. Nested start_trace calls become plain spans."""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+
+        if _current_span.get() is not None:
+            with self.span(name, **attributes) as span:
+                yield span
+            return
+
+        trace = Trace(request_id or new_request_id())
+        root = Span(trace, name, kind=SPAN_KIND_SERVER, attributes=attributes)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()
+            self._finish(trace, root)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Open a child span of the current span (no-op outside a trace)."""
+        parent = _current_span.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+
+        span = Span(parent.trace, name, parent=parent, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def _finish(self, trace: Trace, root: Span):
+        slow = root.duration_ms >= self.slow_threshold_ms
+        failed = any(s.status_code == STATUS_CODE_ERROR for s in trace.spans)
+        if not (slow or failed or random.random() < self.sample_rate):
+            return
+
+        if slow:
+            print(f"[tracing] Slow trace '{root.name}' ({root.duration_ms:.0f} ms, "
+                  f"{len(trace.spans)} spans, request_id={trace.request_id})")
+
+        payload = to_otlp_json(trace, self.service_name)
+        for exporter in self.exporters:
+            try:
+                exporter.export(payload)
+            except Exception as e:
+                print(f"[WARNING] Trace export failed: {e}")
+
+
+def _build_tracer() -> Tracer:
+    cfg = settings.tracing
+    exporters = []
+    if cfg.export_path:
+        exporters.append(FileSpanExporter(cfg.export_path))
+    if cfg.otlp_endpoint:
+        exporters.append(OTLPHttpSpanExporter(cfg.otlp_endpoint))
+    return Tracer(
+        enabled=cfg.enabled,
+        slow_threshold_ms=cfg.slow_threshold_ms,
+        sample_rate=cfg.sample_rate,
+        exporters=exporters,
+        service_name=cfg.service_name,
+    )
+
+
+tracer = _build_tracer()
+
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def get_request_id() -> Optional[str]:
+    """Request id of the active trace, or None outside a trace."""
+    span = _current_span.get()
+    return span.trace.request_id if span is not None else None
+
+
+def current_span():
+    """The active span, or a no-op span outside a trace."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def traced(name: Optional[str] = None):
+    """Decorator wrapping a function (or generator function) in a span."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                with tracer.span(span_name):
+                    yield from func(*args, **kwargs)
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def trace_generator(
+    name: str,
+    generator_func: Callable[..., Generator],
+    *args: Any,
+    request_id: Optional[str] = None,
+    attributes: Optional[Dict[str, Any]] = None,
+    **kwargs: Any
+) -> Generator:
+    """
+    Run a sync generator inside a root span.
+
+    Meant to be handed to async_stream_wrapper so the root span is opened in
+    the worker thread that actually iterates the generator.
+    """
+    with tracer.start_trace(name, request_id=request_id, **(attributes or {})):
+        yield from generator_func(*args, **kwargs)
+
+
+def propagate(func: Callable) -> Callable:
+    """Bind func to a copy of the current context (for thread pools)."""
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so each call
+        # runs in its own copy.
+        return ctx.copy().run(func, *args, **kwargs)
+
+    return wrapper
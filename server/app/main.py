@@ -1,10 +1,27 @@
 """
 Main FastAPI application factory
 """
+import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.settings import settings
-from app.api.routes import rag, course, qcm
+from app.api.routes import rag, course, qcm, llm
+from app.services.course_jobs import course_jobs
+from app.core.llm_gateway import gateway
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up the LLM, resume course jobs interrupted by a restart; stop the job pool on shutdown"""
+    if settings.llm.warmup:
+        # Loading a model can take a while: don't hold up startup
+        threading.Thread(
+            target=gateway.warm_up, args=([settings.RAG_MODEL],), name="llm-warmup", daemon=True
+        ).start()
+    course_jobs.resume_pending()
+    yield
+    course_jobs.shutdown()
 
 
 def create_app() -> FastAPI:
@@ -17,7 +34,8 @@ def create_app() -> FastAPI:
     app = FastAPI(
         title="RAG Server for LibreChat",
         description="RAG and Course Generation API",
-        version="1.0.0"
+        version="1.0.0",
+        lifespan=lifespan
     )
 
     # Configure CORS
@@ -33,6 +51,7 @@ def create_app() -> FastAPI:
     app.include_router(rag.router)
     app.include_router(course.router)
     app.include_router(qcm.router, prefix="/qcm", tags=["QCM Generation"])
+    app.include_router(llm.router)
 
     # Root endpoint
     @app.get("/")
@@ -44,7 +63,8 @@ def create_app() -> FastAPI:
             "endpoints": {
                 "rag": "/rag",
                 "course": "/course",
-                "qcm": "/qcm"
+                "qcm": "/qcm",
+                "llm": "/llm"
             }
         }
 
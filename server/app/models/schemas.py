@@ -18,4 +18,4 @@ class ChatRequest(BaseModel):
     stream: bool = True
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = None
-    top_k: Optional[int] = 5
+    top_k: Optional[int] = None
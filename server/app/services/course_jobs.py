@@ -0,0 +1,351 @@
+"""
+Course Generation Jobs
+======================
+
+Course generation runs as a background job instead of inside the HTTP
+stream, so a dropped connection no longer loses the work: the stream only
+follows the job, and any client can reattach to it later.
+
+Architecture
+------------
+
+    POST /course/api/chat/completions
+       │
+       ├──► submit() ──► worker pool (COURSE_JOB_WORKERS threads)
+       │                    │
+       │                    ▼
+       │                 stream_course_generation_progress(checkpoint=...)
+       │                    │  progress ──► events.jsonl
+       │                    │  checkpoint ► checkpoint.json
+       │                    │  complete ──► results.json + course.md
+       │                    ▼
+       └──◄ follow(job_id, after) ◄── events.jsonl (replay, then live)
+
+Job Directory
+-------------
+{COURSE_OUTPUT_BASE_DIR}/jobs/<job_id>/
+    job.json          status, subject, config, last finished phase, error
+    events.jsonl      progress events, one JSON object per line, numbered by "seq"
+    checkpoint.json   pipeline state after the last finished step
+    results.json      course structure and source counts (when completed)
+    course.md         course markdown (when completed)
+
+Resuming
+--------
+The pipeline checkpoints after the retriever, after each enhancer iteration
+and after the course generator. On startup, jobs that a previous process left
+queued or running are resubmitted and continue after their last checkpoint,
+so a crash only costs the step in progress. Failed jobs can be resumed the
+same way with POST /course/api/jobs/{job_id}/resume.
+
+Reattaching
+-----------
+GET /course/api/jobs/{job_id}/events?after=<seq> replays the events after
+`seq` and then follows the job live until it ends.
+"""
+
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Generator, List, Optional
+
+from course_build_agents.orchestrator_with_logging import stream_course_generation_progress
+from app.core.settings import settings, BASE_DIR
+from app.core.tracing import trace_generator
+
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+TERMINAL = (COMPLETED, FAILED)
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _write_json(path: Path, data):
+    """Atomic write: readers see the old or the new file, never half of it."""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+class CourseJob:
+    """One course generation run and its files."""
+
+    def __init__(self, job_dir: Path, meta: Dict):
+        self.dir = job_dir
+        self.meta = meta
+        self._cond = threading.Condition()
+        self._seq = self._count_events()
+
+    @property
+    def id(self) -> str:
+        return self.meta["job_id"]
+
+    @property
+    def status(self) -> str:
+        return self.meta["status"]
+
+    @property
+    def seq(self) -> int:
+        """Number of the last event written."""
+        return self._seq
+
+    def to_dict(self) -> Dict:
+        return {
+            **{k: v for k, v in self.meta.items() if k != "config"},
+            "events": self._seq,
+            "has_result": (self.dir / "results.json").exists(),
+        }
+
+    # ------------------------------------------------------------------
+    # Status
+    # ------------------------------------------------------------------
+
+    def update(self, **fields):
+        with self._cond:
+            self.meta.update(fields, updated_at=_now())
+            _write_json(self.dir / "job.json", self.meta)
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # Events
+    # ------------------------------------------------------------------
+
+    def append_event(self, event: Dict) -> int:
+        with self._cond:
+            self._seq += 1
+            line = json.dumps({"seq": self._seq, **event}, ensure_ascii=False)
+            with open(self.dir / "events.jsonl", "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._cond.notify_all()
+            return self._seq
+
+    def read_events(self, offset: int = 0):
+        """Events written since byte `offset`. Returns (events, new_offset)."""
+        path = self.dir / "events.jsonl"
+        if not path.exists():
+            return [], offset
+        events = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Line still being written
+                offset += len(line)
+                events.append(json.loads(line))
+        return events, offset
+
+    def wait(self, timeout: float):
+        """Block until a new event or status change (or timeout)."""
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def _count_events(self) -> int:
+        path = self.dir / "events.jsonl"
+        if not path.exists():
+            return 0
+        with open(path, "rb") as f:
+            return sum(1 for _ in f)
+
+    # ------------------------------------------------------------------
+    # Checkpoint & results
+    # ------------------------------------------------------------------
+
+    def load_checkpoint(self) -> Optional[Dict]:
+        return _read_json(self.dir / "checkpoint.json")
+
+    def save_checkpoint(self, state: Dict):
+        _write_json(self.dir / "checkpoint.json", state)
+
+    def load_results(self) -> Optional[Dict]:
+        results = _read_json(self.dir / "results.json")
+        if results is not None:
+            md_path = self.dir / "course.md"
+            results["course_markdown"] = md_path.read_text(encoding="utf-8") if md_path.exists() else ""
+        return results
+
+    def save_results(self, results: Dict):
+        (self.dir / "course.md").write_text(results.get("course_markdown", ""), encoding="utf-8")
+        _write_json(self.dir / "results.json", {k: v for k, v in results.items() if k != "course_markdown"})
+
+
+class CourseJobManager:
+    """Submits course jobs to a worker pool and tracks them on disk."""
+
+    def __init__(self, base_dir: Path, workers: int = 1):
+        self.base_dir = Path(base_dir)
+        self.workers = max(1, workers)
+        self._jobs: Dict[str, CourseJob] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, subject: str, config: Dict, request_id: Optional[str] = None) -> CourseJob:
+        job_id = uuid.uuid4().hex[:16]
+        job_dir = self.base_dir / job_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+        job = CourseJob(job_dir, {
+            "job_id": job_id,
+            "subject": subject,
+            "collection": config.get("collection_name"),
+            "config": config,
+            "request_id": request_id,
+            "status": QUEUED,
+            "phase": None,
+            "error": None,
+            "created_at": _now(),
+            "updated_at": _now(),
+        })
+        job.update()
+        with self._lock:
+            self._jobs[job_id] = job
+        self._schedule(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[CourseJob]:
+        if not job_id.isalnum():
+            return None  # Job ids are hex; also keeps lookups inside base_dir
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._load(job_id)
+                if job is not None:
+                    self._jobs[job_id] = job
+            return job
+
+    def list_jobs(self) -> List[Dict]:
+        jobs = []
+        if self.base_dir.exists():
+            for job_dir in self.base_dir.iterdir():
+                job = self.get(job_dir.name) if job_dir.is_dir() else None
+                if job is not None:
+                    jobs.append(job.to_dict())
+        return sorted(jobs, key=lambda j: j["created_at"], reverse=True)
+
+    def resume(self, job_id: str) -> Optional[CourseJob]:
+        """Resubmit a failed job; it continues after its last checkpoint."""
+        job = self.get(job_id)
+        if job is None or job.status != FAILED:
+            return job
+        job.update(status=QUEUED, error=None)
+        self._schedule(job)
+        return job
+
+    def resume_pending(self) -> int:
+        """Resubmit jobs a previous process left queued or running."""
+        count = 0
+        if not self.base_dir.exists():
+            return 0
+        for job_dir in sorted(self.base_dir.iterdir()):
+            job = self.get(job_dir.name) if job_dir.is_dir() else None
+            if job is not None and job.status in (QUEUED, RUNNING):
+                job.append_event({"type": "progress", "content": "\n↺ Serveur redémarré, reprise de la génération...\n"})
+                job.update(status=QUEUED)
+                self._schedule(job)
+                count += 1
+        if count:
+            print(f"[course_jobs] Resumed {count} interrupted job(s)")
+        return count
+
+    def follow(self, job_id: str, after: int = 0, poll_interval: float = 1.0) -> Generator[Dict, None, None]:
+        """
+        Replay the events of a job after `after`, then follow it until it ends.
+
+        'complete' events are yielded with the job results attached.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return
+        offset = 0
+        while True:
+            # Status first: once terminal, every event is already on disk
+            finished = job.status in TERMINAL
+            events, offset = job.read_events(offset)
+            for event in events:
+                if event["seq"] <= after:
+                    continue
+                after = event["seq"]
+                if event["type"] == "complete":
+                    event["results"] = job.load_results() or {}
+                yield event
+            if finished and not events:
+                return
+            if not events:
+                job.wait(poll_interval)
+
+    def shutdown(self):
+        """Stop accepting work. Running jobs stay 'running' and resume at next startup."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule(self, job: CourseJob):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="course-job")
+            executor = self._executor
+        executor.submit(self._run, job)
+
+    def _load(self, job_id: str) -> Optional[CourseJob]:
+        job_dir = self.base_dir / job_id
+        meta = _read_json(job_dir / "job.json") if job_dir.is_dir() else None
+        return CourseJob(job_dir, meta) if meta else None
+
+    def _run(self, job: CourseJob):
+        checkpoint = job.load_checkpoint()
+        job.update(status=RUNNING)
+        if checkpoint:
+            job.append_event({"type": "progress", "content": f"↺ Reprise après l'étape '{job.meta.get('phase')}'\n"})
+
+        try:
+            for update in trace_generator(
+                "course.generate", stream_course_generation_progress,
+                job.meta["subject"], job.meta["config"],
+                checkpoint=checkpoint,
+                request_id=job.meta.get("request_id"),
+                attributes={"collection": job.meta.get("collection"), "job_id": job.id, "resumed": bool(checkpoint)}
+            ):
+                if update["type"] == "checkpoint":
+                    job.save_checkpoint(update["state"])
+                    job.update(phase=update["phase"])
+                elif update["type"] == "progress":
+                    job.append_event({"type": "progress", "content": update["content"]})
+                elif update["type"] == "complete":
+                    results = update["results"]
+                    job.save_results(results)
+                    job.append_event({
+                        "type": "complete",
+                        "total_chapters": results["course_structure"].get("total_chapters", 0),
+                        "final_source_count": results["final_source_count"],
+                        "sources_added": results["sources_added"],
+                    })
+            job.update(status=COMPLETED, phase="done")
+
+        except Exception as e:
+            print(f"[WARNING] Course job {job.id} failed: {e}")
+            job.append_event({"type": "error", "content": str(e)})
+            job.update(status=FAILED, error=str(e))
+
+
+def _jobs_dir() -> Path:
+    path = Path(settings.COURSE_OUTPUT_BASE_DIR) / "jobs"
+    return path if path.is_absolute() else BASE_DIR / path
+
+
+# Shared instance for the server process
+course_jobs = CourseJobManager(_jobs_dir(), workers=settings.course.job_workers)
@@ -1,49 +1,89 @@
 """
 Course generation service
+
+Course generation runs as a background job (see course_jobs.py); the
+streaming response follows the job's events, so a dropped connection does
+not stop the generation and the stream can be reattached later.
 """
-import os
 import json
 import asyncio
 import uuid
 from datetime import datetime
-from course_build_agents.orchestrator_with_logging import stream_course_generation_progress
 from app.core.settings import settings
+from app.services.course_jobs import course_jobs, CourseJob
 from app.services.streaming_utils import async_stream_wrapper_with_heartbeat
 
 
-async def stream_course_generation(subject: str, model: str = "course-generator", collection_name: str = None):
+def submit_course_job(subject: str, collection_name: str, request_id: str = None) -> CourseJob:
     """
-    Stream course generation with progress as reasoning_content
+    Submit a course generation job with the configured agent settings
 
     Args:
         subject: Course subject/topic
-        model: Model identifier
         collection_name: Name of the collection to use for RAG queries
+        request_id: Id of the request, attached to the trace
 
-    Yields:
-        str: Server-sent events formatted response chunks
+    Returns:
+        CourseJob: The queued job
     """
-    message_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
-    created_timestamp = int(datetime.now().timestamp())
-
     config = {
         'retriever_top_k': settings.course.retriever_top_k,
         'enhancer_iterations': settings.course.enhancer_iterations,
         'enhancer_top_k': settings.course.enhancer_top_k,
+        'candidate_k': settings.course.candidate_k,
+        'chapter_concurrency': settings.course.chapter_concurrency,
+        'chapter_context_tokens': settings.course.chapter_context_tokens,
         'collection_name': collection_name,
     }
+    return course_jobs.submit(subject, config, request_id=request_id)
+
+
+async def stream_course_generation(
+    job_id: str,
+    model: str = "course-generator",
+    after: int = 0
+):
+    """
+    Stream the progress of a course job as reasoning_content, then the course
+
+    Args:
+        job_id: Id of the course job to follow
+        model: Model identifier
+        after: Replay only the events after this sequence number (reattach)
+
+    Yields:
+        str: Server-sent events formatted response chunks
+    """
+    message_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created_timestamp = int(datetime.now().timestamp())
 
     try:
         loop = asyncio.get_event_loop()
 
-        # Track last heartbeat time
-        last_heartbeat = asyncio.get_event_loop().time()
-        heartbeat_interval = 10  # seconds
-
-        # Run the streaming generator in executor and process updates
+        # Heartbeat interval in seconds
+        heartbeat_interval = 10
+
+        if after == 0:
+            job_info_chunk = {
+                "id": message_id,
+                "object": "chat.completion.chunk",
+                "created": created_timestamp,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {
+                        "role": "assistant",
+                        "reasoning_content": f"Tâche de génération : {job_id}\n"
+                    },
+                    "finish_reason": None
+                }]
+            }
+            yield f"data: {json.dumps(job_info_chunk)}\n\n"
+
+        # Follow the job's events in executor
         # (bridges sync generator to async iteration with heartbeat support)
         async for update in async_stream_wrapper_with_heartbeat(
-            loop, stream_course_generation_progress, subject, config,
+            loop, course_jobs.follow, job_id, after,
             heartbeat_interval=heartbeat_interval
         ):
             if update['type'] == 'heartbeat':
@@ -79,6 +119,20 @@ async def stream_course_generation(subject: str, model: str = "course-generator"
                 }
                 yield f"data: {json.dumps(progress_chunk)}\n\n"
 
+            elif update['type'] == 'error':
+                error_chunk = {
+                    "id": message_id,
+                    "object": "chat.completion.chunk",
+                    "created": created_timestamp,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": f"\n\nErreur: {update['content']}"},
+                        "finish_reason": None
+                    }]
+                }
+                yield f"data: {json.dumps(error_chunk)}\n\n"
+
             elif update['type'] == 'complete':
                 # Get final results
                 results = update['results']
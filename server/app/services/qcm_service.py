@@ -19,13 +19,15 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from qcm_agents.orchestrator import handle_qcm_conversation, stream_qcm_generation
 from qcm_agents.state_manager import StateManagerAgent
 from app.core.settings import settings
+from app.core.tracing import trace_generator
 from app.services.streaming_utils import async_stream_wrapper_with_heartbeat
 
 
 async def stream_qcm_response(
     messages: List[Dict],
     model: str = "qcm-generator",
-    collection_name: str = None
+    collection_name: str = None,
+    request_id: str = None
 ) -> AsyncGenerator[str, None]:
     """
     Stream la réponse de conversation QCM en SSE.
@@ -38,6 +40,7 @@ async def stream_qcm_response(
         messages: HISTORIQUE COMPLET des messages [{"role": "user"|"assistant", "content": str}, ...]
         model: Nom du modèle pour la réponse
         collection_name: Nom de la collection à utiliser pour les requêtes RAG
+        request_id: Identifiant de la requête, rattaché à la trace
 
     Yields:
         str: Chunks formatés en SSE
@@ -48,6 +51,7 @@ async def stream_qcm_response(
     config = {
         'retriever_top_k': settings.qcm.retriever_top_k,
         'answer_top_k': settings.qcm.answer_top_k,
+        'candidate_k': settings.qcm.candidate_k,
         'collection_name': collection_name,
     }
 
@@ -70,9 +74,13 @@ async def stream_qcm_response(
         # Stream la gestion de conversation avec l'historique COMPLET
         async for update in async_stream_wrapper_with_heartbeat(
             loop,
+            trace_generator,
+            "qcm.conversation",
             handle_qcm_conversation,
             messages,  # Passer l'historique COMPLET
             config,
+            request_id=request_id,
+            attributes={"collection": collection_name, "turns": len(messages)},
             heartbeat_interval=10
         ):
             if update['type'] == 'heartbeat':
@@ -158,7 +166,8 @@ async def stream_qcm_direct_generation(
     difficulty: str,
     number: int,
     model: str = "qcm-generator",
-    collection_name: str = None
+    collection_name: str = None,
+    request_id: str = None
 ) -> AsyncGenerator[str, None]:
     """
     Stream la génération de QCM directement (sans gestion d'état).
@@ -171,6 +180,7 @@ async def stream_qcm_direct_generation(
         number: Nombre de questions
         model: Nom du modèle pour la réponse
         collection_name: Nom de la collection à utiliser pour les requêtes RAG
+        request_id: Identifiant de la requête, rattaché à la trace
 
     Yields:
         str: Chunks formatés en SSE
@@ -181,6 +191,7 @@ async def stream_qcm_direct_generation(
     config = {
         'retriever_top_k': settings.qcm.retriever_top_k,
         'answer_top_k': settings.qcm.answer_top_k,
+        'candidate_k': settings.qcm.candidate_k,
         'collection_name': collection_name,
     }
 
@@ -202,11 +213,15 @@ async def stream_qcm_direct_generation(
 
         async for update in async_stream_wrapper_with_heartbeat(
             loop,
+            trace_generator,
+            "qcm.generate",
             stream_qcm_generation,
             topic,
             difficulty,
             number,
             config,
+            request_id=request_id,
+            attributes={"collection": collection_name, "difficulty": difficulty, "number": number},
             heartbeat_interval=10
         ):
             if update['type'] == 'heartbeat':
@@ -7,18 +7,28 @@ import uuid
 from datetime import datetime
 from rag_engine.rag import stream_rag_with_thinking
 from app.core.settings import settings
+from app.core.tracing import trace_generator
 from app.services.streaming_utils import async_stream_wrapper
 
 
-async def stream_rag_response(question: str, top_k: int = 5, model: str = "rag-hybrid", collection_name: str = "btp"):
+async def stream_rag_response(
+    question: str,
+    top_k: int = 5,
+    model: str = "rag-hybrid",
+    collection_name: str = "btp",
+    candidate_k: int = None,
+    request_id: str = None
+):
     """
-    Stream RAG response with thinking from Ollama, then corrected final response
+    Stream RAG response from Ollama with citation links, then the sources list
 
     Args:
         question: User question
-        top_k: Number of top results to retrieve
+        top_k: Number of chunks sent to the LLM
         model: Model identifier
         collection_name: Collection name to query
+        candidate_k: Number of BM25/vector candidates fused before keeping top_k
+        request_id: Id of the request, attached to the trace
 
     Yields:
         str: Server-sent events formatted response chunks
@@ -31,10 +41,16 @@ async def stream_rag_response(question: str, top_k: int = 5, model: str = "rag-h
 
         # Use the async wrapper to stream in real-time
         # (bridges sync generator to async iteration)
-        async for update in async_stream_wrapper(loop, stream_rag_with_thinking, question, collection_name, top_k):
-            if update['type'] == 'thinking':
-                # Stream Ollama response as reasoning_content (thinking box)
-                thinking_chunk = {
+        async for update in async_stream_wrapper(
+            loop, trace_generator, "rag.stream", stream_rag_with_thinking,
+            question, collection_name, top_k,
+            candidate_k=candidate_k,
+            request_id=request_id,
+            attributes={"collection": collection_name, "top_k": top_k, "candidate_k": candidate_k}
+        ):
+            if update['type'] == 'content':
+                # Stream the answer as it is generated (citations already linked)
+                content_chunk = {
                     "id": message_id,
                     "object": "chat.completion.chunk",
                     "created": created_timestamp,
@@ -43,25 +59,23 @@ async def stream_rag_response(question: str, top_k: int = 5, model: str = "rag-h
                         "index": 0,
                         "delta": {
                             "role": "assistant",
-                            "reasoning_content": update['content']
+                            "content": update['content']
                         },
                         "finish_reason": None
                     }]
                 }
-                yield f"data: {json.dumps(thinking_chunk)}\n\n"
+                yield f"data: {json.dumps(content_chunk)}\n\n"
 
             elif update['type'] == 'final':
-                # Send final corrected response with sources
-                answer_with_links = update['content']
+                # Append the sources block (only the cited sources, not the answer again)
                 used_sources = update['sources']
 
+                sources_text = ""
                 if used_sources:
                     sources_text = "\n\n**Sources:**\n"
                     for idx, source in enumerate(used_sources, 1):
                         sources_text += f"{idx}. [{source['title']}]({source['url']})\n"
-                    answer_with_links += sources_text
 
-                # Send complete final response
                 final_content_chunk = {
                     "id": message_id,
                     "object": "chat.completion.chunk",
@@ -69,7 +83,7 @@ async def stream_rag_response(question: str, top_k: int = 5, model: str = "rag-h
                     "model": model,
                     "choices": [{
                         "index": 0,
-                        "delta": {"content": answer_with_links},
+                        "delta": {"content": sources_text},
                         "finish_reason": "stop"
                     }]
                 }
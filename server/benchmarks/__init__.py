@@ -0,0 +1,7 @@
+"""
+Offline benchmarks for the server pipelines.
+
+Each benchmark runs the real server code against local stand-ins for the
+external services (Elasticsearch, Qdrant, Ollama), so results are comparable
+from one commit to the next without a running stack.
+"""
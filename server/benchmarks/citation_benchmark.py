@@ -0,0 +1,146 @@
+"""
+Citation Rewriting Micro-Benchmark
+==================================
+
+Times rag_engine.citations.add_citation_links() against the previous
+implementation (kept below as legacy_add_citation_links) on synthetic long
+answers, and checks that both produce the same output.
+
+The legacy version looked up each URL with a linear scan over the sources
+for every marker and made three regex passes over the text, so its cost grew
+with markers x sources; the current one is a single pass with dict lookups.
+
+Usage (from the server/ directory):
+    python -m benchmarks.citation_benchmark
+    python -m benchmarks.citation_benchmark --sources 50 200 1000 --markers 2000 --repeat 5
+"""
+
+import argparse
+import json
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+# This project uses a flat directory structure without a formal Python package.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from rag_engine.citations import add_citation_links
+
+
+def legacy_add_citation_links(text, sources):
+    """Previous rag_engine.rag implementation, kept for comparison."""
+    used_sources = re.findall(r'\[\s*source\s+(\d+)\s*\]', text, flags=re.IGNORECASE)
+
+    used_sources = map(int, used_sources)
+    source_mapping = {}
+    order = 1
+    url_to_order = {}
+    for src in used_sources:
+        if src not in source_mapping:
+            source_url = next((s['url'] for s in sources if s['id'] == src), '#')
+            if source_url not in url_to_order:
+                url_to_order[source_url] = order
+                source_mapping[src] = order
+                order += 1
+            else:
+                source_mapping[src] = url_to_order[source_url]
+
+    def replace_source(match):
+        source_num = int(match.group(1))
+        if source_num in source_mapping:
+            sequential_num = source_mapping[source_num]
+            source_url = next((s['url'] for s in sources if s['id'] == source_num), '#')
+            return f'[{sequential_num}]({source_url})'
+        return match.group(0)
+
+    text = re.sub(r'\[\s*SOURCE\s+(\d+)\s*\]', replace_source, text)
+    text = re.sub(r'(\[\d+\]\([^)]+\))(\s*\1)+', r'\1', text)
+    return text, source_mapping
+
+
+def synthetic_sources(count: int, rng: random.Random) -> List[Dict]:
+    # ~1 source in 5 shares its URL with another (several chunks of one document)
+    urls = [f"https://files.example.org/download/{i:06x}" for i in range(max(1, count * 4 // 5))]
+    return [
+        {"id": i, "url": urls[i - 1] if i <= len(urls) else rng.choice(urls), "title": f"Document {i}"}
+        for i in range(1, count + 1)
+    ]
+
+
+def synthetic_answer(num_sources: int, markers: int, rng: random.Random) -> str:
+    words = ("béton", "armature", "coffrage", "dalle", "poutre", "charge", "norme",
+             "enrobage", "fissuration", "résistance", "ciment", "granulat")
+    parts = []
+    for _ in range(markers):
+        parts.append(" ".join(rng.choice(words) for _ in range(rng.randint(8, 30))))
+        # Mostly single citations, sometimes repeated or grouped like LLMs do
+        cited = [rng.randint(1, num_sources) for _ in range(rng.choice((1, 1, 1, 2, 3)))]
+        if rng.random() < 0.1:
+            cited.append(cited[-1])
+        parts.append(" " + " ".join(f"[SOURCE {c}]" for c in cited) + ".")
+    return " ".join(parts)
+
+
+def _time(func, text, sources, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text, sources)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def run_case(num_sources: int, markers: int, repeat: int, seed: int) -> Dict:
+    rng = random.Random(seed)
+    sources = synthetic_sources(num_sources, rng)
+    text = synthetic_answer(num_sources, markers, rng)
+
+    expected = legacy_add_citation_links(text, sources)
+    actual = add_citation_links(text, sources)
+
+    legacy = _time(legacy_add_citation_links, text, sources, repeat)
+    current = _time(add_citation_links, text, sources, repeat)
+    return {
+        "sources": num_sources,
+        "markers": markers,
+        "text_chars": len(text),
+        "legacy_ms": round(statistics.median(legacy), 3),
+        "current_ms": round(statistics.median(current), 3),
+        "speedup": round(statistics.median(legacy) / max(statistics.median(current), 1e-9), 1),
+        "identical": expected[0] == actual[0] and expected[1] == actual[1],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark add_citation_links() on long answers")
+    parser.add_argument("--sources", type=int, nargs="+", default=[10, 100, 500, 2000])
+    parser.add_argument("--markers", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="Citation groups per synthetic answer")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (median reported)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'sources':>8} {'markers':>8} {'chars':>9} {'legacy ms':>10} {'current ms':>11} {'speedup':>8}  same")
+    for num_sources in args.sources:
+        for markers in args.markers:
+            r = run_case(num_sources, markers, args.repeat, args.seed)
+            results.append(r)
+            print(f"{r['sources']:>8} {r['markers']:>8} {r['text_chars']:>9} {r['legacy_ms']:>10.2f} "
+                  f"{r['current_ms']:>11.2f} {r['speedup']:>7.1f}x  {'yes' if r['identical'] else 'NO'}")
+
+    if args.output:
+        out = Path(args.output)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({"results": results}, indent=2), encoding="utf-8")
+        print(f"Results written to {out}")
+
+    return 0 if all(r["identical"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
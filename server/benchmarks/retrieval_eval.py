@@ -0,0 +1,296 @@
+"""
+Offline Retrieval Evaluation
+============================
+
+Sweeps the hybrid retriever parameters over a labeled query set and reports
+quality (recall@k, MRR, nDCG@k) next to the latency of each configuration:
+
+    candidate_k   depth of the BM25 and vector searches   (RETRIEVER_TOP_K)
+    final_k       chunks kept after fusion                (RETRIEVER_FINAL_K)
+    rrf_k         RRF smoothing constant                  (RRF_K)
+    bm25_weight   BM25 share of the fused score           (BM25_WEIGHT, VECTOR_WEIGHT = 1 - BM25_WEIGHT)
+
+Only the ratio of the two weights affects the ranking, so sweeping
+bm25_weight with vector_weight = 1 - bm25_weight covers the space.
+
+Runs fully offline: searches go through the real bm25_search/vector_search/
+hybrid_re_rank code backed by the in-memory stand-ins (benchmarks/standins.py),
+loaded from a snapshot made with benchmarks/snapshot.py.
+
+Labeled Set Format
+------------------
+JSONL, one query per line; relevance is binary (list) or graded (dict):
+    {"query": "dosage béton C25/30", "relevant": ["<point id>", "<point id>"]}
+    {"query": "...", "relevant": {"<point id>": 2, "<point id>": 1}}
+
+Query Embeddings
+----------------
+Snapshot vectors come from the real embedding model, so query vectors must
+too. They are read from --embedding-cache; with --embed-with-ollama, missing
+ones are computed once through Ollama and written back to the cache. Without
+snapshot vectors, both sides use the deterministic hash embedding.
+
+Latency
+-------
+Per configuration: measured search time at candidate_k + measured fusion
+time + measured time of one batched hydration of final_k chunks (fetch_chunks).
+
+Usage (from the server/ directory):
+    python -m benchmarks.snapshot btp snapshots/btp.jsonl --with-vectors
+    python -m benchmarks.retrieval_eval snapshots/btp.jsonl labels/btp.jsonl \\
+        --embedding-cache snapshots/btp_queries.json --embed-with-ollama \\
+        --output bench/eval_btp.json
+"""
+
+import argparse
+import json
+import math
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from itertools import product
+from pathlib import Path
+from typing import Dict, List
+
+# This project uses a flat directory structure without a formal Python package.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from retrivers import hybrid_retriever
+from benchmarks.standins import StandinStack, load_snapshot
+
+
+# ==========================================================
+# METRICS
+# ==========================================================
+
+def recall_at_k(ranked: List[str], relevant: Dict[str, float], k: int) -> float:
+    if not relevant:
+        return 0.0
+    hits = sum(1 for doc_id in ranked[:k] if doc_id in relevant)
+    return hits / len(relevant)
+
+
+def reciprocal_rank(ranked: List[str], relevant: Dict[str, float], k: int) -> float:
+    for rank, doc_id in enumerate(ranked[:k]):
+        if doc_id in relevant:
+            return 1.0 / (rank + 1)
+    return 0.0
+
+
+def ndcg_at_k(ranked: List[str], relevant: Dict[str, float], k: int) -> float:
+    dcg = sum(relevant.get(doc_id, 0.0) / math.log2(rank + 2) for rank, doc_id in enumerate(ranked[:k]))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum(grade / math.log2(rank + 2) for rank, grade in enumerate(ideal))
+    return dcg / idcg if idcg > 0 else 0.0
+
+
+# ==========================================================
+# INPUTS
+# ==========================================================
+
+def load_labels(path: str) -> List[dict]:
+    """Load the labeled set as [{"query": str, "relevant": {id: grade}}]."""
+    labeled = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            relevant = entry.get("relevant") or {}
+            if isinstance(relevant, list):
+                relevant = {str(doc_id): 1.0 for doc_id in relevant}
+            else:
+                relevant = {str(doc_id): float(grade) for doc_id, grade in relevant.items()}
+            if entry.get("query") and relevant:
+                labeled.append({"query": entry["query"], "relevant": relevant})
+    return labeled
+
+
+def load_query_vectors(queries: List[str], cache_path: str, embed_with_ollama: bool) -> Dict[str, List[float]]:
+    """Read cached query embeddings, computing and caching missing ones if allowed."""
+    cache = {}
+    path = Path(cache_path) if cache_path else None
+    if path and path.exists():
+        cache = json.loads(path.read_text(encoding="utf-8"))
+
+    missing = [q for q in queries if q not in cache]
+    if missing and embed_with_ollama:
+        print(f"Embedding {len(missing)} queries with {hybrid_retriever.settings.EMBED_MODEL}...")
+        for q in missing:
+            cache[q] = hybrid_retriever._embed(q)
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(cache), encoding="utf-8")
+        missing = []
+
+    if missing:
+        raise SystemExit(
+            f"Error: {len(missing)} queries have no cached embedding; "
+            f"rerun with --embed-with-ollama to compute them once"
+        )
+    return cache
+
+
+# ==========================================================
+# SWEEP
+# ==========================================================
+
+def _mean_ms(samples: List[float]) -> float:
+    return statistics.fmean(samples) if samples else 0.0
+
+
+def evaluate(stack: StandinStack, labeled: List[dict], candidate_ks: List[int], final_ks: List[int],
+             rrf_ks: List[int], bm25_weights: List[float]) -> List[Dict]:
+    """Run every configuration and return one result dict per configuration."""
+    # Batched hydration cost per final_k, measured once
+    point_ids = stack.qdrant.point_ids(stack.collection)
+    fetch_ms = {}
+    for final_k in final_ks:
+        samples = []
+        for _ in range(10):
+            start = time.perf_counter()
+            hybrid_retriever.fetch_chunks(point_ids[:final_k], stack.collection)
+            samples.append((time.perf_counter() - start) * 1000)
+        fetch_ms[final_k] = _mean_ms(samples)
+
+    results = []
+    for candidate_k in candidate_ks:
+        # Searches depend only on candidate_k: run them once per depth
+        searched = []
+        search_ms = []
+        for item in labeled:
+            start = time.perf_counter()
+            bm25_res = hybrid_retriever.bm25_search(item["query"], stack.index, top_k=candidate_k)
+            vec_res = hybrid_retriever.vector_search(item["query"], stack.collection, top_k=candidate_k)
+            search_ms.append((time.perf_counter() - start) * 1000)
+            searched.append((bm25_res, vec_res))
+
+        for final_k, rrf_k, bm25_weight in product(final_ks, rrf_ks, bm25_weights):
+            if final_k > candidate_k:
+                continue
+
+            recalls, rrs, ndcgs, fusion_ms = [], [], [], []
+            for item, (bm25_res, vec_res) in zip(labeled, searched):
+                start = time.perf_counter()
+                fused = hybrid_retriever.hybrid_re_rank(
+                    bm25_res, vec_res, final_k,
+                    bm25_weight=bm25_weight, vector_weight=1.0 - bm25_weight, rrf_k=rrf_k,
+                )
+                fusion_ms.append((time.perf_counter() - start) * 1000)
+
+                ranked = [str(doc_id) for doc_id, _ in fused]
+                recalls.append(recall_at_k(ranked, item["relevant"], final_k))
+                rrs.append(reciprocal_rank(ranked, item["relevant"], final_k))
+                ndcgs.append(ndcg_at_k(ranked, item["relevant"], final_k))
+
+            results.append({
+                "candidate_k": candidate_k,
+                "final_k": final_k,
+                "rrf_k": rrf_k,
+                "bm25_weight": bm25_weight,
+                "vector_weight": round(1.0 - bm25_weight, 4),
+                "recall": round(statistics.fmean(recalls), 4),
+                "mrr": round(statistics.fmean(rrs), 4),
+                "ndcg": round(statistics.fmean(ndcgs), 4),
+                "search_ms": round(_mean_ms(search_ms), 3),
+                "fusion_ms": round(_mean_ms(fusion_ms), 3),
+                "latency_ms": round(_mean_ms(search_ms) + _mean_ms(fusion_ms) + fetch_ms[final_k], 3),
+            })
+    return results
+
+
+def recommend(results: List[Dict], tolerance: float) -> Dict:
+    """Cheapest configuration whose nDCG is within `tolerance` of the best one."""
+    best = max(results, key=lambda r: (r["ndcg"], r["recall"]))
+    eligible = [r for r in results if r["ndcg"] >= best["ndcg"] - tolerance]
+    cheapest = min(eligible, key=lambda r: (r["candidate_k"], r["final_k"], r["latency_ms"], -r["ndcg"]))
+    return {"best": best, "recommended": cheapest}
+
+
+# ==========================================================
+# CLI
+# ==========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline retrieval quality/latency sweep for the hybrid retriever")
+    parser.add_argument("snapshot", help="JSONL corpus snapshot (see benchmarks/snapshot.py)")
+    parser.add_argument("labels", help="JSONL labeled queries")
+    parser.add_argument("--candidate-k", type=int, nargs="+", default=[5, 8, 15, 30])
+    parser.add_argument("--final-k", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--rrf-k", type=int, nargs="+", default=[20, 60, 100])
+    parser.add_argument("--bm25-weight", type=float, nargs="+", default=[0.2, 0.35, 0.5, 0.65, 0.8])
+    parser.add_argument("--embedding-cache", help="JSON file of {query: vector}")
+    parser.add_argument("--embed-with-ollama", action="store_true",
+                        help="Compute missing query embeddings through Ollama (once) and cache them")
+    parser.add_argument("--es-latency-ms", type=float, default=0.0)
+    parser.add_argument("--qdrant-latency-ms", type=float, default=0.0)
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="nDCG loss accepted for a cheaper configuration (default: 0.01)")
+    parser.add_argument("--show", type=int, default=15, help="Rows to print (default: 15)")
+    parser.add_argument("--output", help="Write all results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    corpus = load_snapshot(args.snapshot)
+    labeled = load_labels(args.labels)
+    if not corpus or not labeled:
+        print("Error: empty snapshot or labeled set")
+        return 1
+
+    # Resolve query vectors before the stand-ins replace the Ollama session
+    has_vectors = any(d.get("vector") for d in corpus)
+    query_vectors = {}
+    if has_vectors:
+        query_vectors = load_query_vectors(
+            [item["query"] for item in labeled], args.embedding_cache, args.embed_with_ollama
+        )
+
+    print(f"Indexing {len(corpus)} chunks, {len(labeled)} labeled queries...")
+    stack = StandinStack(
+        corpus,
+        analyzer=hybrid_retriever.normalize_and_lemmatize,
+        es_latency_ms=args.es_latency_ms,
+        qdrant_latency_ms=args.qdrant_latency_ms,
+    )
+    stack.session.vectors = query_vectors
+
+    with stack.installed(hybrid_retriever):
+        results = evaluate(stack, labeled, args.candidate_k, args.final_k, args.rrf_k, args.bm25_weight)
+
+    if not results:
+        print("Error: no valid configuration (final_k must be <= candidate_k)")
+        return 1
+
+    picks = recommend(results, args.tolerance)
+
+    ranked = sorted(results, key=lambda r: (-r["ndcg"], r["latency_ms"]))
+    print(f"\n{'cand':>5} {'final':>5} {'rrf':>4} {'w_bm25':>6} {'recall':>7} {'mrr':>6} {'ndcg':>6} {'latency':>10}")
+    for r in ranked[:args.show]:
+        print(f"{r['candidate_k']:>5} {r['final_k']:>5} {r['rrf_k']:>4} {r['bm25_weight']:>6.2f} "
+              f"{r['recall']:>7.3f} {r['mrr']:>6.3f} {r['ndcg']:>6.3f} {r['latency_ms']:>8.2f}ms")
+
+    for label, r in (("Best", picks["best"]), ("Recommended", picks["recommended"])):
+        print(f"\n{label}: RETRIEVER_TOP_K={r['candidate_k']} RETRIEVER_FINAL_K={r['final_k']} "
+              f"RRF_K={r['rrf_k']} BM25_WEIGHT={r['bm25_weight']} VECTOR_WEIGHT={r['vector_weight']} "
+              f"(nDCG={r['ndcg']:.3f}, recall={r['recall']:.3f}, {r['latency_ms']:.1f} ms)")
+
+    if args.output:
+        out = Path(args.output)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({
+            "evaluation": "hybrid_retriever",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "snapshot": args.snapshot,
+            "labels": args.labels,
+            "queries": len(labeled),
+            "tolerance": args.tolerance,
+            **picks,
+            "results": results,
+        }, indent=2), encoding="utf-8")
+        print(f"\nResults written to {out}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
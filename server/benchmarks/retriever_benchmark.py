@@ -0,0 +1,257 @@
+"""
+Hybrid Retriever Benchmark
+==========================
+
+Replays a query log against hybrid_retriever.retrieve() backed by local
+stand-ins (see benchmarks/standins.py) and reports latency percentiles and
+throughput for every (top_k, concurrency) combination.
+
+Query Log Format
+----------------
+JSONL, one request per line. The query text is taken from the first present
+key among: query, question, prompt, message, title (+ body). A plain-text
+file with one query per line is also accepted. Without --queries, queries
+are sampled from the corpus.
+
+Usage (from the server/ directory):
+    python -m benchmarks.retriever_benchmark
+    python -m benchmarks.retriever_benchmark --queries logs/queries.jsonl \\
+        --snapshot snapshots/btp.jsonl --top-k 5 10 20 --concurrency 1 4 16
+    python -m benchmarks.retriever_benchmark --output bench/current.json \\
+        --baseline bench/baseline.json --max-regression 0.15
+
+Exit code is 1 when --baseline is given and any combination regressed by
+more than --max-regression (p95 latency up, or throughput down).
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# This project uses a flat directory structure without a formal Python package.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from retrivers import hybrid_retriever
+from benchmarks.standins import StandinStack, load_snapshot, synthetic_corpus, synthetic_queries
+
+
+_QUERY_KEYS = ("query", "question", "prompt", "message")
+
+
+# ==========================================================
+# INPUTS
+# ==========================================================
+
+def load_queries(path: str) -> List[str]:
+    """Load queries from a JSONL request log (or one plain query per line)."""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                queries.append(line)
+                continue
+
+            if isinstance(entry, str):
+                queries.append(entry)
+                continue
+
+            text = next((entry[k] for k in _QUERY_KEYS if entry.get(k)), None)
+            if text is None and entry.get("title"):
+                text = f"{entry['title']} {entry.get('body', '')}".strip()
+            if text:
+                queries.append(text)
+    return queries
+
+
+# ==========================================================
+# MEASUREMENT
+# ==========================================================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def run_case(stack: StandinStack, queries: List[str], top_k: int, concurrency: int,
+             candidate_k: Optional[int] = None) -> Dict:
+    """Replay all queries with `concurrency` workers and collect per-call latencies."""
+    def one(query: str):
+        start = time.perf_counter()
+        try:
+            hybrid_retriever.retrieve(query, stack.collection, stack.index, top_k=top_k, candidate_k=candidate_k)
+            return (time.perf_counter() - start) * 1000, None
+        except Exception as e:
+            return (time.perf_counter() - start) * 1000, e
+
+    stack.reset_counters()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, queries))
+    wall_s = time.perf_counter() - wall_start
+
+    latencies = sorted(ms for ms, _ in outcomes)
+    errors = sum(1 for _, err in outcomes if err is not None)
+
+    return {
+        "top_k": top_k,
+        "concurrency": concurrency,
+        "queries": len(queries),
+        "errors": errors,
+        "mean_ms": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p90_ms": round(percentile(latencies, 90), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+        "throughput_qps": round(len(queries) / wall_s, 2) if wall_s > 0 else 0.0,
+        "backend_calls": {
+            "es": stack.es.calls,
+            "qdrant": stack.qdrant.calls,
+            "embed": stack.session.calls,
+        },
+    }
+
+
+# ==========================================================
+# REGRESSION CHECK
+# ==========================================================
+
+def compare_to_baseline(results: List[Dict], baseline: Dict, max_regression: float) -> List[str]:
+    """Return one message per (top_k, concurrency) case that regressed."""
+    base_cases = {(r["top_k"], r["concurrency"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        base = base_cases.get((r["top_k"], r["concurrency"]))
+        if base is None:
+            continue
+        case = f"top_k={r['top_k']} concurrency={r['concurrency']}"
+        if base["p95_ms"] > 0 and r["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{case}: p95 {base['p95_ms']:.1f} -> {r['p95_ms']:.1f} ms")
+        if base["throughput_qps"] > 0 and r["throughput_qps"] < base["throughput_qps"] * (1 - max_regression):
+            regressions.append(
+                f"{case}: throughput {base['throughput_qps']:.1f} -> {r['throughput_qps']:.1f} qps"
+            )
+    return regressions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5, cwd=Path(__file__).parent,
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ==========================================================
+# CLI
+# ==========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark hybrid_retriever.retrieve() against local stand-ins")
+    parser.add_argument("--queries", help="JSONL query log (default: sampled from the corpus)")
+    parser.add_argument("--snapshot", help="JSONL corpus snapshot (default: synthetic corpus)")
+    parser.add_argument("--docs", type=int, default=500, help="Synthetic corpus size (default: 500)")
+    parser.add_argument("--num-queries", type=int, default=200, help="Synthetic query count (default: 200)")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[5, 10, 20])
+    parser.add_argument("--candidate-k", type=int,
+                        help="Search depth per method (default: RETRIEVER_TOP_K, never below top_k)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the query log N times per case")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed queries before each run")
+    parser.add_argument("--es-latency-ms", type=float, default=5.0)
+    parser.add_argument("--qdrant-latency-ms", type=float, default=5.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Previous results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.20,
+                        help="Allowed relative regression vs baseline (default: 0.20)")
+    args = parser.parse_args(argv)
+
+    corpus = load_snapshot(args.snapshot) if args.snapshot else synthetic_corpus(args.docs)
+    queries = load_queries(args.queries) if args.queries else synthetic_queries(corpus, args.num_queries)
+    if not corpus or not queries:
+        print("Error: empty corpus or query log")
+        return 1
+    queries = queries * max(1, args.repeat)
+
+    print(f"Indexing {len(corpus)} chunks into stand-ins...")
+    stack = StandinStack(
+        corpus,
+        analyzer=hybrid_retriever.normalize_and_lemmatize,
+        es_latency_ms=args.es_latency_ms,
+        qdrant_latency_ms=args.qdrant_latency_ms,
+        embed_latency_ms=args.embed_latency_ms,
+    )
+
+    results = []
+    with stack.installed(hybrid_retriever):
+        for q in queries[:args.warmup]:
+            hybrid_retriever.retrieve(q, stack.collection, stack.index)
+
+        print(f"\n{'top_k':>5} {'conc':>5} {'p50':>9} {'p90':>9} {'p95':>9} {'p99':>9} {'qps':>9} {'err':>4}")
+        for top_k in args.top_k:
+            for concurrency in args.concurrency:
+                r = run_case(stack, queries, top_k, concurrency, candidate_k=args.candidate_k)
+                results.append(r)
+                print(f"{top_k:>5} {concurrency:>5} {r['p50_ms']:>7.1f}ms {r['p90_ms']:>7.1f}ms "
+                      f"{r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms {r['throughput_qps']:>9.1f} {r['errors']:>4}")
+
+    report = {
+        "benchmark": "hybrid_retriever.retrieve",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "corpus": args.snapshot or f"synthetic:{args.docs}",
+            "corpus_size": len(corpus),
+            "queries": args.queries or f"synthetic:{args.num_queries}",
+            "query_count": len(queries),
+            "candidate_k": args.candidate_k,
+            "es_latency_ms": args.es_latency_ms,
+            "qdrant_latency_ms": args.qdrant_latency_ms,
+            "embed_latency_ms": args.embed_latency_ms,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        out = Path(args.output)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nResults written to {out}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare_to_baseline(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\nREGRESSION vs {args.baseline} (> {args.max_regression:.0%}):")
+            for msg in regressions:
+                print(f"  - {msg}")
+            return 1
+        print(f"\nNo regression vs {args.baseline}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
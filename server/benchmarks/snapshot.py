@@ -0,0 +1,78 @@
+"""
+Collection Snapshot Dump
+========================
+
+Exports a Qdrant collection to the JSONL snapshot format read by
+benchmarks/standins.load_snapshot(), so benchmarks and evaluations can run
+offline against real chunks (and, with --with-vectors, real embeddings).
+
+Usage (from the server/ directory):
+    python -m benchmarks.snapshot btp snapshots/btp.jsonl --with-vectors
+    python -m benchmarks.snapshot btp snapshots/btp_sample.jsonl --limit 2000
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from qdrant_client import QdrantClient
+
+# This project uses a flat directory structure without a formal Python package.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from app.core.settings import settings
+
+
+def dump_collection(qdrant_collection: str, output: str, with_vectors: bool = False,
+                    limit: int = None, batch_size: int = 256) -> int:
+    """Scroll the whole collection and write one chunk per line. Returns the count."""
+    client = QdrantClient(url=settings.QDRANT_URL)
+    out = Path(output)
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    written = 0
+    offset = None
+    with open(out, "w", encoding="utf-8") as f:
+        while True:
+            points, offset = client.scroll(
+                collection_name=qdrant_collection,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=with_vectors,
+            )
+            for pt in points:
+                payload = pt.payload or {}
+                record = {
+                    "id": str(pt.id),
+                    "chunk_text": payload.get("chunk_text", ""),
+                    "hash": payload.get("hash"),
+                    "metadata": payload.get("metadata"),
+                    "citation": payload.get("citation"),
+                }
+                if with_vectors and isinstance(pt.vector, list):
+                    record["vector"] = pt.vector
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                written += 1
+                if limit and written >= limit:
+                    return written
+            if offset is None:
+                return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dump a Qdrant collection to a JSONL snapshot")
+    parser.add_argument("collection", help="Collection name from collections.json (or a raw Qdrant collection)")
+    parser.add_argument("output", help="Output JSONL path")
+    parser.add_argument("--with-vectors", action="store_true", help="Include stored embeddings")
+    parser.add_argument("--limit", type=int, help="Stop after N chunks")
+    args = parser.parse_args(argv)
+
+    qdrant_collection = settings.COLLECTIONS.get(args.collection, {}).get("qdrant_collection", args.collection)
+    count = dump_collection(qdrant_collection, args.output, args.with_vectors, args.limit)
+    print(f"Wrote {count} chunks from '{qdrant_collection}' to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+Local Stand-ins for Elasticsearch, Qdrant and Ollama Embeddings
+===============================================================
+
+In-memory replacements that expose exactly the client surface used by
+retrivers/hybrid_retriever.py:
+
+    Elasticsearch.search(index, size, query={"match": {"text": ...}}, stored_fields=[...])
+    QdrantClient.query_points(collection_name, query, limit, with_payload, with_vectors)
+    QdrantClient.retrieve(collection_name, ids, with_payload, with_vectors)
+    requests.Session.post(f"{OLLAMA_BASE_URL}/api/embeddings", json={...})
+
+Each stand-in can simulate a per-call network latency (time.sleep, which
+releases the GIL like real socket I/O), so concurrency numbers stay
+meaningful.
+
+Corpus Sources
+--------------
+    - load_snapshot(path): JSONL, one chunk per line
+          {"id": ..., "chunk_text": ..., "hash": ..., "metadata": {...}, "vector": [...]}
+      ("vector" is optional; missing vectors are computed with the fake embedder)
+    - synthetic_corpus(n_docs): deterministic French-like chunks for quick runs
+
+Usage:
+    from benchmarks.standins import StandinStack, synthetic_corpus
+    from retrivers import hybrid_retriever
+
+    stack = StandinStack(synthetic_corpus(500), analyzer=hybrid_retriever.normalize_and_lemmatize)
+    with stack.installed(hybrid_retriever):
+        hybrid_retriever.retrieve("...", stack.collection, stack.index)
+"""
+
+import hashlib
+import json
+import math
+import random
+import re
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _sleep_ms(ms: float):
+    if ms > 0:
+        time.sleep(ms / 1000.0)
+
+
+# ==========================================================
+# EMBEDDINGS (Ollama stand-in)
+# ==========================================================
+
+def hash_embedding(text: str, dim: int = 64) -> List[float]:
+    """
+    Deterministic bag-of-words embedding (feature hashing, L2-normalized).
+
+    Texts sharing words get similar vectors, so vector search behaves
+    plausibly without a model.
+    """
+    vec = [0.0] * dim
+    for token in _tokenize(text):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        h = int.from_bytes(digest, "little")
+        sign = 1.0 if (h >> 63) & 1 else -1.0
+        vec[h % dim] += sign
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class _FakeResponse:
+    def __init__(self, payload: dict):
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._payload
+
+
+class FakeEmbeddingSession:
+    """Replaces the requests.Session used for Ollama /api/embeddings calls."""
+
+    def __init__(self, dim: int = 64, latency_ms: float = 0.0,
+                 vectors: Optional[Dict[str, List[float]]] = None):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.vectors = vectors or {}
+        self.calls = 0
+
+    def post(self, url, json=None, **kwargs):
+        self.calls += 1
+        _sleep_ms(self.latency_ms)
+        prompt = (json or {}).get("prompt", "")
+        vec = self.vectors.get(prompt)
+        if vec is None:
+            vec = hash_embedding(prompt, self.dim)
+        return _FakeResponse({"embedding": vec})
+
+
+# ==========================================================
+# ELASTICSEARCH (BM25 stand-in)
+# ==========================================================
+
+class InMemoryElasticsearch:
+    """Okapi BM25 over an in-memory inverted index (k1=1.2, b=0.75, like ES)."""
+
+    def __init__(self, latency_ms: float = 0.0, k1: float = 1.2, b: float = 0.75):
+        self.latency_ms = latency_ms
+        self.k1 = k1
+        self.b = b
+        self._indices: Dict[str, dict] = {}
+        self.calls = 0
+
+    def info(self):
+        return {"version": {"number": "in-memory"}}
+
+    def index_documents(self, index: str, docs: Iterable[tuple]):
+        """Index (doc_id, analyzed_text) pairs."""
+        postings: Dict[str, Dict[str, int]] = {}
+        lengths: Dict[str, int] = {}
+        for doc_id, text in docs:
+            tokens = _tokenize(text)
+            lengths[doc_id] = len(tokens)
+            for token in tokens:
+                tf = postings.setdefault(token, {})
+                tf[doc_id] = tf.get(doc_id, 0) + 1
+
+        n_docs = len(lengths) or 1
+        self._indices[index] = {
+            "postings": postings,
+            "lengths": lengths,
+            "avgdl": (sum(lengths.values()) / n_docs) or 1.0,
+            "n_docs": n_docs,
+        }
+
+    def search(self, index: str, size: int = 10, query: Optional[dict] = None, **kwargs):
+        self.calls += 1
+        _sleep_ms(self.latency_ms)
+        idx = self._indices.get(index)
+        if idx is None:
+            raise KeyError(f"index_not_found_exception: {index}")
+
+        text = ((query or {}).get("match") or {}).get("text", "")
+        postings, lengths = idx["postings"], idx["lengths"]
+        n_docs, avgdl = idx["n_docs"], idx["avgdl"]
+
+        scores: Dict[str, float] = {}
+        for token in set(_tokenize(text)):
+            tf_map = postings.get(token)
+            if not tf_map:
+                continue
+            df = len(tf_map)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in tf_map.items():
+                norm = self.k1 * (1 - self.b + self.b * lengths[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda x: -x[1])[:size]
+        return {
+            "hits": {
+                "hits": [
+                    {"_id": doc_id, "_score": score, "fields": {"doc_id": [doc_id]}}
+                    for doc_id, score in top
+                ]
+            }
+        }
+
+
+# ==========================================================
+# QDRANT (vector stand-in)
+# ==========================================================
+
+class InMemoryQdrant:
+    """Exact cosine search over normalized vectors held in memory."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self._collections: Dict[str, dict] = {}
+        self.calls = 0
+
+    def upsert_points(self, collection_name: str, points: Iterable[dict]):
+        """Add points given as {"id", "vector", "payload"} dicts."""
+        col = self._collections.setdefault(collection_name, {"points": {}})
+        for p in points:
+            vec = list(p["vector"])
+            norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+            col["points"][p["id"]] = {
+                "vector": [v / norm for v in vec],
+                "payload": p.get("payload") or {},
+            }
+
+    def _collection(self, name: str) -> dict:
+        col = self._collections.get(name)
+        if col is None:
+            raise KeyError(f"Collection `{name}` doesn't exist!")
+        return col
+
+    def point_ids(self, collection_name: str) -> List:
+        return list(self._collection(collection_name)["points"])
+
+    def query_points(self, collection_name: str, query, limit: int = 10,
+                     with_payload=True, with_vectors=False, **kwargs):
+        self.calls += 1
+        _sleep_ms(self.latency_ms)
+        col = self._collection(collection_name)
+
+        norm = math.sqrt(sum(v * v for v in query)) or 1.0
+        q = [v / norm for v in query]
+        scored = [
+            (pid, sum(a * b for a, b in zip(q, p["vector"])))
+            for pid, p in col["points"].items()
+        ]
+        scored.sort(key=lambda x: -x[1])
+        return SimpleNamespace(points=[
+            self._point(pid, col["points"][pid], score, with_payload, with_vectors)
+            for pid, score in scored[:limit]
+        ])
+
+    def retrieve(self, collection_name: str, ids, with_payload=True, with_vectors=False, **kwargs):
+        self.calls += 1
+        _sleep_ms(self.latency_ms)
+        col = self._collection(collection_name)
+        return [
+            self._point(pid, col["points"][pid], None, with_payload, with_vectors)
+            for pid in ids
+            if pid in col["points"]
+        ]
+
+    @staticmethod
+    def _point(pid, point, score, with_payload, with_vectors):
+        return SimpleNamespace(
+            id=pid,
+            score=score,
+            payload=point["payload"] if with_payload else None,
+            vector=point["vector"] if with_vectors else None,
+        )
+
+
+# ==========================================================
+# CORPORA
+# ==========================================================
+
+_VOCABULARY = (
+    "béton armature coffrage dalle poutre poteau fondation chantier sécurité "
+    "norme eurocode charge résistance compression traction acier ciment granulat "
+    "malaxage cure fissure joint étanchéité isolation thermique acoustique façade "
+    "toiture charpente bois maçonnerie enduit mortier parpaing brique plancher "
+    "escalier ascenseur ventilation chauffage plomberie électricité câblage "
+    "réglementation contrôle qualité essai laboratoire réception ouvrage devis "
+    "planning budget marché appel offre sous-traitance responsabilité assurance "
+    "garantie décennale dommage expertise diagnostic rénovation démolition"
+).split()
+
+
+def synthetic_corpus(n_docs: int = 500, words_per_doc: int = 120, seed: int = 42) -> List[dict]:
+    """Deterministic chunks drawn from a small domain vocabulary (Zipf-like)."""
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(_VOCABULARY))]
+    docs = []
+    for i in range(n_docs):
+        vocab = _VOCABULARY[:]
+        rng.shuffle(vocab)  # each doc gets its own dominant topics
+        words = rng.choices(vocab, weights=weights, k=words_per_doc)
+        text = " ".join(words)
+        docs.append({
+            "id": f"synthetic-{i:06d}",
+            "chunk_text": text,
+            "hash": hashlib.sha256(f"doc-{i // 10}".encode()).hexdigest(),
+            "metadata": {"chunk_index": i % 10},
+        })
+    return docs
+
+
+def synthetic_queries(corpus: List[dict], n_queries: int = 100, seed: int = 7) -> List[str]:
+    """Short queries sampled from corpus chunks, so every query has relevant hits."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        words = _tokenize(rng.choice(corpus)["chunk_text"])
+        start = rng.randrange(max(1, len(words) - 6))
+        queries.append(" ".join(words[start:start + rng.randint(3, 6)]))
+    return queries
+
+
+def load_snapshot(path: str) -> List[dict]:
+    """Load a JSONL corpus snapshot (one chunk per line)."""
+    docs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                docs.append(json.loads(line))
+    return docs
+
+
+# ==========================================================
+# STACK
+# ==========================================================
+
+class StandinStack:
+    """The three stand-ins, loaded with one corpus and ready to install."""
+
+    def __init__(self, corpus: List[dict], analyzer: Callable[[str], str] = lambda t: t,
+                 collection: str = "bench", index: str = "bench_bm25", dim: int = 64,
+                 es_latency_ms: float = 0.0, qdrant_latency_ms: float = 0.0,
+                 embed_latency_ms: float = 0.0):
+        self.collection = collection
+        self.index = index
+        self.es = InMemoryElasticsearch(latency_ms=es_latency_ms)
+        self.qdrant = InMemoryQdrant(latency_ms=qdrant_latency_ms)
+
+        # Snapshot vectors fix the embedding dimension
+        for doc in corpus:
+            if doc.get("vector"):
+                dim = len(doc["vector"])
+                break
+        self.session = FakeEmbeddingSession(dim=dim, latency_ms=embed_latency_ms)
+
+        # Same analysis as the digest indexer: ES stores lemmatized text
+        self.es.index_documents(index, ((d["id"], analyzer(d["chunk_text"])) for d in corpus))
+        self.qdrant.upsert_points(collection, (
+            {
+                "id": d["id"],
+                "vector": d.get("vector") or hash_embedding(d["chunk_text"], dim),
+                "payload": {
+                    "chunk_text": d["chunk_text"],
+                    "hash": d.get("hash"),
+                    "metadata": d.get("metadata"),
+                    "citation": d.get("citation"),
+                },
+            }
+            for d in corpus
+        ))
+
+    def reset_counters(self):
+        self.es.calls = self.qdrant.calls = self.session.calls = 0
+
+    @contextmanager
+    def installed(self, retriever_module):
+        """Swap the retriever's es/qdrant/session globals for the stand-ins."""
+        saved = (retriever_module.es, retriever_module.qdrant, retriever_module.session)
+        retriever_module.es = self.es
+        retriever_module.qdrant = self.qdrant
+        retriever_module.session = self.session
+        try:
+            yield self
+        finally:
+            retriever_module.es, retriever_module.qdrant, retriever_module.session = saved
@@ -0,0 +1,173 @@
+"""
+Time-To-First-Token Benchmark
+=============================
+
+Measures how model residency and prompt ordering change the time to the first
+streamed token on a live Ollama server (unlike the other benchmarks, this one
+cannot use a stand-in: the cost being measured is Ollama's own).
+
+Three scenarios, each issuing the same sequence of calls that share a long
+knowledge block but ask a different question (like the chapter calls of a
+course build):
+
+    cold            model unloaded before every call (keep_alive=0 reset)
+    warm-unstable   model resident, per-call question BEFORE the knowledge:
+                    only the system prompt can be reused between calls
+    warm-prefix     model resident, knowledge first and question last (the
+                    order used by the server prompts): system prompt and
+                    knowledge form a shared prefix, only the question is
+                    evaluated after the first call
+
+For each scenario: TTFT p50/mean, model load time and prompt tokens actually
+evaluated by Ollama (tokens served from its cache are not counted).
+
+Usage (from the server/ directory, with Ollama running):
+    python -m benchmarks.ttft_benchmark
+    python -m benchmarks.ttft_benchmark --model llama3.1:8b --calls 8 --knowledge-words 3000 \\
+        --output bench/ttft.json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict
+
+# This project uses a flat directory structure without a formal Python package.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from ollama import Client
+
+from benchmarks.standins import synthetic_corpus
+
+
+SYSTEM_PROMPT = """You are an expert curriculum designer.
+
+IMPORTANT: You must respond in French.
+
+Your task is to design a course from the knowledge base. Answer briefly."""
+
+QUESTIONS = [
+    "Quels sont les prérequis de ce chapitre ?",
+    "Propose un exercice pratique sur ce thème.",
+    "Résume les principes clés en trois phrases.",
+    "Quelles erreurs fréquentes faut-il éviter ?",
+    "Comment évaluer les acquis des étudiants ?",
+    "Donne un exemple d'application sur chantier.",
+    "Quelles normes s'appliquent ici ?",
+    "Quel ordre de présentation recommandes-tu ?",
+]
+
+
+def build_knowledge(words: int, seed: int) -> str:
+    docs = synthetic_corpus(n_docs=max(1, words // 120), words_per_doc=120, seed=seed)
+    return "\n\n".join(
+        f'<source id="{i}">\n{doc["chunk_text"]}\n</source>' for i, doc in enumerate(docs, 1)
+    )
+
+
+def prompt_for(knowledge: str, question: str, prefix_stable: bool) -> str:
+    block = f"<knowledge_base>\n{knowledge}\n</knowledge_base>"
+    if prefix_stable:
+        return f"{block}\n\nQuestion: {question}"
+    return f"Question: {question}\n\n{block}"
+
+
+def timed_call(client: Client, model: str, prompt: str, keep_alive, max_tokens: int) -> Dict:
+    start = time.perf_counter()
+    ttft = None
+    final = {}
+    for chunk in client.generate(model=model, prompt=prompt, system=SYSTEM_PROMPT, stream=True,
+                                 keep_alive=keep_alive, options={"num_predict": max_tokens}):
+        if ttft is None and (chunk.get("response") or chunk.get("thinking")):
+            ttft = time.perf_counter() - start
+        if chunk.get("done"):
+            final = chunk
+    return {
+        "ttft_ms": round((ttft if ttft is not None else time.perf_counter() - start) * 1000, 1),
+        "load_ms": round((final.get("load_duration") or 0) / 1e6, 1),
+        "prompt_eval_count": final.get("prompt_eval_count") or 0,
+        "prompt_eval_ms": round((final.get("prompt_eval_duration") or 0) / 1e6, 1),
+    }
+
+
+def unload(client: Client, model: str):
+    client.generate(model=model, prompt="", keep_alive=0)
+    time.sleep(1)  # Unloading is asynchronous on the Ollama side
+
+
+def run_scenario(client: Client, name: str, model: str, knowledge: str, calls: int,
+                 keep_alive: str, max_tokens: int) -> Dict:
+    cold = name == "cold"
+    prefix_stable = name != "warm-unstable"
+    if not cold:
+        # Load the model and prime the cache with an unrelated prompt
+        unload(client, model)
+        timed_call(client, model, "Bonjour", keep_alive, 1)
+
+    samples = []
+    for i in range(calls):
+        if cold:
+            unload(client, model)
+        question = QUESTIONS[i % len(QUESTIONS)]
+        samples.append(timed_call(client, model, prompt_for(knowledge, question, prefix_stable),
+                                  keep_alive, max_tokens))
+
+    # The first call of a warm scenario pays for the whole prompt: report the rest apart
+    steady = samples if cold else samples[1:] or samples
+    ttfts = [s["ttft_ms"] for s in steady]
+    return {
+        "scenario": name,
+        "calls": calls,
+        "first_ttft_ms": samples[0]["ttft_ms"],
+        "ttft_p50_ms": round(statistics.median(ttfts), 1),
+        "ttft_mean_ms": round(statistics.mean(ttfts), 1),
+        "avg_load_ms": round(statistics.mean(s["load_ms"] for s in steady), 1),
+        "avg_prompt_eval_count": round(statistics.mean(s["prompt_eval_count"] for s in steady), 1),
+        "samples": samples,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark time-to-first-token against a live Ollama")
+    parser.add_argument("--host", default=None, help="Ollama URL (default: OLLAMA_BASE_URL from settings)")
+    parser.add_argument("--model", default=None, help="Model (default: RAG_MODEL from settings)")
+    parser.add_argument("--calls", type=int, default=6, help="Calls per scenario")
+    parser.add_argument("--knowledge-words", type=int, default=2000, help="Size of the shared knowledge block")
+    parser.add_argument("--max-tokens", type=int, default=16, help="Tokens generated per call")
+    parser.add_argument("--keep-alive", default="30m", help="keep_alive of the warm scenarios")
+    parser.add_argument("--scenarios", nargs="+", default=["cold", "warm-unstable", "warm-prefix"],
+                        choices=["cold", "warm-unstable", "warm-prefix"])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    host, model = args.host, args.model
+    if host is None or model is None:
+        from app.core.settings import settings
+        host = host or settings.ollama.base_url
+        model = model or settings.RAG_MODEL
+
+    client = Client(host=host)
+    knowledge = build_knowledge(args.knowledge_words, args.seed)
+
+    results = []
+    print(f"model={model} host={host} knowledge={len(knowledge)} chars calls={args.calls}")
+    print(f"{'scenario':>14} {'first ms':>9} {'p50 ms':>8} {'mean ms':>8} {'load ms':>8} {'prompt tok':>11}")
+    for name in args.scenarios:
+        r = run_scenario(client, name, model, knowledge, args.calls, args.keep_alive, args.max_tokens)
+        results.append(r)
+        print(f"{r['scenario']:>14} {r['first_ttft_ms']:>9.1f} {r['ttft_p50_ms']:>8.1f} {r['ttft_mean_ms']:>8.1f} "
+              f"{r['avg_load_ms']:>8.1f} {r['avg_prompt_eval_count']:>11.1f}")
+
+    if args.output:
+        out = Path(args.output)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({"model": model, "results": results}, indent=2), encoding="utf-8")
+        print(f"Results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
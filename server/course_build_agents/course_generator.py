@@ -1,8 +1,13 @@
-from .utils import call_llm, parse_llm_json_response
+from .utils import call_llm_structured_output, parse_structured_response, knowledge_slice
+from .schemas import CourseOutline, ChapterDetail
+from app.core.settings import settings
+from app.core.tracing import tracer, traced, propagate
+from app.core.llm_gateway import gateway, current_llm_context, no_queue_timeout
 from .prompts import (
     COURSE_OUTLINE_SYSTEM_PROMPT, get_course_outline_user_prompt,
     CHAPTER_DETAIL_SYSTEM_PROMPT, get_chapter_detail_user_prompt
 )
+from concurrent.futures import ThreadPoolExecutor
 import json
 
 
@@ -12,9 +17,14 @@ class CourseGeneratorAgent:
     Creates chapters, subchapters, and detailed content outlines for teaching.
     """
     
-    def __init__(self):
+    def __init__(self, chapter_concurrency=None, chapter_context_tokens=None):
         self.course_structure = None
+        self.chapter_concurrency = chapter_concurrency or settings.course.chapter_concurrency
+        self.chapter_context_tokens = (
+            settings.course.chapter_context_tokens if chapter_context_tokens is None else chapter_context_tokens
+        )
         
+    @traced("course.generator.generate_course")
     def generate_course(self, subject, knowledge_base, sources):
         """Generate a complete course structure from the knowledge base."""
         print(f"\n📚 Agent 3 : Génération de la structure du cours sur '{subject}'...")
@@ -33,13 +43,14 @@ class CourseGeneratorAgent:
         self.course_structure = detailed_structure
         return detailed_structure
     
+    @traced("course.generator.outline")
     def _generate_outline(self, subject, knowledge_base):
         """Generate high-level course outline."""
         # Use centralized prompts from prompts.py
         system_prompt = COURSE_OUTLINE_SYSTEM_PROMPT
         user_prompt = get_course_outline_user_prompt(subject, knowledge_base)
 
-        response = call_llm(system_prompt, user_prompt)
+        response = call_llm_structured_output(system_prompt, user_prompt, CourseOutline)
 
         # Minimal fallback structure
         fallback_outline = {
@@ -50,14 +61,9 @@ class CourseGeneratorAgent:
         }
 
         # Parse JSON with automatic cleanup and repair
-        outline = parse_llm_json_response(
+        outline = parse_structured_response(
             response,
-            expected_schema="""{
-  "course_title": "Title in French",
-  "description": "Brief course description",
-  "target_audience": "Who this course is for",
-  "chapters": [{"chapter_number": 1, "title": "Chapter title", "description": "What this chapter covers"}, ...]
-}""",
+            CourseOutline,
             fallback=fallback_outline,
             context="outline generation"
         )
@@ -65,48 +71,53 @@ class CourseGeneratorAgent:
         return outline
     
     def _generate_detailed_structure(self, subject, knowledge_base, outline):
-        """Generate detailed structure for each chapter with subchapters and content."""
-        # Use centralized system prompt from prompts.py
-        system_prompt = CHAPTER_DETAIL_SYSTEM_PROMPT
+        """
+        Generate detailed structure for each chapter with subchapters and content.
+
+        Chapters are independent once the outline is known, so they are
+        generated concurrently and assembled in outline order: the step takes
+        about as long as the slowest chapter instead of the sum of all of them.
+
+        The gateway runs at most gateway.capacity() calls of the course's
+        priority at once (LLM_BATCH_CONCURRENCY for batch work), so no more
+        workers than that are started. Chapters queued behind each other are
+        exempt from LLM_QUEUE_TIMEOUT, and a chapter that fails gets the
+        minimal fallback instead of failing the whole course.
+        """
+        chapters = outline.get('chapters', [])
+        _, priority = current_llm_context()
+        model = settings.RAG_MODEL + ("-cloud" if gateway.use_cloud else "")
+        capacity = gateway.capacity(model, priority)
+        workers = max(1, min(self.chapter_concurrency, len(chapters), capacity))
+        reason = ""
+        if capacity < min(self.chapter_concurrency, len(chapters)):
+            reason = (f" (COURSE_CHAPTER_CONCURRENCY={self.chapter_concurrency} limité à {capacity} "
+                      f"appel(s) simultané(s) sur '{model}' : LLM_BATCH_CONCURRENCY / LLM_MAX_CONCURRENCY)")
+        print(f"      {len(chapters)} chapitres, {workers} en parallèle{reason}")
+
+        # propagate() carries the trace span, the LLM priority and the
+        # queue timeout exemption into the pool
+        with no_queue_timeout():
+            generate_chapter = propagate(self._generate_chapter)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="course-chapter") as pool:
+            futures = [pool.submit(generate_chapter, subject, knowledge_base, chapter) for chapter in chapters]
+
+            detailed_chapters = []
+            for chapter, future in zip(chapters, futures):
+                try:
+                    chapter_detail = future.result()
+                except Exception as e:
+                    print(f"[WARNING] Chapter {chapter['chapter_number']} generation failed: {e}")
+                    chapter_detail = self._fallback_chapter(chapter)
+                detailed_chapters.append(chapter_detail)
+
+                print(f"      → Chapitre {chapter['chapter_number']} : {chapter['title']}")
+                subchapter_count = len(chapter_detail.get('subchapters', []))
+                if subchapter_count > 0:
+                    print(f"         ✓ {subchapter_count} sous-chapitres créés")
+                else:
+                    print(f"         ⚠ Chapitre {chapter['chapter_number']} sans sous-chapitres")
 
-        detailed_chapters = []
-
-        for chapter in outline.get('chapters', []):
-            print(f"      → Chapitre {chapter['chapter_number']} : {chapter['title']}")
-
-            # Use centralized user prompt builder from prompts.py
-            user_prompt = get_chapter_detail_user_prompt(subject, knowledge_base, chapter)
-
-            response = call_llm(system_prompt, user_prompt)
-
-            # Minimal fallback for this chapter
-            fallback_chapter = {
-                "chapter_number": chapter['chapter_number'],
-                "title": chapter['title'],
-                "description": chapter['description'],
-                "subchapters": []
-            }
-
-            # Parse JSON with automatic cleanup and repair
-            chapter_detail = parse_llm_json_response(
-                response,
-                expected_schema=f"""{{
-  "chapter_number": {chapter['chapter_number']},
-  "title": "...",
-  "learning_objectives": ["objective 1", ...],
-  "subchapters": [{{"subchapter_number": "1.1", "title": "...", "content_to_cover": [...], ...}}]
-}}""",
-                fallback=fallback_chapter,
-                context=f"chapter {chapter['chapter_number']} detail"
-            )
-
-            detailed_chapters.append(chapter_detail)
-            subchapter_count = len(chapter_detail.get('subchapters', []))
-            if subchapter_count > 0:
-                print(f"         ✓ {subchapter_count} sous-chapitres créés")
-            else:
-                print(f"         ⚠ Chapitre {chapter['chapter_number']} sans sous-chapitres")
-        
         # Assemble complete course structure
         complete_structure = {
             "course_title": outline.get('course_title', f"Course sur {subject}"),
@@ -118,6 +129,42 @@ class CourseGeneratorAgent:
         
         return complete_structure
     
+    def _generate_chapter(self, subject, knowledge_base, chapter):
+        """Generate the detailed structure of one chapter from its knowledge slice."""
+        # Use centralized prompts from prompts.py
+        system_prompt = CHAPTER_DETAIL_SYSTEM_PROMPT
+        # Trade-off: a knowledge base larger than chapter_context_tokens gives
+        # each chapter its own slice, so chapter prompts no longer share the
+        # subject + knowledge prefix Ollama could reuse from its KV cache
+        # (prompts.py). A knowledge base that fits is sent whole, keeping the
+        # shared prefix; chapter_context_tokens=0 always sends it whole.
+        chapter_knowledge = knowledge_slice(
+            knowledge_base, f"{chapter['title']} {chapter['description']}", self.chapter_context_tokens
+        )
+        user_prompt = get_chapter_detail_user_prompt(subject, chapter_knowledge, chapter)
+
+        with tracer.span("course.generator.chapter", chapter=chapter['chapter_number'],
+                         knowledge_chars=len(chapter_knowledge)):
+            response = call_llm_structured_output(system_prompt, user_prompt, ChapterDetail)
+
+        # Parse JSON with automatic cleanup and repair
+        return parse_structured_response(
+            response,
+            ChapterDetail,
+            fallback=self._fallback_chapter(chapter),
+            context=f"chapter {chapter['chapter_number']} detail"
+        )
+
+    @staticmethod
+    def _fallback_chapter(chapter):
+        """Minimal fallback for one chapter."""
+        return {
+            "chapter_number": chapter['chapter_number'],
+            "title": chapter['title'],
+            "description": chapter['description'],
+            "subchapters": []
+        }
+
     def get_markdown_content(self):
         """Generate markdown content as a string without saving to file."""
         if not self.course_structure:
@@ -0,0 +1,74 @@
+"""
+Streaming JSON Parser
+=====================
+
+Follows a streamed LLM response and tells when its JSON value is complete.
+
+With schema-constrained output (Ollama `format=`), the model emits exactly one
+JSON object or array, but may keep streaming whitespace after it until it hits
+its token limit. JSONStreamParser tracks bracket depth outside of strings, so
+the caller can stop the stream as soon as the top-level value closes instead
+of waiting for the end of generation.
+
+Anything before the first '{' or '[' (a code fence, a stray word) is skipped.
+
+Usage:
+    parser = JSONStreamParser()
+    for delta in llm_stream:
+        if parser.feed(delta):
+            break
+    data = json.loads(parser.text)
+"""
+
+
+class JSONStreamParser:
+    """Incremental scanner for the first top-level JSON object or array."""
+
+    def __init__(self):
+        self._parts = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.started = False
+        self.complete = False
+
+    @property
+    def text(self) -> str:
+        """The JSON value seen so far (the whole value once complete)."""
+        return "".join(self._parts)
+
+    def feed(self, delta: str) -> bool:
+        """Add a chunk of output. Returns True once the JSON value is complete."""
+        if self.complete or not delta:
+            return self.complete
+
+        start = 0
+        if not self.started:
+            positions = [p for p in (delta.find("{"), delta.find("[")) if p != -1]
+            if not positions:
+                return False
+            start = min(positions)
+            self.started = True
+
+        for i in range(start, len(delta)):
+            char = delta[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(delta[start:i + 1])
+                    self.complete = True
+                    return True
+
+        self._parts.append(delta[start:])
+        return False
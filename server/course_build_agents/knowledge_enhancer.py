@@ -1,4 +1,6 @@
-from .utils import context_from_query, call_llm, add_citation_links, parse_llm_json_response
+from .utils import context_from_query, call_llm, add_citation_links, call_llm_structured_output, parse_structured_response
+from .schemas import KnowledgeGaps
+from app.core.tracing import tracer, traced
 from .prompts import (
     GAP_IDENTIFIER_SYSTEM_PROMPT, get_gap_identifier_user_prompt,
     KNOWLEDGE_INTEGRATION_SYSTEM_PROMPT, get_knowledge_integration_user_prompt
@@ -13,12 +15,14 @@ class KnowledgeEnhancerAgent:
     Asks clarifying questions and performs additional research.
     """
 
-    def __init__(self, max_iterations=3, top_k=5, collection_name=None):
+    def __init__(self, max_iterations=3, top_k=5, collection_name=None, candidate_k=None):
         self.max_iterations = max_iterations
         self.top_k = top_k
+        self.candidate_k = candidate_k
         self.collection_name = collection_name
         self.enhancement_sources = []
         
+    @traced("course.enhancer.enhance_knowledge")
     def enhance_knowledge(self, subject, initial_knowledge, initial_sources):
         """Iteratively enhance knowledge by identifying and filling gaps."""
         print(f"\n🔬 Agent 2 : Amélioration des connaissances sur '{subject}'...")
@@ -27,14 +31,33 @@ class KnowledgeEnhancerAgent:
         all_sources = initial_sources.copy()
 
         for iteration in range(self.max_iterations):
-            print(f"   Itération {iteration + 1}/{self.max_iterations}")
+            current_knowledge, all_sources, done = self.enhance_iteration(
+                subject, current_knowledge, all_sources, iteration
+            )
+            if done:
+                break
+
+        print(f"✅ Agent 2 : Connaissances enrichies avec {len(all_sources) - len(initial_sources)} sources supplémentaires")
+        return current_knowledge, all_sources
+
+    def enhance_iteration(self, subject, current_knowledge, all_sources, iteration):
+        """
+        Une itération d'amélioration (lacunes -> recherche -> intégration).
+
+        Permet à l'orchestrateur de sauvegarder un point de reprise entre les itérations.
+
+        Returns:
+            (knowledge, all_sources, done) - done=True si plus rien à ajouter
+        """
+        print(f"   Itération {iteration + 1}/{self.max_iterations}")
 
+        with tracer.span("course.enhancer.iteration", iteration=iteration + 1):
             # Identify gaps
             gaps = self._identify_gaps(subject, current_knowledge)
 
             if not gaps or len(gaps) == 0:
                 print("      ✓ Aucune lacune significative trouvée")
-                break
+                return current_knowledge, all_sources, True
 
             print(f"      → {len(gaps)} lacunes identifiées")
 
@@ -43,32 +66,31 @@ class KnowledgeEnhancerAgent:
 
             if not enhancements:
                 print("      ✓ Aucune nouvelle information trouvée")
-                break
+                return current_knowledge, all_sources, True
 
             # Integrate enhancements
             current_knowledge = self._integrate_enhancements(
                 subject, current_knowledge, enhancements, all_sources
             )
 
-            print(f"      ✓ {len(self.enhancement_sources)} nouvelles sources ajoutées")
-            all_sources.extend(self.enhancement_sources)
-            self.enhancement_sources = []
+        print(f"      ✓ {len(self.enhancement_sources)} nouvelles sources ajoutées")
+        all_sources = all_sources + self.enhancement_sources
+        self.enhancement_sources = []
+        return current_knowledge, all_sources, False
 
-        print(f"✅ Agent 2 : Connaissances enrichies avec {len(all_sources) - len(initial_sources)} sources supplémentaires")
-        return current_knowledge, all_sources
-    
+    @traced("course.enhancer.identify_gaps")
     def _identify_gaps(self, subject, knowledge):
         """Identify gaps, unclear points, and missing information."""
         # Use centralized prompts from prompts.py
         system_prompt = GAP_IDENTIFIER_SYSTEM_PROMPT
         user_prompt = get_gap_identifier_user_prompt(subject, knowledge)
 
-        response = call_llm(system_prompt, user_prompt)
+        response = call_llm_structured_output(system_prompt, user_prompt, KnowledgeGaps)
 
         # Parse JSON array from response
-        gaps = parse_llm_json_response(
+        gaps = parse_structured_response(
             response,
-            expected_schema='["gap 1", "gap 2", ...]',
+            KnowledgeGaps,
             fallback=[],
             context="gap identification"
         )
@@ -82,6 +104,7 @@ class KnowledgeEnhancerAgent:
 
         return gaps[:5]  # Limit to 5 most important
     
+    @traced("course.enhancer.fill_gaps")
     def _fill_gaps(self, subject, gaps, existing_sources):
         """Fill identified gaps using RAG queries."""
         enhancements = []
@@ -89,7 +112,10 @@ class KnowledgeEnhancerAgent:
         
         for gap in gaps:
             # Query RAG for this gap
-            knowledge_base, sources = context_from_query(gap, collection_name=self.collection_name, top_k=self.top_k)
+            knowledge_base, sources = context_from_query(
+                gap, collection_name=self.collection_name,
+                top_k=self.top_k, candidate_k=self.candidate_k
+            )
             
             # Re-number sources
             for source in sources:
@@ -106,6 +132,7 @@ class KnowledgeEnhancerAgent:
         
         return enhancements
     
+    @traced("course.enhancer.integrate")
     def _integrate_enhancements(self, subject, current_knowledge, enhancements, all_sources):
         """Integrate new knowledge into existing knowledge base."""
         enhancement_text_parts = []
@@ -1,4 +1,6 @@
-from .utils import context_from_query, call_llm, add_citation_links, parse_llm_json_response
+from .utils import context_from_query, call_llm, add_citation_links, call_llm_structured_output, parse_structured_response
+from .schemas import SearchQueries
+from app.core.tracing import traced
 from .prompts import (
     QUERY_GENERATOR_SYSTEM_PROMPT, get_query_generator_user_prompt,
     KNOWLEDGE_SYNTHESIS_SYSTEM_PROMPT, get_knowledge_synthesis_user_prompt
@@ -12,18 +14,20 @@ class KnowledgeRetrieverAgent:
     Generates multiple queries to cover all aspects of the topic.
     """
 
-    def __init__(self, top_k_per_query=5, collection_name=None):
+    def __init__(self, top_k_per_query=5, collection_name=None, candidate_k=None):
         self.top_k_per_query = top_k_per_query
+        self.candidate_k = candidate_k
         self.collection_name = collection_name
         self.all_sources = []
         
+    @traced("course.retriever.generate_search_queries")
     def generate_search_queries(self, subject):
         """Generate multiple search queries to cover the subject comprehensively."""
         # Use centralized prompts from prompts.py
         system_prompt = QUERY_GENERATOR_SYSTEM_PROMPT
         user_prompt = get_query_generator_user_prompt(subject)
 
-        response = call_llm(system_prompt, user_prompt)
+        response = call_llm_structured_output(system_prompt, user_prompt, SearchQueries)
 
         # Fallback queries if parsing fails
         fallback_queries = [
@@ -35,9 +39,9 @@ class KnowledgeRetrieverAgent:
         ]
 
         # Parse JSON array from response
-        queries = parse_llm_json_response(
+        queries = parse_structured_response(
             response,
-            expected_schema='["query 1", "query 2", "query 3", ...]',
+            SearchQueries,
             fallback=fallback_queries,
             context="search query generation"
         )
@@ -48,6 +52,7 @@ class KnowledgeRetrieverAgent:
 
         return queries
     
+    @traced("course.retriever.retrieve_knowledge")
     def retrieve_knowledge(self, subject):
         """Retrieve and structure knowledge from multiple queries."""
         print(f"📚 Agent 1 : Collecte des connaissances sur '{subject}'...")
@@ -62,7 +67,10 @@ class KnowledgeRetrieverAgent:
 
         for idx, query in enumerate(queries, 1):
             print(f"   Requête {idx}/{len(queries)} : {query[:60]}...")
-            knowledge_base, sources = context_from_query(query, collection_name=self.collection_name, top_k=self.top_k_per_query)
+            knowledge_base, sources = context_from_query(
+                query, collection_name=self.collection_name,
+                top_k=self.top_k_per_query, candidate_k=self.candidate_k
+            )
 
             # Re-number sources to avoid conflicts
             for source in sources:
@@ -85,6 +93,7 @@ class KnowledgeRetrieverAgent:
         print(f"✅ Agent 1 : Connaissances récupérées depuis {len(self.all_sources)} sources")
         return synthesized, self.all_sources
     
+    @traced("course.retriever.synthesize")
     def _synthesize_knowledge(self, subject, all_knowledge):
         """Synthesize retrieved knowledge into structured format."""
         # Build comprehensive knowledge base
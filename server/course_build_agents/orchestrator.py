@@ -91,6 +91,7 @@ from course_build_agents.course_generator import CourseGeneratorAgent
 import json
 import os
 from datetime import datetime
+from app.core.scheduler import scheduled
 
 
 class MultiAgentOrchestrator:
@@ -130,13 +131,17 @@ class MultiAgentOrchestrator:
             max_iterations=config.get('enhancer_iterations', 3),
             top_k=config.get('enhancer_top_k', 5)
         )
-        self.course_generator = CourseGeneratorAgent()
+        self.course_generator = CourseGeneratorAgent(
+            chapter_concurrency=config.get('chapter_concurrency'),
+            chapter_context_tokens=config.get('chapter_context_tokens')
+        )
         
         self.output_dir = config.get('output_dir', './output')
         os.makedirs(self.output_dir, exist_ok=True)
         
         self.results = {}
         
+    @scheduled("course")
     def run(self, subject):
         """
         Execute the complete multi-agent workflow.
@@ -7,6 +7,7 @@ import sys
 import logging
 from datetime import datetime
 from io import StringIO
+from app.core.scheduler import scheduled
 
 
 class StreamingPrintCapture:
@@ -31,15 +32,22 @@ class StreamingPrintCapture:
         return content
 
 
-def stream_course_generation_progress(subject, config=None):
+@scheduled("course")
+def stream_course_generation_progress(subject, config=None, checkpoint=None):
     """
     Stream course generation with progress updates.
     Yields progress messages that can be sent as reasoning_content.
 
+    After the retriever, each enhancer iteration and the course generator, a
+    checkpoint with the pipeline state so far is yielded. Passing the last
+    checkpoint state back as `checkpoint` resumes the run after that step.
+
     Yields:
         dict: {'type': 'progress'|'complete', 'content': str, 'results': dict}
+              {'type': 'checkpoint', 'phase': str, 'state': dict}
     """
     config = config or {}
+    state = dict(checkpoint or {})
 
     # Extract collection_name from config
     collection_name = config.get('collection_name')
@@ -52,14 +60,19 @@ def stream_course_generation_progress(subject, config=None):
     try:
         retriever = KnowledgeRetrieverAgent(
             top_k_per_query=config.get('retriever_top_k', 5),
-            collection_name=collection_name
+            collection_name=collection_name,
+            candidate_k=config.get('candidate_k')
         )
         enhancer = KnowledgeEnhancerAgent(
             max_iterations=config.get('enhancer_iterations', 3),
             top_k=config.get('enhancer_top_k', 5),
-            collection_name=collection_name
+            collection_name=collection_name,
+            candidate_k=config.get('candidate_k')
+        )
+        course_generator = CourseGeneratorAgent(
+            chapter_concurrency=config.get('chapter_concurrency'),
+            chapter_context_tokens=config.get('chapter_context_tokens')
         )
-        course_generator = CourseGeneratorAgent()
 
         # Phase 1: Knowledge Retrieval
         print("=" * 80)
@@ -76,12 +89,18 @@ def stream_course_generation_progress(subject, config=None):
         if header:
             yield {'type': 'progress', 'content': header}
 
-        knowledge_base, sources = retriever.retrieve_knowledge(subject)
+        if 'sources' in state:
+            knowledge_base, sources = state['knowledge_base'], state['sources']
+            print(f"   ↺ Reprise : {len(sources)} sources déjà récupérées")
+        else:
+            knowledge_base, sources = retriever.retrieve_knowledge(subject)
+            state.update(knowledge_base=knowledge_base, sources=sources)
 
         # Yield retrieval logs
         retrieval_logs = capture.get_and_clear()
         if retrieval_logs:
             yield {'type': 'progress', 'content': retrieval_logs}
+        yield {'type': 'checkpoint', 'phase': 'retriever', 'state': state}
 
         # Phase 2: Knowledge Enhancement
         print("\n" + "=" * 80)
@@ -92,9 +111,39 @@ def stream_course_generation_progress(subject, config=None):
         if phase2_header:
             yield {'type': 'progress', 'content': phase2_header}
 
-        enhanced_knowledge, all_sources = enhancer.enhance_knowledge(
-            subject, knowledge_base, sources
-        )
+        enhanced_knowledge = state.get('enhanced_knowledge', knowledge_base)
+        all_sources = state.get('all_sources', list(sources))
+        start_iteration = state.get('enhancer_iteration', 0)
+
+        if state.get('enhancer_done'):
+            print("   ↺ Reprise : amélioration déjà terminée")
+        else:
+            if start_iteration:
+                print(f"   ↺ Reprise après l'itération {start_iteration}")
+            else:
+                print(f"\n🔬 Agent 2 : Amélioration des connaissances sur '{subject}'...")
+
+            for iteration in range(start_iteration, enhancer.max_iterations):
+                enhanced_knowledge, all_sources, done = enhancer.enhance_iteration(
+                    subject, enhanced_knowledge, all_sources, iteration
+                )
+                state.update(
+                    enhanced_knowledge=enhanced_knowledge,
+                    all_sources=all_sources,
+                    enhancer_iteration=iteration + 1,
+                    enhancer_done=done or iteration + 1 >= enhancer.max_iterations,
+                )
+
+                # Yield enhancement logs
+                enhancement_logs = capture.get_and_clear()
+                if enhancement_logs:
+                    yield {'type': 'progress', 'content': enhancement_logs}
+                yield {'type': 'checkpoint', 'phase': f'enhancer:{iteration + 1}', 'state': state}
+
+                if done:
+                    break
+
+            print(f"✅ Agent 2 : Connaissances enrichies avec {len(all_sources) - len(sources)} sources supplémentaires")
 
         # Yield enhancement logs
         enhancement_logs = capture.get_and_clear()
@@ -112,14 +161,21 @@ def stream_course_generation_progress(subject, config=None):
         if phase3_header:
             yield {'type': 'progress', 'content': phase3_header}
 
-        course_structure = course_generator.generate_course(
-            subject, enhanced_knowledge, all_sources
-        )
+        if 'course_structure' in state:
+            course_structure = state['course_structure']
+            course_generator.course_structure = course_structure
+            print("   ↺ Reprise : structure du cours déjà générée")
+        else:
+            course_structure = course_generator.generate_course(
+                subject, enhanced_knowledge, all_sources
+            )
+            state.update(course_structure=course_structure)
 
         # Yield course generation logs
         generation_logs = capture.get_and_clear()
         if generation_logs:
             yield {'type': 'progress', 'content': generation_logs}
+        yield {'type': 'checkpoint', 'phase': 'generator', 'state': state}
 
         # Generate markdown
         print("\n" + "=" * 80)
@@ -241,14 +297,19 @@ class MultiAgentOrchestratorWithLogging:
 
         self.retriever = KnowledgeRetrieverAgent(
             top_k_per_query=config.get('retriever_top_k', 5),
-            collection_name=collection_name
+            collection_name=collection_name,
+            candidate_k=config.get('candidate_k')
         )
         self.enhancer = KnowledgeEnhancerAgent(
             max_iterations=config.get('enhancer_iterations', 3),
             top_k=config.get('enhancer_top_k', 5),
-            collection_name=collection_name
+            collection_name=collection_name,
+            candidate_k=config.get('candidate_k')
+        )
+        self.course_generator = CourseGeneratorAgent(
+            chapter_concurrency=config.get('chapter_concurrency'),
+            chapter_context_tokens=config.get('chapter_context_tokens')
         )
-        self.course_generator = CourseGeneratorAgent()
 
         self.output_dir = config.get('output_dir', './output')
         os.makedirs(self.output_dir, exist_ok=True)
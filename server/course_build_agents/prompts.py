@@ -150,18 +150,21 @@ Return the complete updated knowledge base."""
 # COURSE GENERATOR PROMPTS
 # =============================================================================
 
-COURSE_OUTLINE_SYSTEM_PROMPT = """You are an expert curriculum designer.
+# The outline and the chapter calls share one system prompt and start their
+# user prompt with the same subject + knowledge base; only the instructions
+# after the knowledge base differ. When the knowledge base fits in
+# COURSE_CHAPTER_CONTEXT_TOKENS (chapters then get all of it), the prefix
+# evaluated for the outline is reused by Ollama for the chapter calls.
+COURSE_GENERATOR_SYSTEM_PROMPT = """You are an expert curriculum designer.
 
 IMPORTANT: You must respond in French.
 
-Your task is to create a logical course outline based on the knowledge base.
-Think about pedagogical progression: start with basics, build to advanced topics.
+Your task is to design a course from the knowledge base: first a logical course outline,
+then detailed chapter structures with subchapters and specific content to teach.
+Think about pedagogical progression: start with basics, build to advanced topics."""
 
-Consider:
-- Prerequisites and foundational concepts first
-- Logical progression of difficulty
-- Balance between theory and practice
-- Student learning journey"""
+COURSE_OUTLINE_SYSTEM_PROMPT = COURSE_GENERATOR_SYSTEM_PROMPT
+CHAPTER_DETAIL_SYSTEM_PROMPT = COURSE_GENERATOR_SYSTEM_PROMPT
 
 
 def get_course_outline_user_prompt(subject: str, knowledge_base: str) -> str:
@@ -174,6 +177,12 @@ def get_course_outline_user_prompt(subject: str, knowledge_base: str) -> str:
 
 Create a course outline with 5-10 chapters that will teach this subject effectively to students.
 
+Consider:
+- Prerequisites and foundational concepts first
+- Logical progression of difficulty
+- Balance between theory and practice
+- Student learning journey
+
 IMPORTANT: the course must contain at least 5 chapters.
 
 Return ONLY a JSON object with this structure:
@@ -188,20 +197,6 @@ Return ONLY a JSON object with this structure:
 }}"""
 
 
-CHAPTER_DETAIL_SYSTEM_PROMPT = """You are an expert curriculum designer.
-
-IMPORTANT: You must respond in French.
-
-Your task is to create detailed chapter structures with subchapters and specific content to teach.
-
-For each chapter:
-- Break it into 3-6 logical subchapters
-- For each subchapter, specify exactly what concepts, principles, or skills to teach
-- Include learning objectives
-- Note practical examples or exercises to include
-- Suggest estimated duration"""
-
-
 def get_chapter_detail_user_prompt(subject: str, knowledge_base: str, chapter: dict) -> str:
     """Build the user prompt for detailed chapter structure generation."""
     return f"""Subject: {subject}
@@ -213,7 +208,12 @@ def get_chapter_detail_user_prompt(subject: str, knowledge_base: str, chapter: d
 Chapter {chapter['chapter_number']}: {chapter['title']}
 Description: {chapter['description']}
 
-Create a detailed structure for this chapter.
+Create a detailed structure for this chapter:
+- Break it into 3-6 logical subchapters
+- For each subchapter, specify exactly what concepts, principles, or skills to teach
+- Include learning objectives
+- Note practical examples or exercises to include
+- Suggest estimated duration
 
 Return ONLY a JSON object with this structure:
 {{
@@ -0,0 +1,55 @@
+"""
+Course Generation Output Schemas
+================================
+
+Pydantic models for every JSON-producing step of the course pipeline. Their
+JSON schema is passed to Ollama as `format=`, which constrains generation to
+valid JSON of that shape; the same model then validates the response.
+
+Top-level JSON arrays use RootModel, so the prompts keep asking for a plain
+array.
+"""
+
+from typing import List
+
+from pydantic import BaseModel, RootModel
+
+
+class SearchQueries(RootModel[List[str]]):
+    """Knowledge retriever: search queries covering the subject."""
+
+
+class KnowledgeGaps(RootModel[List[str]]):
+    """Knowledge enhancer: questions/gaps to fill."""
+
+
+class OutlineChapter(BaseModel):
+    chapter_number: int
+    title: str
+    description: str
+
+
+class CourseOutline(BaseModel):
+    """Course generator: high-level outline."""
+    course_title: str
+    description: str
+    target_audience: str
+    chapters: List[OutlineChapter]
+
+
+class Subchapter(BaseModel):
+    subchapter_number: str
+    title: str
+    content_to_cover: List[str]
+    practical_elements: List[str]
+    estimated_duration: str
+
+
+class ChapterDetail(BaseModel):
+    """Course generator: detailed structure of one chapter."""
+    chapter_number: int
+    title: str
+    description: str
+    learning_objectives: List[str]
+    estimated_duration: str
+    subchapters: List[Subchapter]
@@ -1,125 +1,155 @@
 from retrivers.hybrid_retriever import retrieve
-import ollama
-from ollama import Client
+from rag_engine.context_builder import pack_context, format_knowledge, count_tokens
+from rag_engine.url_resolver import resolver
+from rag_engine.citations import add_citation_links  # noqa: F401  (used by the agents)
 import re
 import json
 import sys
+import threading
 from pathlib import Path
+from pydantic import ValidationError
 
 # sys.path manipulation for flat project structure
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from app.core.settings import settings
-
-# Load global_hashes.json for PDF URL conversion (same as RAG)
-global_hashes = {}
-global_hashes_path = Path(__file__).parent.parent / "rag_engine" / "global_hashes.json"
-if global_hashes_path.exists():
-    try:
-        with open(global_hashes_path, "r") as f:
-            global_hashes = json.load(f)
-    except Exception:
-        pass
+from app.core.tracing import traced
+from app.core.llm_gateway import gateway
+from course_build_agents.json_stream import JSONStreamParser
 
 # Load fileserver URLs from settings
 FILESERVER_BASE = settings.fileserver.base_url
 FILESERVER_PUBLIC_URL = settings.fileserver.public_base_url
 
-# Create Ollama client: cloud if key exists, local otherwise
-if settings.ollama.use_cloud:
-    ollama_client = Client(
-        host=settings.ollama.cloud_host,
-        headers={"Authorization": f"Bearer {settings.ollama.api_key}"}
-    )
-    USE_CLOUD = True
-else:
-    ollama_client = Client(host=settings.ollama.base_url)
-    USE_CLOUD = False
+# Shared Ollama client (cloud if key exists, local otherwise), see app/core/llm_gateway.py
+USE_CLOUD = gateway.use_cloud
+
+
+class JSONStats:
+    """
+    Counters for JSON-producing LLM steps (served in GET /llm/metrics).
+
+    repair_calls is the number of extra LLM round trips made by
+    fix_malformed_json(); with schema-constrained output it should stay at 0.
+    """
 
+    def __init__(self):
+        self._counts = {
+            "structured_calls": 0,
+            "schema_failures": 0,
+            "parse_failures": 0,
+            "repair_calls": 0,
+            "repair_failures": 0,
+        }
+        self._lock = threading.Lock()
 
+    def count(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
 
-def context_from_query(query, collection_name=None, top_k=5):
-    """Récupère le contexte pertinent avec métadonnées pour citation."""
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+json_stats = JSONStats()
+
+
+@traced("course.context_from_query")
+def context_from_query(query, collection_name=None, top_k=5, candidate_k=None, max_tokens=None):
+    """
+    Récupère le contexte pertinent avec métadonnées pour citation.
+
+    Les chunks sont triés par score fusionné, dédupliqués et limités à
+    max_tokens (défaut: CONTEXT_MAX_TOKENS) avant d'être numérotés.
+    """
     if collection_name is None:
         collection_name = next(iter(settings.COLLECTIONS))
         print(f"[WARN] No collection_name provided to context_from_query, defaulting to '{collection_name}'")
     pair = settings.get_collection(collection_name)
-    results = retrieve(query, qdrant_collection=pair["qdrant_collection"], es_index=pair["es_index"], top_k=top_k)
+    results = retrieve(
+        query, qdrant_collection=pair["qdrant_collection"], es_index=pair["es_index"],
+        top_k=top_k, candidate_k=candidate_k
+    )
+
+    entries = []
+    for result in results:
+        # Citation resolved at ingest time (payload field), or on the fly for
+        # legacy points. Use PUBLIC URL since these links are shown to users
+        source_url, title = resolver.resolve(result, FILESERVER_PUBLIC_URL)
+
+        entries.append({
+            'title': title,
+            'url': source_url,
+            'chunk_text': result['chunk_text'],
+            'fused_score': result.get('fused_score'),
+        })
+
+    entries, _ = pack_context(entries, max_tokens=max_tokens)
 
     knowledge_parts = []
     sources = []
 
-    for i, result in enumerate(results, 1):
-        source_url = result['metadata'].get('source_url', '')
-        is_pdf = source_url.lower().endswith(".pdf")
-
-        # Use fileserver URL if hash exists (for PDFs AND HTML pages)
-        # Use PUBLIC URL since these links are shown to users in the browser
-        if source_url in global_hashes:
-            hash_code = global_hashes[source_url]
-            source_url = f"{FILESERVER_PUBLIC_URL}/download/{hash_code}"
-        elif result['metadata'].get('hash'):
-            # Fallback: use the file hash directly to build fileserver URL
-            # (for collections created by the digest CLI)
-            hash_code = result['metadata']['hash']
-            source_url = f"{FILESERVER_PUBLIC_URL}/download/{hash_code}"
-        elif is_pdf:
-            source_url = source_url[:-4]  # Remove .pdf for cleaner display if no hash
-
-        title = result['metadata'].get('title', 'Document sans titre')
-        chunk_text = result['chunk_text']
-
-        knowledge_parts.append(
-            f"<knowledge id=\"{i}\" title=\"{title}\" url=\"{source_url}\">\n"
-            f"{chunk_text}\n"
-            f"</knowledge>"
-        )
+    for i, entry in enumerate(entries, 1):
+        knowledge_parts.append(format_knowledge(i, entry['title'], entry['url'], entry['chunk_text']))
 
         sources.append({
             'id': i,
-            'title': title,
-            'url': source_url,
-            'chunk_text': chunk_text
+            'title': entry['title'],
+            'url': entry['url'],
+            'chunk_text': entry['chunk_text']
         })
 
     knowledge_base = "\n\n".join(knowledge_parts)
     return knowledge_base, sources
 
 
-def add_citation_links(text, sources):
-    """Convertit [SOURCE X] en citations séquentielles [1](url), [2](url)..."""
-    used_sources = re.findall(r'\[\s*SOURCE\s+(\d+)\s*\]', text)
-
-    # Create mapping SOURCE X -> sequential number (deduplicated by URL)
-    used_sources_list = list(map(int, used_sources))
-    source_mapping = {}
-    order = 1
-    url_to_order = {}
-    for src in used_sources_list:
-        if src not in source_mapping:
-            source_url = next((s['url'] for s in sources if s['id'] == src), '#')
-            if source_url not in url_to_order:
-                url_to_order[source_url] = order
-                source_mapping[src] = order
-                order += 1
-            else:
-                source_mapping[src] = url_to_order[source_url]
+_SLICE_TERM_RE = re.compile(r"\w{4,}", re.UNICODE)
 
-    def replace_source(match):
-        source_num = int(match.group(1))
-        if source_num in source_mapping:
-            sequential_num = source_mapping[source_num]
-            source_url = next((s['url'] for s in sources if s['id'] == source_num), '#')
-            return f'[{sequential_num}]({source_url})'
-        return match.group(0)
 
-    text = re.sub(r'\[\s*SOURCE\s+(\d+)\s*\]', replace_source, text)
+def knowledge_slice(knowledge_base, query, max_tokens):
+    """
+    Extrait de la base de connaissances les paragraphes les plus pertinents pour `query`.
+
+    Les paragraphes (un titre markdown reste attaché au paragraphe qui le
+    suit) sont classés par nombre de termes communs avec la requête, puis
+    ajoutés tant qu'ils tiennent dans max_tokens, et rendus dans leur ordre
+    d'origine. La base entière est renvoyée si elle tient dans le budget
+    (ou si max_tokens <= 0), ce qui garde un préfixe de prompt commun.
+    """
+    if max_tokens <= 0 or count_tokens(knowledge_base) <= max_tokens:
+        return knowledge_base
+
+    paragraphs = []
+    heading = ""
+    for block in re.split(r"\n\s*\n", knowledge_base):
+        if not block.strip():
+            continue
+        if all(line.lstrip().startswith("#") for line in block.strip().splitlines()):
+            heading += block.strip() + "\n\n"
+            continue
+        paragraphs.append(heading + block)
+        heading = ""
+    if heading:
+        paragraphs.append(heading.rstrip())
+
+    terms = {t.lower() for t in _SLICE_TERM_RE.findall(query)}
+    ranked = sorted(
+        range(len(paragraphs)),
+        key=lambda i: (-len(terms & {t.lower() for t in _SLICE_TERM_RE.findall(paragraphs[i])}), i)
+    )
 
-    # Remove consecutive duplicate citations (e.g., "[1](url) [1](url)" -> "[1](url)")
-    text = re.sub(r'(\[\d+\]\([^)]+\))(\s*\1)+', r'\1', text)
+    kept = []
+    budget = max_tokens
+    for i in ranked:
+        tokens = count_tokens(paragraphs[i])
+        if tokens <= budget:
+            kept.append(i)
+            budget -= tokens
 
-    return text, source_mapping
+    return "\n\n".join(paragraphs[i] for i in sorted(kept))
 
 
+@traced("llm.generate")
 def call_llm(system_prompt, user_prompt, model=None):
     """Wrapper pour appeler le LLM avec system et user prompts."""
     if model is None:
@@ -131,14 +161,14 @@ def call_llm(system_prompt, user_prompt, model=None):
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
-        cloud_response = ollama_client.chat(
+        cloud_response = gateway.chat(
             model=model + "-cloud",
             messages=messages
         )
         return cloud_response['message']['content']
     else:
         # Local: use generate() API
-        local_response = ollama_client.generate(
+        local_response = gateway.generate(
             model=model,
             prompt=user_prompt,
             system=system_prompt
@@ -146,31 +176,97 @@ def call_llm(system_prompt, user_prompt, model=None):
         return local_response['response']
 
 
-def call_llm_structured_output(system_prompt, user_prompt,schema, model=None):
-    """Wrapper pour appeler le LLM avec system et user prompts."""
+@traced("llm.generate_structured")
+def call_llm_structured_output(system_prompt, user_prompt, schema, model=None):
+    """
+    Appelle le LLM avec une sortie JSON contrainte par un modèle Pydantic.
+
+    Le JSON schema du modèle est passé en `format=` (cloud et local). La
+    réponse est streamée dans un JSONStreamParser : dès que la valeur JSON
+    est fermée, le stream est interrompu (le modèle peut sinon continuer à
+    émettre des espaces jusqu'à sa limite de tokens).
+
+    Returns:
+        Le texte JSON produit (à valider avec parse_structured_response)
+    """
     if model is None:
         model = settings.RAG_MODEL
-    
+    json_format = schema.model_json_schema()
+
     if USE_CLOUD:
         # Cloud: use chat() API
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
-        cloud_response = ollama_client.chat(
+        stream = gateway.chat(
             model=model + "-cloud",
             messages=messages,
-            format=schema
+            format=json_format,
+            stream=True
         )
-        return cloud_response['message']['content']
     else:
         # Local: use generate() API
-        local_response = ollama_client.generate(
+        stream = gateway.generate(
             model=model,
             prompt=user_prompt,
-            system=system_prompt
+            system=system_prompt,
+            format=json_format,
+            stream=True
         )
-        return local_response['response']
+
+    parser = JSONStreamParser()
+    raw = []
+    try:
+        for chunk in stream:
+            if USE_CLOUD:
+                delta = chunk.get('message', {}).get('content', '')
+            else:
+                delta = chunk.get('response', '')
+            raw.append(delta)
+            if parser.feed(delta):
+                break
+    finally:
+        stream.close()
+
+    json_stats.count("structured_calls")
+    if parser.complete:
+        return parser.text
+    return "".join(raw)
+
+
+def parse_structured_response(response: str, schema, fallback=None, context: str = ""):
+    """
+    Valide une réponse de call_llm_structured_output() avec son modèle Pydantic.
+
+    Avec une sortie contrainte, la validation réussit normalement du premier
+    coup. Sinon (réponse tronquée, modèle sans support de `format`), on
+    retombe sur parse_llm_json_response et sa réparation par le LLM, qui
+    est comptée dans json_stats.
+
+    Returns:
+        dict/list validé (model_dump) ou fallback
+    """
+    try:
+        return schema.model_validate_json(response).model_dump()
+    except ValidationError as e:
+        json_stats.count("schema_failures")
+        if context:
+            print(f"   [{context}] Structured output did not match the schema: {e.error_count()} error(s)")
+
+    result = parse_llm_json_response(
+        response,
+        expected_schema=json.dumps(schema.model_json_schema(), ensure_ascii=False),
+        fallback=fallback,
+        context=context
+    )
+    if result is fallback:
+        return fallback
+    try:
+        return schema.model_validate(result).model_dump()
+    except ValidationError:
+        return fallback
+
 
 def parse_llm_json_response(response: str, expected_schema: str, fallback=None, context: str = ""):
     """
@@ -242,6 +338,7 @@ def parse_llm_json_response(response: str, expected_schema: str, fallback=None,
         return result
 
     except (json.JSONDecodeError, ValueError) as e:
+        json_stats.count("parse_failures")
         if context:
             print(f"   [{context}] JSON parsing failed: {e}")
         else:
@@ -266,6 +363,7 @@ def parse_llm_json_response(response: str, expected_schema: str, fallback=None,
         return fallback
 
 
+@traced("llm.fix_malformed_json")
 def fix_malformed_json(broken_json, expected_structure_description, error_message):
     """
     Failsafe function that asks LLM to fix malformed JSON.
@@ -313,6 +411,7 @@ EXPECTED STRUCTURE:
 
 Fix this JSON and return ONLY the corrected, valid JSON. No explanations, no markdown, just valid JSON."""
 
+    json_stats.count("repair_calls")
     try:
             corrected = call_llm(system_prompt, user_prompt)
             
@@ -336,5 +435,6 @@ Fix this JSON and return ONLY the corrected, valid JSON. No explanations, no mar
             return corrected
             
     except Exception as repair_error:
+            json_stats.count("repair_failures")
             print(f"   ✗ Failed to repair JSON: {repair_error}")
             return None
\ No newline at end of file
@@ -15,8 +15,10 @@ from typing import List, Dict
 
 # Note: sys.path manipulation needed for flat project structure
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from course_build_agents.utils import context_from_query, call_llm, parse_llm_json_response, add_citation_links
+from course_build_agents.utils import context_from_query, call_llm_structured_output, parse_structured_response, add_citation_links
+from app.core.tracing import traced
 from qcm_agents.prompts import get_answer_generator_system_prompt, get_answer_generator_user_prompt
+from qcm_agents.schemas import QCMAnswer
 
 
 class AnswerGeneratorAgent:
@@ -40,15 +42,17 @@ class AnswerGeneratorAgent:
         "hard": "Difficile"
     }
 
-    def __init__(self, answer_top_k: int = 5, collection_name: str = None):
+    def __init__(self, answer_top_k: int = 5, collection_name: str = None, candidate_k: int = None):
         """
         Initialise le générateur de réponses.
 
         Args:
             answer_top_k: Nombre de chunks à récupérer par question
             collection_name: Nom de la collection à utiliser pour les requêtes RAG
+            candidate_k: Nombre de candidats BM25/vectoriels fusionnés avant de garder les meilleurs
         """
         self.answer_top_k = answer_top_k
+        self.candidate_k = candidate_k
         self.collection_name = collection_name
 
     def generate_answers(
@@ -108,6 +112,7 @@ class AnswerGeneratorAgent:
 
         return qcm_items
 
+    @traced("qcm.answers.generate_one")
     def _generate_answer_for_question(
         self,
         question: str,
@@ -118,7 +123,10 @@ class AnswerGeneratorAgent:
         """Génère la réponse et les choix pour une question."""
 
         # Étape 1: Récupérer le contexte ciblé pour cette question
-        knowledge_context, sources = context_from_query(question, collection_name=self.collection_name, top_k=self.answer_top_k)
+        knowledge_context, sources = context_from_query(
+            question, collection_name=self.collection_name,
+            top_k=self.answer_top_k, candidate_k=self.candidate_k
+        )
 
         if not sources:
             print(f"   Aucune source trouvée pour cette question")
@@ -143,15 +151,15 @@ class AnswerGeneratorAgent:
     ) -> Dict:
         """Utilise le LLM pour générer l'élément QCM complet."""
         # Use centralized prompts from prompts.py
-        system_prompt = get_answer_generator_system_prompt(topic, difficulty)
-        user_prompt = get_answer_generator_user_prompt(question, difficulty, knowledge_context)
+        system_prompt = get_answer_generator_system_prompt(difficulty)
+        user_prompt = get_answer_generator_user_prompt(question, topic, difficulty, knowledge_context)
 
-        response = call_llm(system_prompt, user_prompt)
+        response = call_llm_structured_output(system_prompt, user_prompt, QCMAnswer)
 
-        # Parse JSON response with automatic cleanup and repair
-        result = parse_llm_json_response(
+        # Validate against the schema (repair only as a last resort)
+        result = parse_structured_response(
             response,
-            expected_schema='{"right_choice": "...", "wrong_choice_1": "...", "wrong_choice_2": "...", "source_text": "..."}',
+            QCMAnswer,
             fallback=None,
             context="answer generation"
         )
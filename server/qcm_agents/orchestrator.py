@@ -94,6 +94,7 @@ from typing import Dict, List, Generator, Optional
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from app.core.settings import settings
+from app.core.scheduler import scheduled
 from .state_manager import StateManagerAgent
 from .question_generator import QuestionGeneratorAgent
 from .answer_generator import AnswerGeneratorAgent, format_qcm_markdown, format_qcm_json, format_qcm_downloadable
@@ -122,8 +123,8 @@ def upload_qcm_to_fileserver(qcm_data: dict, topic: str) -> dict:
     print(f"[UPLOAD] FILESERVER_BASE = {FILESERVER_BASE}")
 
     try:
-        # Generate a hash from the content
-        json_content = json.dumps(qcm_data, ensure_ascii=False, indent=2)
+        # Generate a hash from the content (compact: the fileserver stores and compresses it as is)
+        json_content = json.dumps(qcm_data, ensure_ascii=False, separators=(",", ":"))
         content_hash = hashlib.sha256(json_content.encode('utf-8')).hexdigest()[:16]
 
         # Prepare the upload request
@@ -217,6 +218,7 @@ class QCMOrchestrator:
             config: Dictionnaire de configuration avec clés optionnelles:
                 - retriever_top_k: Chunks pour le contexte large (défaut: 15)
                 - answer_top_k: Chunks par question (défaut: 5)
+                - candidate_k: Candidats fusionnés par requête (défaut: RETRIEVER_TOP_K)
                 - output_dir: Répertoire pour sauvegarder les sorties
                 - collection_name: Nom de la collection à utiliser pour les requêtes RAG
         """
@@ -228,11 +230,13 @@ class QCMOrchestrator:
         self.state_manager = StateManagerAgent()
         self.question_generator = QuestionGeneratorAgent(
             retriever_top_k=config.get('retriever_top_k', 15),
-            collection_name=collection_name
+            collection_name=collection_name,
+            candidate_k=config.get('candidate_k')
         )
         self.answer_generator = AnswerGeneratorAgent(
             answer_top_k=config.get('answer_top_k', 5),
-            collection_name=collection_name
+            collection_name=collection_name,
+            candidate_k=config.get('candidate_k')
         )
 
         self.output_dir = config.get('output_dir', './qcm_outputs')
@@ -374,6 +378,7 @@ class QCMOrchestrator:
         return paths
 
 
+@scheduled("qcm.generate")
 def stream_qcm_generation(
     topic: str,
     difficulty: str,
@@ -536,6 +541,7 @@ def stream_qcm_generation(
         sys.stdout = old_stdout
 
 
+@scheduled("qcm.conversation")
 def handle_qcm_conversation(
     messages: List[Dict],
     config: Dict = None
@@ -12,8 +12,11 @@ Prompt Categories:
 - QUESTION_GENERATOR_*: Prompts for generating questions from context
 - ANSWER_GENERATOR_*: Prompts for generating correct answers and distractors
 - STATE_MANAGER_*: Prompts for conversation state analysis
+- STATE_UPDATE_*: Prompts for incremental state updates (new turns only)
 """
 
+import json
+
 # =============================================================================
 # DIFFICULTY INSTRUCTIONS
 # =============================================================================
@@ -75,13 +78,15 @@ RÈGLES POUR LES MAUVAIS CHOIX (DIFFICILE):
 # QUESTION GENERATOR PROMPTS
 # =============================================================================
 
-def get_question_generator_system_prompt(topic: str, number: int, difficulty: str) -> str:
+def get_question_generator_system_prompt(difficulty: str) -> str:
     """
     Build the system prompt for question generation.
 
+    The prompt only depends on the difficulty, so it stays identical across
+    QCMs and Ollama can reuse its evaluation; the topic and the number of
+    questions go in the user prompt.
+
     Args:
-        topic: Subject of the questions
-        number: How many questions to generate
         difficulty: "easy", "medium", or "hard"
 
     Returns:
@@ -91,13 +96,13 @@ def get_question_generator_system_prompt(topic: str, number: int, difficulty: st
 
     return f"""Tu es un expert en conception d'évaluations éducatives créant des Questions à Choix Multiples (QCM).
 
-Ta tâche est de générer exactement {number} questions sur "{topic}" basées sur la base de connaissances fournie.
+Ta tâche est de générer exactement le nombre de questions demandé sur le sujet demandé, basées sur la base de connaissances fournie.
 
 NIVEAU DE DIFFICULTÉ: {difficulty.upper()}
 {difficulty_instruction}
 
 RÈGLES:
-1. Génère EXACTEMENT {number} questions - ni plus, ni moins
+1. Génère EXACTEMENT le nombre de questions demandé - ni plus, ni moins
 2. Les questions doivent être répondables à partir de la base de connaissances fournie
 3. Les questions doivent être claires, non ambiguës et bien formulées
 4. Chaque question doit tester un aspect ou concept différent
@@ -106,7 +111,7 @@ RÈGLES:
 7. Éviter les questions oui/non - poser des questions "quoi", "quel", "comment", "pourquoi"
 
 FORMAT DE SORTIE:
-Retourne un objet JSON avec un tableau "questions" contenant exactement {number} chaînes de questions:
+Retourne un objet JSON avec un tableau "questions" contenant exactement le nombre de questions demandé:
 {{
     "questions": [
         "Première question ici?",
@@ -117,13 +122,13 @@ Retourne un objet JSON avec un tableau "questions" contenant exactement {number}
 
 
 def get_question_generator_user_prompt(topic: str, number: int, difficulty: str, knowledge_context: str) -> str:
-    """Build the user prompt for question generation."""
-    return f"""À partir de cette base de connaissances sur "{topic}", génère exactement {number} questions de niveau {difficulty}:
-
-<base_de_connaissances>
+    """Build the user prompt for question generation (knowledge first, request last)."""
+    return f"""<base_de_connaissances>
 {knowledge_context}
 </base_de_connaissances>
 
+À partir de cette base de connaissances sur "{topic}", génère exactement {number} questions de niveau {difficulty}.
+
 Génère {number} questions EN FRANÇAIS. Retourne UNIQUEMENT l'objet JSON avec le tableau de questions."""
 
 
@@ -131,12 +136,14 @@ Génère {number} questions EN FRANÇAIS. Retourne UNIQUEMENT l'objet JSON avec
 # ANSWER GENERATOR PROMPTS
 # =============================================================================
 
-def get_answer_generator_system_prompt(topic: str, difficulty: str) -> str:
+def get_answer_generator_system_prompt(difficulty: str) -> str:
     """
     Build the system prompt for answer generation.
 
+    Like the question prompt, it only depends on the difficulty; the topic
+    goes in the user prompt.
+
     Args:
-        topic: Subject of the questions
         difficulty: "easy", "medium", or "hard"
 
     Returns:
@@ -146,7 +153,7 @@ def get_answer_generator_system_prompt(topic: str, difficulty: str) -> str:
 
     return f"""Tu es un expert en création de QCM (Questions à Choix Multiples) pour des évaluations éducatives.
 
-Ta tâche est de créer les choix de réponse pour une question sur "{topic}".
+Ta tâche est de créer les choix de réponse pour une question sur le sujet indiqué.
 
 {wrong_choice_rules}
 
@@ -167,14 +174,16 @@ FORMAT DE SORTIE (JSON):
 }}"""
 
 
-def get_answer_generator_user_prompt(question: str, difficulty: str, knowledge_context: str) -> str:
-    """Build the user prompt for answer generation."""
-    return f"""Crée les choix QCM pour cette question:
+def get_answer_generator_user_prompt(question: str, topic: str, difficulty: str, knowledge_context: str) -> str:
+    """Build the user prompt for answer generation (knowledge first, question last)."""
+    return f"""BASE DE CONNAISSANCES:
+{knowledge_context}
 
-QUESTION: {question}
+SUJET: {topic}
 
-BASE DE CONNAISSANCES:
-{knowledge_context}
+Crée les choix QCM pour cette question:
+
+QUESTION: {question}
 
 À partir de ces connaissances, crée:
 1. La bonne réponse (doit être supportée par les connaissances)
@@ -232,3 +241,45 @@ CONVERSATION:
 {conversation_text}
 
 Retourne UNIQUEMENT le JSON avec l'état extrait."""
+
+
+STATE_UPDATE_SYSTEM_PROMPT = """Tu es un analyseur de conversation intelligent pour un générateur de QCM.
+
+Tu reçois l'ÉTAT PRÉCÉDENT de la configuration (déjà extrait des messages antérieurs)
+et les NOUVEAUX MESSAGES de la conversation. Tu dois retourner l'état mis à jour:
+
+1. **topic**: Le sujet/thème des questions
+2. **difficulty**: La difficulté, normalisée en: "easy", "medium", ou "hard"
+   - "facile", "simple" → "easy"
+   - "moyen", "moyenne", "intermédiaire" → "medium"
+   - "difficile", "dur", "avancé" → "hard"
+3. **number**: Le nombre de questions (entier entre 1 et 50)
+4. **confirmed**: BOOLEAN - Est-ce que l'utilisateur a CONFIRMÉ la configuration?
+
+RÈGLES POUR LES PARAMÈTRES:
+- Garde la valeur de l'état précédent pour chaque paramètre que les nouveaux messages ne modifient pas
+- Si un nouveau message donne une nouvelle valeur, elle remplace l'ancienne
+
+RÈGLES POUR DÉTERMINER "confirmed":
+- confirmed = true SEULEMENT SI, dans les nouveaux messages, l'assistant a présenté un récapitulatif
+  de la configuration ET l'utilisateur a répondu positivement APRÈS ce récapitulatif
+- confirmed = false si l'utilisateur modifie des paramètres, refuse, hésite ou pose une question
+
+Retourne UNIQUEMENT un JSON valide:
+{
+    "topic": "sujet extrait ou null",
+    "difficulty": "easy|medium|hard ou null",
+    "number": entier ou null,
+    "confirmed": true ou false
+}"""
+
+
+def get_state_update_user_prompt(previous_state: dict, new_messages_text: str) -> str:
+    """Build the user prompt for an incremental state update (previous state + new turns)."""
+    return f"""ÉTAT PRÉCÉDENT:
+{json.dumps(previous_state, ensure_ascii=False)}
+
+NOUVEAUX MESSAGES:
+{new_messages_text}
+
+Retourne UNIQUEMENT le JSON avec l'état mis à jour."""
@@ -14,8 +14,10 @@ from typing import List
 # Note: sys.path manipulation needed for flat project structure
 # This allows importing from sibling directories without package installation
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from course_build_agents.utils import context_from_query, call_llm, parse_llm_json_response
+from course_build_agents.utils import context_from_query, call_llm_structured_output, parse_structured_response
+from app.core.tracing import traced
 from qcm_agents.prompts import get_question_generator_system_prompt, get_question_generator_user_prompt
+from qcm_agents.schemas import QuestionList
 
 
 class QuestionGeneratorAgent:
@@ -35,17 +37,20 @@ class QuestionGeneratorAgent:
         "hard": "Difficile"
     }
 
-    def __init__(self, retriever_top_k: int = 15, collection_name: str = None):
+    def __init__(self, retriever_top_k: int = 15, collection_name: str = None, candidate_k: int = None):
         """
         Initialise le générateur de questions.
 
         Args:
             retriever_top_k: Nombre de chunks à récupérer pour le contexte large
             collection_name: Nom de la collection à utiliser pour les requêtes RAG
+            candidate_k: Nombre de candidats BM25/vectoriels fusionnés avant de garder les meilleurs
         """
         self.retriever_top_k = retriever_top_k
+        self.candidate_k = candidate_k
         self.collection_name = collection_name
 
+    @traced("qcm.questions.generate")
     def generate_questions(self, topic: str, difficulty: str, number: int) -> dict:
         """
         Génère N questions sur le sujet.
@@ -73,7 +78,10 @@ class QuestionGeneratorAgent:
         print(f"Récupération des {self.retriever_top_k} meilleurs chunks...")
 
         # Étape 1: Récupérer le contexte large
-        knowledge_context, sources = context_from_query(topic, collection_name=self.collection_name, top_k=self.retriever_top_k)
+        knowledge_context, sources = context_from_query(
+            topic, collection_name=self.collection_name,
+            top_k=self.retriever_top_k, candidate_k=self.candidate_k
+        )
 
         print(f"Sources récupérées: {len(sources)}")
         for i, src in enumerate(sources[:5], 1):
@@ -110,15 +118,15 @@ class QuestionGeneratorAgent:
     ) -> List[str]:
         """Génère les questions avec le LLM à partir du contexte récupéré."""
         # Use centralized prompts from prompts.py
-        system_prompt = get_question_generator_system_prompt(topic, number, difficulty)
+        system_prompt = get_question_generator_system_prompt(difficulty)
         user_prompt = get_question_generator_user_prompt(topic, number, difficulty, knowledge_context)
 
-        response = call_llm(system_prompt, user_prompt)
+        response = call_llm_structured_output(system_prompt, user_prompt, QuestionList)
 
-        # Parse JSON response with automatic cleanup and repair
-        result = parse_llm_json_response(
+        # Validate against the schema (repair only as a last resort)
+        result = parse_structured_response(
             response,
-            expected_schema='{"questions": ["question1", "question2", ...]}',
+            QuestionList,
             fallback=None,
             context="question generation"
         )
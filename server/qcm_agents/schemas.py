@@ -0,0 +1,32 @@
+"""
+QCM Output Schemas
+==================
+
+Pydantic models for the JSON produced by the QCM agents, passed to Ollama as
+`format=` (see course_build_agents/schemas.py).
+"""
+
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel
+
+
+class QuestionList(BaseModel):
+    """Question generator: the generated questions."""
+    questions: List[str]
+
+
+class QCMAnswer(BaseModel):
+    """Answer generator: right answer, two distractors and supporting text."""
+    right_choice: str
+    wrong_choice_1: str
+    wrong_choice_2: str
+    source_text: str
+
+
+class ConversationState(BaseModel):
+    """State manager: QCM parameters extracted from the conversation."""
+    topic: Optional[str]
+    difficulty: Optional[Literal["easy", "medium", "hard"]]
+    number: Optional[int]
+    confirmed: bool
@@ -5,18 +5,249 @@ Utilise le LLM pour analyser intelligemment la conversation et déterminer:
 - Les paramètres extraits (topic, difficulty, number)
 - Si l'utilisateur a confirmé ou non
 - Quelle action prendre ensuite
+
+LibreChat renvoie tout l'historique à chaque tour. Pour ne pas réanalyser
+l'historique complet à chaque message:
+- l'état obtenu après chaque historique est mis en cache, indexé par un hash
+  chaîné des messages : au tour suivant, l'état du tour précédent est
+  retrouvé et seuls les nouveaux messages sont analysés;
+- les nouveaux messages explicites ("10 questions faciles sur le béton",
+  "oui", "difficile") sont traités par des règles, sans appel au LLM;
+- sinon le LLM ne reçoit que l'état précédent et les nouveaux messages
+  (l'historique complet seulement si aucun état antérieur n'est en cache).
 """
 
+import hashlib
 import json
 import re
 import sys
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 # Note: sys.path manipulation needed for flat project structure
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from course_build_agents.utils import call_llm, parse_llm_json_response
-from qcm_agents.prompts import STATE_MANAGER_SYSTEM_PROMPT, get_state_manager_user_prompt
+from course_build_agents.utils import call_llm_structured_output, parse_structured_response
+from app.core.settings import settings
+from app.core.tracing import traced, current_span
+from qcm_agents.prompts import (
+    STATE_MANAGER_SYSTEM_PROMPT, get_state_manager_user_prompt,
+    STATE_UPDATE_SYSTEM_PROMPT, get_state_update_user_prompt
+)
+from qcm_agents.schemas import ConversationState
+
+
+EMPTY_STATE = {"topic": None, "difficulty": None, "number": None, "confirmed": False}
+
+# Début du message de récapitulatif (voir _generate_confirmation_message)
+RECAP_MARKER = "**Configuration du QCM:**"
+
+DIFFICULTY_WORDS = {
+    "facile": "easy", "faciles": "easy", "simple": "easy", "simples": "easy", "easy": "easy",
+    "moyen": "medium", "moyens": "medium", "moyenne": "medium", "moyennes": "medium",
+    "intermédiaire": "medium", "intermédiaires": "medium", "medium": "medium",
+    "difficile": "hard", "difficiles": "hard", "dur": "hard", "durs": "hard",
+    "avancé": "hard", "avancés": "hard", "hard": "hard",
+}
+
+
+# =============================================================================
+# RÈGLES (messages explicites, sans LLM)
+# =============================================================================
+
+_WORD_RE = re.compile(r"[\w'’-]+", re.UNICODE)
+_NUMBER_RE = re.compile(
+    r"\b(?:nombre(?:\s+de\s+questions)?\s*[:=]?\s*(\d{1,3})|(\d{1,3})\s*(?:questions?|qcm)\b)",
+    re.IGNORECASE
+)
+_ONLY_NUMBER_RE = re.compile(r"^\s*(\d{1,3})\s*[.!]?\s*$")
+_DIFFICULTY_RE = re.compile(
+    r"(?:\b(?:niveau|difficult[ée])\s*[:=]?\s*)?\b(" + "|".join(sorted(DIFFICULTY_WORDS, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE
+)
+_TOPIC_RE = re.compile(
+    r"\b(?:(?:sujet|th[èe]me|topic)\s*[:=]\s*|sur\s+(?:les?\s+|la\s+|l['’]\s*)?)([^,;.!?\n]+)",
+    re.IGNORECASE
+)
+
+_CONFIRM_TRIGGERS = {"oui", "ok", "okay", "d'accord", "daccord", "parfait", "lance", "lancer", "lancez",
+                     "génère", "générer", "générez", "go", "valide", "valider", "confirme", "confirmer",
+                     "yes", "bon", "parti", "vas-y", "allez-y", "exact", "correct"}
+_REFUSE_TRIGGERS = {"non", "attends", "attendez", "stop", "annule", "annuler", "pas"}
+_NEGATIONS = {"pas", "non", "ni", "jamais", "sans", "not", "no"}
+# Mots qui, restés dans un sujet, signalent une suite de phrase non comprise ("béton mais ...")
+_TOPIC_CONNECTORS = {"mais", "ou", "sauf", "plutôt", "puis", "donc", "car", "or", "but"}
+# Mots qui ne peuvent ni commencer ni terminer un sujet ("béton en" après retrait de "10 questions")
+_TOPIC_DANGLING = {"en", "et", "avec", "de", "du", "des", "d'", "pour", "à", "au", "aux", "le", "la",
+                   "les", "l'", "un", "une", "sur", "dans", "par", "trop", "très", "plus", "moins"}
+# Formules de politesse finales, retirées du sujet ("sur le BTP stp", "béton merci")
+_COURTESY = {"merci", "beaucoup", "svp", "stp", "s'il", "te", "vous", "plaît", "plait", "please"}
+_TRAILING_WORD_RE = re.compile(r"[\w'’-]+[^\w'’-]*$", re.UNICODE)
+_FILLER = {"je", "j'", "veux", "voudrais", "souhaite", "aimerais", "un", "une", "des", "de", "du", "d'",
+           "le", "la", "les", "l'", "qcm", "question", "questions", "avec", "et", "en", "pour", "niveau",
+           "merci", "svp", "stp", "s'il", "te", "vous", "plaît", "plait", "fais", "faites", "moi", "crée",
+           "créer", "génère", "générer", "please", "oui", "ok", "alors", "plutôt", "mets", "mettre", "à",
+           "au", "sur", "difficulté", "sujet", "thème", "nombre", "c'est", "ça", "est", "tout", "bien", "très",
+           "super", "top", "y", "it", "encore", "aussi", "génération"}
+
+
+def _words(text: str) -> List[str]:
+    return [w.replace("’", "'") for w in _WORD_RE.findall(text.lower())]
+
+
+def _strip_courtesy(topic: str) -> str:
+    """Retire les formules de politesse qui terminent le sujet ("béton armé s'il te plaît")."""
+    while True:
+        match = _TRAILING_WORD_RE.search(topic)
+        if not match or _words(match.group(0))[0] not in _COURTESY:
+            return topic
+        topic = topic[:match.start()].rstrip(" \"'«»")
+
+
+def parse_explicit_turn(text: str) -> Optional[tuple]:
+    """
+    Interprète un message utilisateur explicite sans LLM.
+
+    Exemples traités par les règles :
+        "10 questions faciles sur le béton"        -> number, difficulty, topic "béton"
+        "Je veux 10 questions faciles sur le BTP stp" -> topic "BTP"
+        "5 questions difficiles sur le béton merci"  -> topic "béton"
+        "sujet: béton armé s'il te plaît"          -> topic "béton armé"
+    Laissés au LLM (None) :
+        "10 questions sur le béton pas faciles", "sur le béton en 10 questions",
+        "sur les dalles mais facile"
+
+    Returns:
+        ("confirm", {}) | ("refuse", {}) | ("params", {topic?, difficulty?, number?}),
+        ou None si le message n'est pas entièrement compris par les règles.
+    """
+    words = _words(text)
+    if not words:
+        return None
+
+    # Commandes directes : "oui", "ok c'est parti", "non attends"
+    if all(w in _CONFIRM_TRIGGERS or w in _FILLER for w in words):
+        if any(w in _CONFIRM_TRIGGERS for w in words) and not _NUMBER_RE.search(text):
+            return "confirm", {}
+    if any(w in _REFUSE_TRIGGERS for w in words) and all(
+        w in _REFUSE_TRIGGERS or w in _FILLER for w in words
+    ):
+        return "refuse", {}
+
+    # Paramètres explicites
+    params = {}
+    remaining = text
+
+    match = _ONLY_NUMBER_RE.match(remaining) or _NUMBER_RE.search(remaining)
+    if match:
+        number = int(next(g for g in match.groups() if g))
+        if not 1 <= number <= 50:
+            return None
+        params["number"] = number
+        remaining = remaining[:match.start()] + " " + remaining[match.end():]
+
+    match = _DIFFICULTY_RE.search(remaining)
+    if match:
+        # "pas faciles", "pas trop difficile", "facile ? non" : laissé au LLM
+        around = _words(remaining[:match.start()])[-2:] + _words(remaining[match.end():])[:1]
+        if any(w in _NEGATIONS for w in around):
+            return None
+        params["difficulty"] = DIFFICULTY_WORDS[match.group(1).lower()]
+        remaining = remaining[:match.start()] + " " + remaining[match.end():]
+        if _DIFFICULTY_RE.search(remaining):
+            return None  # Plusieurs difficultés : ambigu
+
+    match = _TOPIC_RE.search(remaining)
+    if match:
+        topic = _strip_courtesy(match.group(1).strip(" \"'«»"))
+        topic_words = _words(topic)
+        if any(w in _NEGATIONS or w in _TOPIC_CONNECTORS for w in topic_words) or (
+            topic_words and (topic_words[0] in _TOPIC_DANGLING or topic_words[-1] in _TOPIC_DANGLING)
+        ):
+            return None  # Sujet coupé par un paramètre retiré ou suivi d'une réserve
+        if topic:
+            params["topic"] = topic
+            remaining = remaining[:match.start()] + " " + remaining[match.end():]
+
+    # Tout le message doit être expliqué par les paramètres trouvés
+    if not params or any(w not in _FILLER for w in _words(remaining)):
+        return None
+    return "params", params
+
+
+def apply_explicit_turns(state: Dict, messages: List[Dict], start: int) -> Optional[Dict]:
+    """
+    Applique par règles les messages messages[start:] à `state`.
+
+    Returns:
+        Le nouvel état, ou None si un message utilisateur nécessite le LLM.
+    """
+    state = dict(state)
+    for idx in range(start, len(messages)):
+        if messages[idx].get("role") != "user":
+            continue
+        turn = parse_explicit_turn(messages[idx].get("content", ""))
+        if turn is None:
+            return None
+        kind, params = turn
+        if kind == "params":
+            state.update(params)
+            state["confirmed"] = False
+        elif kind == "refuse":
+            state["confirmed"] = False
+        else:
+            # Une confirmation ne compte qu'en réponse au récapitulatif
+            previous = messages[idx - 1] if idx > 0 else {}
+            recap_shown = previous.get("role") == "assistant" and RECAP_MARKER in previous.get("content", "")
+            complete = all(state[k] is not None for k in ("topic", "difficulty", "number"))
+            state["confirmed"] = recap_shown and complete
+    return state
+
+
+# =============================================================================
+# CACHE D'ÉTAT PAR HISTORIQUE
+# =============================================================================
+
+def history_keys(messages: List[Dict]) -> List[str]:
+    """Hash chaîné de chaque préfixe de l'historique : keys[i] identifie messages[:i + 1]."""
+    keys = []
+    digest = b""
+    for msg in messages:
+        h = hashlib.sha256(digest)
+        h.update(f"{msg.get('role')}\0{msg.get('content', '')}".encode("utf-8"))
+        digest = h.digest()
+        keys.append(h.hexdigest())
+    return keys
+
+
+class ConversationStateCache:
+    """LRU des états de conversation, partagé par toutes les requêtes."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._states: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return None
+            self._states.move_to_end(key)
+            return dict(state)
+
+    def put(self, key: str, state: Dict):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._states[key] = dict(state)
+            self._states.move_to_end(key)
+            while len(self._states) > self.maxsize:
+                self._states.popitem(last=False)
+
+
+state_cache = ConversationStateCache(settings.qcm.state_cache_size)
 
 
 class StateManagerAgent:
@@ -42,6 +273,7 @@ class StateManagerAgent:
             "confirmed": False
         }
 
+    @traced("qcm.state_manager.process_conversation")
     def process_conversation(self, messages: List[Dict]) -> dict:
         """
         Analyse l'HISTORIQUE COMPLET de la conversation avec le LLM.
@@ -65,8 +297,8 @@ class StateManagerAgent:
                 "action": "ask_params"
             }
 
-        # Utiliser le LLM pour analyser la conversation complète
-        analysis = self._analyze_conversation_with_llm(messages)
+        # État du tour précédent (cache) + analyse des nouveaux messages seulement
+        analysis = self._analyze_conversation(messages)
 
         # Mettre à jour l'état
         self.state["topic"] = analysis.get("topic")
@@ -102,58 +334,100 @@ class StateManagerAgent:
                 "action": "ask_params"
             }
 
-    def _analyze_conversation_with_llm(self, messages: List[Dict]) -> dict:
+    def _analyze_conversation(self, messages: List[Dict]) -> dict:
         """
-        Utilise le LLM pour analyser toute la conversation et extraire:
-        - Les paramètres (topic, difficulty, number)
-        - Si l'utilisateur a confirmé la configuration
+        Détermine l'état après `messages` en réutilisant l'état des tours précédents.
+
+        Ordre : cache de l'historique complet, puis règles sur les nouveaux
+        messages, puis LLM sur les nouveaux messages, puis LLM sur tout
+        l'historique si aucun tour précédent n'est en cache.
         """
-        # Format conversation for LLM
+        span = current_span()
+        keys = history_keys(messages)
+
+        cached = state_cache.get(keys[-1])
+        if cached is not None:
+            span.set_attribute("qcm.state.path", "cache")
+            return cached
+
+        # Dernier préfixe déjà analysé (normalement l'historique du tour précédent)
+        base, start = dict(EMPTY_STATE), 0
+        for i in range(len(keys) - 2, -1, -1):
+            state = state_cache.get(keys[i])
+            if state is not None:
+                base, start = state, i + 1
+                break
+
+        analysis = apply_explicit_turns(base, messages, start)
+        if analysis is not None:
+            path = "rules"
+        elif start > 0:
+            path = "llm_incremental"
+            analysis = self._update_state_with_llm(base, messages[start:])
+        else:
+            path = "llm_full"
+            analysis = self._analyze_conversation_with_llm(messages)
+
+        span.set_attribute("qcm.state.path", path)
+        span.set_attribute("qcm.state.new_messages", len(messages) - start)
+        if analysis is None:
+            # Échec du LLM : ne pas mettre en cache, le prochain tour réessaiera
+            return dict(EMPTY_STATE)
+        state_cache.put(keys[-1], analysis)
+        return analysis
+
+    @staticmethod
+    def _format_messages(messages: List[Dict]) -> str:
         conversation_text = ""
         for msg in messages:
             role = "Utilisateur" if msg.get("role") == "user" else "Assistant"
             content = msg.get("content", "")
             conversation_text += f"{role}: {content}\n\n"
+        return conversation_text
 
+    def _analyze_conversation_with_llm(self, messages: List[Dict]) -> Optional[dict]:
+        """
+        Utilise le LLM pour analyser toute la conversation et extraire:
+        - Les paramètres (topic, difficulty, number)
+        - Si l'utilisateur a confirmé la configuration
+        """
         # Use centralized prompts from prompts.py
         system_prompt = STATE_MANAGER_SYSTEM_PROMPT
-        user_prompt = get_state_manager_user_prompt(conversation_text)
+        user_prompt = get_state_manager_user_prompt(self._format_messages(messages))
+
+        response = call_llm_structured_output(system_prompt, user_prompt, ConversationState)
+        return self._parse_analysis(response)
 
-        response = call_llm(system_prompt, user_prompt)
+    def _update_state_with_llm(self, previous_state: Dict, new_messages: List[Dict]) -> Optional[dict]:
+        """Utilise le LLM pour appliquer les nouveaux messages à l'état précédent."""
+        system_prompt = STATE_UPDATE_SYSTEM_PROMPT
+        user_prompt = get_state_update_user_prompt(previous_state, self._format_messages(new_messages))
 
-        # Default empty state
-        default_state = {"topic": None, "difficulty": None, "number": None, "confirmed": False}
+        response = call_llm_structured_output(system_prompt, user_prompt, ConversationState)
+        return self._parse_analysis(response)
 
-        # Parse JSON response with automatic cleanup and repair
-        analysis = parse_llm_json_response(
+    def _parse_analysis(self, response: str) -> Optional[dict]:
+        """Valide et normalise l'état retourné par le LLM (None si illisible)."""
+        # Validate against the schema (repair only as a last resort)
+        analysis = parse_structured_response(
             response,
-            expected_schema='{"topic": "...", "difficulty": "...", "number": N, "confirmed": true/false}',
-            fallback=default_state,
+            ConversationState,
+            fallback=None,
             context="StateManager"
         )
 
-        if not analysis or analysis == default_state:
-            return default_state
+        if not analysis:
+            return None
 
         # Validate and normalize the parsed data
-        result = {
-            "topic": None,
-            "difficulty": None,
-            "number": None,
-            "confirmed": False
-        }
+        result = dict(EMPTY_STATE)
 
         if analysis.get("topic"):
             result["topic"] = str(analysis["topic"]).strip()
 
         if analysis.get("difficulty"):
             diff = str(analysis["difficulty"]).lower().strip()
-            diff_map = {
-                "facile": "easy", "easy": "easy", "simple": "easy",
-                "moyen": "medium", "medium": "medium", "moyenne": "medium", "intermédiaire": "medium",
-                "difficile": "hard", "hard": "hard", "dur": "hard", "avancé": "hard"
-            }
-            result["difficulty"] = diff_map.get(diff, diff if diff in ["easy", "medium", "hard"] else None)
+            result["difficulty"] = DIFFICULTY_WORDS.get(diff, diff if diff in self.VALID_DIFFICULTIES else None)
 
         if analysis.get("number"):
             try:
@@ -0,0 +1,173 @@
+"""
+Citation Rewriting
+==================
+
+Turns the `[SOURCE X]` markers produced by the LLM into sequential markdown
+links `[N](url)`:
+
+    - numbers are assigned in order of first citation (1, 2, 3...)
+    - sources sharing a URL share a number
+    - consecutive repeats of the same link are collapsed ("[1](u) [1](u)" -> "[1](u)")
+
+StreamingCitationRewriter does this incrementally, token by token: text is
+released as soon as it cannot be part of a marker, so only a trailing partial
+marker (e.g. "[SOU") and the whitespace after a link are held back.
+
+add_citation_links() does the same on a complete text in a single pass: one
+finditer over a precompiled pattern and dict lookups per marker, so the cost
+is linear in the text length whatever the number of sources.
+
+Usage:
+    text, mapping = add_citation_links(text, sources)
+
+    rewriter = StreamingCitationRewriter(sources)
+    for delta in llm_stream:
+        out = rewriter.feed(delta)
+        if out:
+            yield out
+    yield rewriter.flush()
+    used = rewriter.used_sources()
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+
+# [SOURCE 1], [source 5], [ SOURCE 10 ], ...
+SOURCE_PATTERN = re.compile(r"\[\s*source\s+(\d+)\s*\]", re.IGNORECASE)
+
+# Everything a marker can look like before its closing bracket arrives
+_PARTIAL_SOURCE = re.compile(r"\[\s*(?:s(?:o(?:u(?:r(?:c(?:e(?:\s+\d*\s*)?)?)?)?)?)?)?\Z", re.IGNORECASE)
+
+
+class CitationMapper:
+    """Assigns sequential link numbers to source ids, deduplicating by URL."""
+
+    def __init__(self, sources: List[Dict]):
+        self.sources = sources
+        self.url_by_id = {s['id']: s['url'] for s in sources}
+        self.number_by_id: Dict[int, int] = {}
+        self._number_by_url: Dict[str, int] = {}
+
+    def link(self, source_id: int) -> str:
+        number = self.number_by_id.get(source_id)
+        url = self.url_by_id.get(source_id, '#')
+        if number is None:
+            number = self._number_by_url.get(url)
+            if number is None:
+                number = len(self._number_by_url) + 1
+                self._number_by_url[url] = number
+            self.number_by_id[source_id] = number
+        return f"[{number}]({url})"
+
+    def used_sources(self) -> List[Dict]:
+        """Cited sources, in source order, one per URL."""
+        seen_urls = set()
+        used = []
+        for s in self.sources:
+            if s['id'] in self.number_by_id and s['url'] not in seen_urls:
+                used.append(s)
+                seen_urls.add(s['url'])
+        return used
+
+
+def add_citation_links(text: str, sources: List[Dict]) -> Tuple[str, Dict[int, int]]:
+    """
+    Convert [SOURCE X] citations to sequential markdown links [1](url), [2](url)...
+
+    Args:
+        text: The response text containing [SOURCE X] citations
+        sources: List of source dicts with 'id', 'url', and 'title' keys
+
+    Returns:
+        Tuple of (processed_text, source_mapping_dict)
+    """
+    mapper = CitationMapper(sources)
+    out = []
+    pos = 0
+    last_link = None
+    for match in SOURCE_PATTERN.finditer(text):
+        gap = text[pos:match.start()]
+        link = mapper.link(int(match.group(1)))
+        if link == last_link and not gap.strip():
+            # Consecutive duplicate: drop it and the whitespace before it
+            pass
+        else:
+            out.append(gap)
+            out.append(link)
+            last_link = link
+        pos = match.end()
+    out.append(text[pos:])
+    return "".join(out), mapper.number_by_id
+
+
+class StreamingCitationRewriter:
+    """Incremental [SOURCE X] -> [N](url) rewriting for streamed LLM output."""
+
+    def __init__(self, sources: List[Dict]):
+        self.mapper = CitationMapper(sources)
+        self._buffer = ""
+        self._last_link = None   # last link emitted, if only whitespace followed it
+        self._pending_ws = ""    # whitespace after that link, held back
+
+    @property
+    def mapping(self) -> Dict[int, int]:
+        return self.mapper.number_by_id
+
+    def used_sources(self) -> List[Dict]:
+        return self.mapper.used_sources()
+
+    def feed(self, delta: str) -> str:
+        """Add a chunk of LLM output; return the text that is safe to emit."""
+        self._buffer += delta
+        buffer = self._buffer
+
+        # Hold back a trailing partial marker
+        cut = len(buffer)
+        bracket = buffer.rfind("[")
+        if bracket != -1 and _PARTIAL_SOURCE.match(buffer, bracket):
+            cut = bracket
+        self._buffer = buffer[cut:]
+
+        return self._rewrite(buffer[:cut])
+
+    def flush(self) -> str:
+        """Emit whatever is still held back (end of stream)."""
+        out = self._rewrite(self._buffer)
+        self._buffer = ""
+        out += self._pending_ws
+        self._pending_ws = ""
+        self._last_link = None
+        return out
+
+    def _rewrite(self, text: str) -> str:
+        out = []
+        pos = 0
+        for match in SOURCE_PATTERN.finditer(text):
+            self._emit_text(out, text[pos:match.start()])
+            link = self.mapper.link(int(match.group(1)))
+            if link == self._last_link:
+                # Consecutive duplicate: drop it and the whitespace before it
+                self._pending_ws = ""
+            else:
+                out.append(self._pending_ws)
+                out.append(link)
+                self._pending_ws = ""
+                self._last_link = link
+            pos = match.end()
+        self._emit_text(out, text[pos:])
+        return "".join(out)
+
+    def _emit_text(self, out: List[str], text: str):
+        if not text:
+            return
+        if self._last_link is not None:
+            stripped = text.lstrip()
+            if not stripped:
+                # Still only whitespace after the last link: keep holding
+                self._pending_ws += text
+                return
+            out.append(self._pending_ws)
+            self._pending_ws = ""
+            self._last_link = None
+        out.append(text)
@@ -0,0 +1,185 @@
+"""
+Token-Budgeted Context Assembly
+===============================
+
+Turns retrieved chunks into the <knowledge> blocks of a prompt without
+exceeding a token budget:
+
+    1. Sort chunks by fused score (best first)
+    2. Drop exact and near-duplicate chunks (word-shingle Jaccard similarity)
+    3. Greedily pack blocks while they fit in the budget; a chunk that does not
+       fit is skipped and smaller, lower-ranked chunks may still fill the gap
+    4. If even the best chunk alone exceeds the budget, it is truncated
+
+Tokens are counted with tiktoken (same encoder family as the digest chunker).
+If tiktoken is unavailable, counts fall back to a chars/4 estimate.
+
+Usage:
+    from rag_engine.context_builder import pack_context, format_knowledge
+
+    entries, stats = pack_context(entries, max_tokens=4000)
+    blocks = [format_knowledge(i, e["title"], e["url"], e["chunk_text"]) for i, e in enumerate(entries, 1)]
+"""
+
+import hashlib
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# sys.path manipulation for flat project structure
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from app.core.settings import settings
+from app.core.tracing import current_span
+
+
+# Module-level tokenizer (lazy-initialized)
+_enc = None
+_enc_failed = False
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+SHINGLE_SIZE = 5
+
+
+def _get_encoder():
+    global _enc, _enc_failed
+    if _enc is None and not _enc_failed:
+        try:
+            import tiktoken
+            _enc = tiktoken.get_encoding(settings.context.encoding)
+        except Exception as e:
+            _enc_failed = True
+            print(f"[WARNING] tiktoken unavailable ({e}); estimating context tokens as chars/4")
+    return _enc
+
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoder()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    enc = _get_encoder()
+    if enc is None:
+        return text[:max_tokens * 4]
+    tokens = enc.encode(text, disallowed_special=())
+    return enc.decode(tokens[:max_tokens])
+
+
+def format_knowledge(idx: int, title: str, url: str, text: str) -> str:
+    """Render one chunk as a <knowledge> block of the prompt."""
+    return (
+        f"<knowledge id=\"{idx}\" title=\"{title}\" url=\"{url}\">\n"
+        f"{text}\n"
+        f"</knowledge>"
+    )
+
+
+# ==========================================================
+# NEAR-DUPLICATE DETECTION
+# ==========================================================
+
+def _shingles(text: str) -> frozenset:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return frozenset(words)
+    return frozenset(
+        " ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)
+    )
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+
+# ==========================================================
+# PACKING
+# ==========================================================
+
+def pack_context(
+    entries: List[Dict],
+    max_tokens: Optional[int] = None,
+    dedup_threshold: Optional[float] = None
+) -> Tuple[List[Dict], Dict]:
+    """
+    Select the chunks that go into the prompt.
+
+    Args:
+        entries: Dicts with 'chunk_text', 'title', 'url' and optionally 'fused_score'
+        max_tokens: Token budget for all blocks (default: CONTEXT_MAX_TOKENS)
+        dedup_threshold: Jaccard similarity treated as duplicate (default: CONTEXT_DEDUP_THRESHOLD)
+
+    Returns:
+        (selected entries in score order, stats dict)
+    """
+    budget = max_tokens or settings.context.max_tokens
+    threshold = settings.context.dedup_threshold if dedup_threshold is None else dedup_threshold
+
+    ranked = sorted(entries, key=lambda e: -(e.get("fused_score") or 0.0))
+
+    selected = []
+    kept_hashes = set()
+    kept_shingles = []
+    stats = {
+        "candidates": len(ranked),
+        "selected": 0,
+        "duplicates": 0,
+        "over_budget": 0,
+        "truncated": 0,
+        "tokens_total": 0,
+        "tokens_used": 0,
+        "tokens_saved": 0,
+        "budget": budget,
+    }
+
+    for entry in ranked:
+        text = entry["chunk_text"]
+        # Block id is at most a few digits; "0" stands in for it when costing
+        cost = count_tokens(format_knowledge(0, entry["title"], entry["url"], text))
+        stats["tokens_total"] += cost
+
+        # --- Duplicates ---
+        text_hash = hashlib.md5(text.strip().lower().encode("utf-8")).hexdigest()
+        if text_hash in kept_hashes:
+            stats["duplicates"] += 1
+            continue
+        shingles = _shingles(text)
+        if threshold < 1.0 and any(_jaccard(shingles, other) >= threshold for other in kept_shingles):
+            stats["duplicates"] += 1
+            continue
+
+        # --- Budget ---
+        remaining = budget - stats["tokens_used"]
+        if cost > remaining:
+            if selected:
+                stats["over_budget"] += 1
+                continue
+            # Best chunk alone is too large: keep its beginning
+            overhead = cost - count_tokens(text)
+            entry = {**entry, "chunk_text": truncate_to_tokens(text, max(remaining - overhead, 0))}
+            cost = count_tokens(format_knowledge(0, entry["title"], entry["url"], entry["chunk_text"]))
+            stats["truncated"] += 1
+
+        selected.append(entry)
+        kept_hashes.add(text_hash)
+        kept_shingles.append(shingles)
+        stats["tokens_used"] += cost
+
+    stats["selected"] = len(selected)
+    stats["tokens_saved"] = stats["tokens_total"] - stats["tokens_used"]
+
+    span = current_span()
+    for key, value in stats.items():
+        span.set_attribute(f"context.{key}", value)
+
+    if stats["tokens_saved"] > 0:
+        print(f"[context] {stats['selected']}/{stats['candidates']} chunks, "
+              f"{stats['tokens_used']} tokens (saved {stats['tokens_saved']}: "
+              f"{stats['duplicates']} duplicates, {stats['over_budget']} over budget)")
+
+    return selected, stats
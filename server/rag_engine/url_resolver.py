@@ -0,0 +1,46 @@
+"""
+Citation URL resolver of the server process.
+
+The resolver itself lives in shared/url_resolver.py (also used by the digest
+CLI at ingest time); this module holds the server's instance, bound to
+rag_engine/global_hashes.json, and refresh_citations() behind
+POST /rag/api/citations/reload.
+
+shared/ is copied to /app/shared in the server image (see docker-compose.yml);
+when the server runs from a checkout it is found at the repository root.
+"""
+
+import sys
+from pathlib import Path
+from typing import Dict
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from shared.url_resolver import CitationResolver, backfill_citations  # noqa: E402
+
+
+DEFAULT_HASHES_PATH = Path(__file__).parent / "global_hashes.json"
+
+# Shared instance for the server process
+resolver = CitationResolver(DEFAULT_HASHES_PATH)
+
+
+def refresh_citations(qdrant_client, collections: Dict[str, dict]) -> Dict:
+    """
+    Re-read global_hashes.json and rewrite the stored citations that changed.
+
+    Points store their citation at ingest time and it wins at query time, so
+    reloading the mapping alone would only affect legacy points.
+
+    Returns:
+        {"entries": mapping size, "updated": {collection name: points updated}}
+    """
+    entries = resolver.reload()
+    updated = {}
+    if qdrant_client is not None:
+        for name, pair in collections.items():
+            try:
+                updated[name] = backfill_citations(qdrant_client, pair["qdrant_collection"], resolver)
+            except Exception as e:
+                print(f"[WARNING] Citation backfill failed for collection '{name}': {e}")
+                updated[name] = None
+    return {"entries": entries, "updated": updated}
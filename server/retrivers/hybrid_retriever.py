@@ -15,6 +15,7 @@ from pathlib import Path
 # To enable imports from sibling directories, we add the parent directory to sys.path.
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from app.core.settings import settings
+from app.core.tracing import tracer, traced
 
 # ==========================================================
 # CONFIG
@@ -50,6 +51,7 @@ _nlp = spacy.load(settings.SPACY_MODEL)
 # Hybrid weights
 BM25_WEIGHT = settings.BM25_WEIGHT
 VECTOR_WEIGHT = settings.VECTOR_WEIGHT
+RRF_K = settings.RRF_K
 
 TOP_K = settings.RETRIEVER_TOP_K
 FINAL_K = settings.RETRIEVER_FINAL_K
@@ -89,6 +91,7 @@ def normalize_and_lemmatize(text: str) -> str:
 # EMBEDDING (Qdrant)
 # ==========================================================
 
+@traced("retriever.embed")
 def _embed(text: str):
     resp = session.post(
         f"{settings.OLLAMA_BASE_URL}/api/embeddings",
@@ -112,23 +115,26 @@ def bm25_search(query: str, es_index: str, top_k=TOP_K):
         return []  # Graceful degradation: return empty results if ES unavailable
 
     try:
-        query_lem = normalize_and_lemmatize(query)
-
-        resp = es.search(
-            index=es_index,
-            size=top_k,
-            query={"match": {"text": query_lem}},
-            stored_fields=["doc_id"]
-        )
-
-        results = []
-        for hit in resp["hits"]["hits"]:
-            results.append({
-                "id": hit["fields"]["doc_id"][0],
-                "score": hit["_score"],
-                "method": "bm25"
-            })
-        return results
+        with tracer.span("retriever.bm25", index=es_index, top_k=top_k) as span:
+            with tracer.span("retriever.lemmatize"):
+                query_lem = normalize_and_lemmatize(query)
+
+            resp = es.search(
+                index=es_index,
+                size=top_k,
+                query={"match": {"text": query_lem}},
+                stored_fields=["doc_id"]
+            )
+
+            results = []
+            for hit in resp["hits"]["hits"]:
+                results.append({
+                    "id": hit["fields"]["doc_id"][0],
+                    "score": hit["_score"],
+                    "method": "bm25"
+                })
+            span.set_attribute("hits", len(results))
+            return results
     except Exception as e:
         print(f"[WARNING] BM25 search failed: {e}")
         return []  # Graceful degradation on search error
@@ -148,65 +154,69 @@ def vector_search(query: str, qdrant_collection: str, top_k=TOP_K):
         return []  # Graceful degradation: return empty results if Qdrant unavailable
 
     try:
-        vec = _embed(query)
-
-        res = qdrant.query_points(
-            collection_name=qdrant_collection,
-            query=vec,
-            limit=top_k,
-            with_payload=True,
-            with_vectors=False
-        )
-
-        results = []
-        for pt in res.points:
-            results.append({
-                "id": pt.id,
-                "score": pt.score,
-                "chunk_text": pt.payload.get("chunk_text", ""),
-                "hash": pt.payload.get("hash"),
-                "metadata": pt.payload.get("metadata"),
-                "method": "vector"
-            })
-        return results
+        with tracer.span("retriever.vector", collection=qdrant_collection, top_k=top_k) as span:
+            vec = _embed(query)
+
+            res = qdrant.query_points(
+                collection_name=qdrant_collection,
+                query=vec,
+                limit=top_k,
+                with_payload=True,
+                with_vectors=False
+            )
+
+            results = []
+            for pt in res.points:
+                results.append({
+                    "id": pt.id,
+                    "score": pt.score,
+                    "chunk_text": pt.payload.get("chunk_text", ""),
+                    "hash": pt.payload.get("hash"),
+                    "metadata": pt.payload.get("metadata"),
+                    "citation": pt.payload.get("citation"),
+                    "method": "vector"
+                })
+            span.set_attribute("hits", len(results))
+            return results
     except Exception as e:
         print(f"[WARNING] Vector search failed: {e}")
         return []  # Graceful degradation on search error
 
 
 # ==========================================================
-# FETCH CHUNK FROM QDRANT
+# FETCH CHUNKS FROM QDRANT
 # ==========================================================
 
-def fetch_chunk(point_id: str, qdrant_collection: str):
+def fetch_chunks(point_ids: List, qdrant_collection: str) -> Dict:
     """
-    Fetch a single chunk from Qdrant by ID.
+    Fetch several chunks from Qdrant in a single request.
 
-    Returns None if Qdrant is unavailable or chunk not found (graceful degradation).
+    Returns {point_id: chunk}; ids that are missing (or all of them, if
+    Qdrant is unavailable) are simply absent from the result.
     """
-    if qdrant is None:
-        return None  # Graceful degradation: return None if Qdrant unavailable
+    if qdrant is None or not point_ids:
+        return {}
 
     try:
         res = qdrant.retrieve(
             collection_name=qdrant_collection,
-            ids=[point_id],
+            ids=list(point_ids),
             with_payload=True,
             with_vectors=False
         )
-        if not res:
-            return None
-
-        pt = res[0]
         return {
-            "id": pt.id,
-            "chunk_text": pt.payload.get("chunk_text", ""),
-            "hash": pt.payload.get("hash"),
-            "metadata": pt.payload.get("metadata")
+            pt.id: {
+                "id": pt.id,
+                "chunk_text": pt.payload.get("chunk_text", ""),
+                "hash": pt.payload.get("hash"),
+                "metadata": pt.payload.get("metadata"),
+                "citation": pt.payload.get("citation")
+            }
+            for pt in res
         }
     except Exception as e:
-        print(f"[WARNING] Failed to fetch chunk {point_id}: {e}")
-        return None
+        print(f"[WARNING] Failed to fetch {len(point_ids)} chunks: {e}")
+        return {}
 
 
 # ==========================================================
@@ -222,7 +232,7 @@ def fetch_chunk(point_id: str, qdrant_collection: str):
 #
 # Where:
 #   - rank_i is the 0-indexed position of the document in method i's results
-#   - k is a smoothing constant (we use k=60, the standard from literature)
+#   - k is a smoothing constant (RRF_K, default 60, the standard from literature)
 #
 # Why k=60?
 # ---------
@@ -237,13 +247,13 @@ def fetch_chunk(point_id: str, qdrant_collection: str):
 #
 # ==========================================================
 
-def hybrid_re_rank(bm25_res, vec_res, final_k):
+def hybrid_re_rank(bm25_res, vec_res, final_k, bm25_weight=None, vector_weight=None, rrf_k=None):
     """
     Combine BM25 + vector results using Reciprocal Rank Fusion (RRF).
 
     The algorithm:
     1. Sort each result set by their native scores (descending)
-    2. Assign RRF scores based on rank: score = 1/(k + rank), where k=60
+    2. Assign RRF scores based on rank: score = 1/(k + rank), where k=RRF_K
     3. Combine RRF scores using weighted average (BM25_WEIGHT + VECTOR_WEIGHT)
     4. Return top final_k documents by fused score
 
@@ -251,13 +261,18 @@ def hybrid_re_rank(bm25_res, vec_res, final_k):
         bm25_res: List of dicts with 'id' and 'score' from BM25 search
         vec_res: List of dicts with 'id' and 'score' from vector search
         final_k: Number of results to return
+        bm25_weight: Override for BM25_WEIGHT (parameter sweeps)
+        vector_weight: Override for VECTOR_WEIGHT (parameter sweeps)
+        rrf_k: Override for RRF_K (parameter sweeps)
 
     Returns:
         List of (doc_id, fused_score) tuples, sorted by fused_score descending
     """
-    # k=60: RRF smoothing constant (Cormack et al., 2009)
+    # RRF smoothing constant (Cormack et al., 2009)
     # Higher k = more weight to lower-ranked documents
-    RRF_K = 60
+    k = RRF_K if rrf_k is None else rrf_k
+    w_bm25 = BM25_WEIGHT if bm25_weight is None else bm25_weight
+    w_vec = VECTOR_WEIGHT if vector_weight is None else vector_weight
 
     scores = {}  # {doc_id: {"bm25": float, "vec": float}}
 
@@ -267,7 +282,7 @@ def hybrid_re_rank(bm25_res, vec_res, final_k):
     for rank, item in enumerate(bm25_sorted):
         doc_id = item["id"]
         scores.setdefault(doc_id, {"bm25": 0, "vec": 0})
-        scores[doc_id]["bm25"] = 1 / (rank + RRF_K)  # RRF formula
+        scores[doc_id]["bm25"] = 1 / (rank + k)  # RRF formula
 
     # --- Vector RRF scoring ---
     # Sort by native vector similarity score, then assign RRF score based on rank
@@ -275,13 +290,13 @@ def hybrid_re_rank(bm25_res, vec_res, final_k):
     for rank, item in enumerate(vec_sorted):
         doc_id = item["id"]
         scores.setdefault(doc_id, {"bm25": 0, "vec": 0})
-        scores[doc_id]["vec"] = 1 / (rank + RRF_K)  # RRF formula
+        scores[doc_id]["vec"] = 1 / (rank + k)  # RRF formula
 
     # --- Weighted merge ---
     # Combine the two RRF scores using configurable weights
     fused = []
     for doc_id, s in scores.items():
-        fused_score = BM25_WEIGHT * s["bm25"] + VECTOR_WEIGHT * s["vec"]
+        fused_score = w_bm25 * s["bm25"] + w_vec * s["vec"]
         fused.append((doc_id, fused_score))
 
     # --- Sort & return final_k ---
@@ -294,31 +309,59 @@ def hybrid_re_rank(bm25_res, vec_res, final_k):
 # PUBLIC API — THE ONLY FUNCTION THE USER CALLS
 # ==========================================================
 
-def retrieve(prompt: str, qdrant_collection: str, es_index: str, top_k: int = 5):
+def retrieve(prompt: str, qdrant_collection: str, es_index: str,
+             top_k: int = None, candidate_k: int = None):
     """
     Full hybrid pipeline:
-    - top_k BM25 candidates
-    - top_k vector candidates
-    - Fuse and return top_k final results
-    """
-    # 1. BM25
-    bm25_results = bm25_search(prompt, es_index=es_index, top_k=top_k)
-
-    # 2. Vector
-    vector_results = vector_search(prompt, qdrant_collection=qdrant_collection, top_k=top_k)
-
-    # 3. Fusion
-    fused = hybrid_re_rank(bm25_results, vector_results, final_k=top_k)
+    - candidate_k BM25 candidates
+    - candidate_k vector candidates
+    - Fuse and return the top_k best results
 
-    # 4. Fetch chunks from Qdrant
-    output = []
-    for doc_id, fused_score in fused:
-        chunk = fetch_chunk(doc_id, qdrant_collection=qdrant_collection)
-        if chunk:
-            chunk["fused_score"] = fused_score
-            output.append(chunk)
+    Candidates are cheap (ids + scores); only the top_k fused results are
+    hydrated and end up in the prompt, so candidate_k can be wide while
+    top_k stays small.
 
-    # Sort again by fused score just to be clean
-    output = sorted(output, key=lambda x: -x["fused_score"])
-
-    return output
+    Args:
+        top_k: Number of chunks returned (default: RETRIEVER_FINAL_K)
+        candidate_k: Depth of each search (default: RETRIEVER_TOP_K, never below top_k)
+    """
+    top_k = top_k or FINAL_K
+    candidate_k = max(candidate_k or TOP_K, top_k)
+
+    with tracer.span("retriever.retrieve", collection=qdrant_collection,
+                     top_k=top_k, candidate_k=candidate_k) as span:
+        # 1. BM25
+        bm25_results = bm25_search(prompt, es_index=es_index, top_k=candidate_k)
+
+        # 2. Vector
+        vector_results = vector_search(prompt, qdrant_collection=qdrant_collection, top_k=candidate_k)
+
+        # 3. Fusion
+        fused = hybrid_re_rank(bm25_results, vector_results, final_k=top_k)
+
+        # 4. Hydrate chunks: vector hits already carry their payload,
+        #    the remaining (BM25-only) ids are fetched in one request
+        known = {r["id"]: r for r in vector_results}
+        missing = [doc_id for doc_id, _ in fused if doc_id not in known]
+        with tracer.span("retriever.fetch", count=len(missing)):
+            fetched = fetch_chunks(missing, qdrant_collection=qdrant_collection)
+
+        output = []
+        for doc_id, fused_score in fused:
+            hit = known.get(doc_id) or fetched.get(doc_id)
+            if hit:
+                chunk = {
+                    "id": hit["id"],
+                    "chunk_text": hit["chunk_text"],
+                    "hash": hit["hash"],
+                    "metadata": hit["metadata"],
+                    "citation": hit.get("citation"),
+                    "fused_score": fused_score
+                }
+                output.append(chunk)
+
+        # Sort again by fused score just to be clean
+        output = sorted(output, key=lambda x: -x["fused_score"])
+        span.set_attribute("results", len(output))
+
+        return output
@@ -0,0 +1 @@
+"""Code shared by the server and the digest CLI (standard library only)."""
@@ -0,0 +1,186 @@
+"""
+Citation URL Resolver
+=====================
+
+Single place that turns chunk metadata into a citation (title + link).
+It is shared by the server (rag_engine, course_build_agents) and by the digest
+CLI, which stores the resolved citation in the Qdrant payload at ingest time:
+
+    payload = {
+        "chunk_text": ...,
+        "metadata": {...},
+        "citation": {"title": ..., "hash": <fileserver hash or null>, "url": <fallback url>}
+    }
+
+At query time the link is then a field read: `{FILESERVER_PUBLIC_URL}/download/{hash}`
+when the source is served by the fileserver, the original URL otherwise. The
+public fileserver URL is deliberately NOT stored, so it can change per
+deployment without re-ingesting.
+
+Resolution rules (unchanged from the original per-module logic):
+    1. source_url listed in global_hashes.json  -> fileserver hash
+    2. metadata["hash"] (digest CLI collections) -> fileserver hash
+    3. otherwise the source_url itself ('.pdf' stripped for display)
+
+Points ingested before citations existed have no "citation" field; they are
+resolved on the fly from their metadata. global_hashes.json is re-read when
+its mtime changes (checked at most every `check_interval` seconds), or on an
+explicit reload().
+
+The stored citation wins over the mapping at query time, so a mapping change
+reaches stored points through backfill_citations(), which rewrites the
+payload of the points whose citation changed. It is run by the digest
+`backfill-citations` command and by the server's POST /rag/api/citations/reload.
+
+This module only depends on the standard library (the Qdrant client is passed
+in), so the server and the digest CLI both import it.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+DEFAULT_TITLE = "Document sans titre"
+
+
+class CitationResolver:
+    """Resolves chunk metadata to citations using the global_hashes.json mapping."""
+
+    def __init__(self, hashes_path, check_interval: float = 5.0):
+        self.hashes_path = Path(hashes_path)
+        self.check_interval = check_interval
+        self._hashes: Dict[str, str] = {}
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    # ------------------------------------------------------------------
+    # Mapping
+    # ------------------------------------------------------------------
+
+    def reload(self) -> int:
+        """Re-read the mapping from disk. Returns the number of entries."""
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(self.hashes_path)
+                with open(self.hashes_path, "r", encoding="utf-8") as f:
+                    hashes = json.load(f)
+                self._hashes = hashes  # atomic swap: readers see old or new dict
+                self._mtime = mtime
+            except FileNotFoundError:
+                self._hashes = {}
+                self._mtime = None
+            except Exception as e:
+                print(f"[WARNING] Failed to load {self.hashes_path}: {e} (keeping previous mapping)")
+            self._last_check = time.monotonic()
+            return len(self._hashes)
+
+    def maybe_reload(self):
+        """Reload if the mapping file changed since the last load (rate-limited)."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.path.getmtime(self.hashes_path)
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            count = self.reload()
+            print(f"[citations] Reloaded mapping ({count} entries)")
+
+    @property
+    def size(self) -> int:
+        return len(self._hashes)
+
+    # ------------------------------------------------------------------
+    # Resolution
+    # ------------------------------------------------------------------
+
+    def citation(self, metadata: Optional[dict]) -> Dict[str, Optional[str]]:
+        """Build the citation stored in the payload from chunk metadata."""
+        metadata = metadata or {}
+        source_url = metadata.get("source_url") or ""
+        file_hash = self._hashes.get(source_url) or metadata.get("hash") or None
+
+        url = source_url
+        if file_hash is None and source_url.lower().endswith(".pdf"):
+            url = source_url[:-4]  # Remove .pdf for cleaner display if no hash
+
+        return {
+            "title": metadata.get("title") or DEFAULT_TITLE,
+            "hash": file_hash,
+            "url": url,
+        }
+
+    def resolve(self, result: dict, fileserver_base: str) -> Tuple[str, str]:
+        """Return (url, title) for a retrieved chunk, preferring its stored citation."""
+        citation = result.get("citation")
+        if not citation:
+            self.maybe_reload()
+            citation = self.citation(result.get("metadata"))
+        return citation_link(citation, fileserver_base), citation.get("title") or DEFAULT_TITLE
+
+
+def citation_link(citation: dict, fileserver_base: str) -> str:
+    """Browser link for a citation."""
+    if citation.get("hash"):
+        return f"{fileserver_base}/download/{citation['hash']}"
+    return citation.get("url") or ""
+
+
+def backfill_citations(client, collection_name: str, resolver: CitationResolver,
+                       scroll_size: int = 2000, batch_size: int = 1000) -> int:
+    """
+    Write (or refresh) the 'citation' payload field of every point.
+
+    Points are grouped by their resolved citation so each distinct citation
+    costs one set_payload call per `batch_size` points. Points already up to
+    date are left untouched.
+
+    Args:
+        client: QdrantClient
+        collection_name: Qdrant collection
+        resolver: Resolver holding the current mapping
+
+    Returns:
+        Number of points updated.
+    """
+    groups = {}  # citation json -> [point ids]
+    total = 0
+    offset = None
+
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=scroll_size,
+            offset=offset,
+            with_payload=["metadata", "citation"],
+            with_vectors=False,
+        )
+        for p in points:
+            payload = p.payload or {}
+            citation = resolver.citation(payload.get("metadata"))
+            if payload.get("citation") != citation:
+                key = json.dumps(citation, sort_keys=True, ensure_ascii=False)
+                groups.setdefault(key, []).append(p.id)
+        total += len(points)
+        if offset is None:
+            break
+
+    updated = 0
+    for key, ids in groups.items():
+        citation = json.loads(key)
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i : i + batch_size]
+            client.set_payload(collection_name=collection_name, payload={"citation": citation}, points=batch)
+            updated += len(batch)
+
+    print(f"[citations] {collection_name}: scanned {total} points, updated {updated} "
+          f"({len(groups)} distinct citations)")
+    return updated